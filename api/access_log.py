@@ -0,0 +1,83 @@
+"""
+Структурированный access log: одна JSON-строка на запрос.
+
+Запись идет через QueueHandler, форматирование и вывод - в отдельном потоке
+QueueListener, поэтому обработчик запроса не ждет stdout.
+Ошибки (5xx) и медленные запросы пишутся всегда, остальные - с вероятностью ACCESS_LOG_SAMPLE_RATE.
+"""
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+import json
+import logging
+import queue
+import random
+import sys
+import time
+
+from bot.config import settings
+
+access_logger = logging.getLogger("cveti.access")
+access_logger.setLevel(logging.INFO)
+access_logger.propagate = False
+
+_listener: Optional[QueueListener] = None
+
+
+def start_access_log() -> None:
+    """Подключает неблокирующий вывод access log (вызывается при старте приложения)"""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+    access_logger.addHandler(QueueHandler(log_queue))
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+
+def stop_access_log() -> None:
+    """Дописывает очередь и останавливает поток вывода"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    for handler in list(access_logger.handlers):
+        if isinstance(handler, QueueHandler):
+            access_logger.removeHandler(handler)
+
+
+def should_log(status_code: int, duration_ms: float) -> bool:
+    if status_code >= 500 or duration_ms >= settings.ACCESS_LOG_SLOW_MS:
+        return True
+    rate = settings.ACCESS_LOG_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def log_access(
+    method: str,
+    path: str,
+    route: str,
+    status_code: int,
+    duration_ms: float,
+    client: Optional[str] = None,
+    upstream_calls: Optional[Dict[str, int]] = None,
+    trace_id: Optional[str] = None,
+) -> None:
+    """Пишет строку access log, если запрос проходит по семплированию"""
+    if not access_logger.handlers or not should_log(status_code, duration_ms):
+        return
+    record: Dict[str, Any] = {
+        "ts": round(time.time(), 3),
+        "method": method,
+        "path": path,
+        "route": route,
+        "status": status_code,
+        "duration_ms": round(duration_ms, 2),
+        "slow": duration_ms >= settings.ACCESS_LOG_SLOW_MS,
+        "client": client,
+        "upstream_calls": upstream_calls or {},
+        "trace_id": trace_id,
+    }
+    access_logger.info(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
@@ -1,25 +1,38 @@
 # КРИТИЧНО: Применяем патчи для Python 3.14 ДО ЛЮБЫХ импортов FastAPI/Pydantic
 import bot.patches  # noqa: F401
 
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import webhooks, app as app_routes, admin as admin_routes, settings as settings_routes
 from bot.services.supabase_client import get_supabase
 from bot.config import settings
 from aiogram import Bot
+from bot.dispatcher import create_bot, dp
 from datetime import datetime
-from bot.tasks.sync import run_periodic_sync
+from bot.tasks.schedule import register_jobs
+from bot.services.metrics import metrics, start_call_budget, finish_call_budget
+from bot.services.tracing import start_trace, finish_trace
+from api.access_log import log_access, start_access_log, stop_access_log
+from api.responses import FastJSONResponse
+from api.static_assets import StaticAssetStore
+from bot.services.images import shutdown_pool as shutdown_image_pool
+from bot.services.update_queue import update_queue
+from bot.services.scheduler import scheduler
+from bot.services.jobs import telegram_updates_in_worker, worker_mode
+from bot.services.cache_versions import run_cache_version_watcher
+from bot.services.storage import get_storage_service
 import os
 import logging
 import asyncio
+import secrets
+import time
 from urllib.parse import urlparse
 logger = logging.getLogger(__name__)
 
 
 
-app = FastAPI(title="Cosmetology Loyalty API")
+app = FastAPI(title="Cosmetology Loyalty API", default_response_class=FastJSONResponse)
 
 def _normalize_origin(url: str) -> str:
     if not url:
@@ -54,116 +67,99 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
-# Middleware для логирования запросов
-SENSITIVE_HEADERS = {
-    "authorization",
-    "apikey",
-    "x-api-key",
-    "x-webhook-secret",
-    "x-telegram-bot-api-secret-token",
-    "x-tg-init-data",
-    "cookie",
-    "set-cookie",
-}
-
-def _redact_headers(headers: dict) -> dict:
-    redacted = {}
-    for key, value in headers.items():
-        lower = key.lower()
-        if lower in SENSITIVE_HEADERS:
-            redacted[key] = "***"
-        else:
-            if isinstance(value, str) and len(value) > 200:
-                redacted[key] = f"{value[:200]}..."
-            else:
-                redacted[key] = value
-    return redacted
-
+# Middleware: метрики, трассировка и access log (одна JSON-строка на запрос, см. api/access_log.py)
 @app.middleware("http")
 async def log_requests(request, call_next):
-    # Логируем детальную информацию о запросе
-    origin = request.headers.get("origin", "no-origin")
-    user_agent = request.headers.get("user-agent", "no-ua")
-    referer = request.headers.get("referer", "no-referer")
-    client_host = request.client.host if request.client else "unknown"
-    
-    logger.info(f"Request: {request.method} {request.url.path}")
-    logger.info(f"  From: {client_host}")
-    logger.info(f"  Origin: {origin}")
-    logger.info(f"  User-Agent: {user_agent[:100] if len(user_agent) > 100 else user_agent}")
-    logger.info(f"  Referer: {referer}")
-    logger.info(f"  Headers: {_redact_headers(dict(request.headers))}")
-    
-    response = await call_next(request)
+    budget_token = start_call_budget()
+    trace_token = start_trace(f"{request.method} {request.url.path}", path=request.url.path)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        duration = time.perf_counter() - started
+        calls = finish_call_budget(budget_token)
+        # Шаблон маршрута (/api/admin/users/{user_id}), а не сырой путь - иначе метрики разрастаются
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "<unmatched>"
+        metrics.record_http(request.method, route_path, status_code, duration)
+        trace = finish_trace(
+            trace_token,
+            name=f"{request.method} {route_path}",
+            error=status_code >= 500,
+            status_code=status_code,
+            upstream_calls=sum(calls.values()),
+        )
+        total_calls = sum(calls.values())
+        log_access(
+            request.method,
+            request.url.path,
+            route_path,
+            status_code,
+            duration * 1000,
+            client=request.client.host if request.client else None,
+            upstream_calls=dict(calls),
+            trace_id=trace.trace_id if trace is not None else None,
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Upstream calls for {request.method} {route_path}: {total_calls} {dict(calls)} in {duration * 1000:.1f} ms"
+            )
+        if settings.UPSTREAM_CALL_BUDGET and total_calls > settings.UPSTREAM_CALL_BUDGET:
+            logger.warning(
+                f"Upstream call budget exceeded for {request.method} {route_path}: "
+                f"{total_calls} > {settings.UPSTREAM_CALL_BUDGET} {dict(calls)}"
+            )
     
-    logger.info(f"Response: {response.status_code} for {request.url.path}")
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.trace_id
     return response
 
 # Раздача статических файлов для Mini App (РЕГИСТРИРУЕМ ПЕРВЫМ!)
-webapp_path = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), "webapp"))
+# Ассеты хранятся в памяти: хэшированные имена, gzip/brotli, ETag (см. api/static_assets.py)
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+webapp_path = os.path.join(project_root, "webapp")
+webapp_assets = StaticAssetStore(project_root)
 
 if os.path.exists(webapp_path):
     # Регистрируем маршруты для webapp ПЕРЕД другими маршрутами
     @app.get("/webapp")
     @app.get("/webapp/")
-    async def webapp_index():
+    async def webapp_index(request: Request):
         """Главная страница Mini App"""
-        logger.info(f"WebApp request received. Path: {webapp_path}")
-        index_path = os.path.join(webapp_path, "index.html")
-        logger.info(f"Index path exists: {os.path.exists(index_path)}, path: {index_path}")
-        if os.path.exists(index_path):
-            logger.info("Returning index.html")
-            return FileResponse(index_path, media_type="text/html")
-        logger.error(f"WebApp index.html not found at {index_path}")
-        return {"error": "WebApp index.html not found", "path": webapp_path}
-    
-    @app.get("/webapp/styles.css")
-    async def webapp_css():
-        css_path = os.path.join(webapp_path, "styles.css")
-        if os.path.exists(css_path):
-            return FileResponse(css_path, media_type="text/css")
-        return {"error": "CSS not found"}
+        return webapp_assets.response(request, "index.html")
     
     @app.get("/webapp/script.js")
-    async def webapp_js():
-        js_path = os.path.join(webapp_path, "script.js")
-        if os.path.exists(js_path):
-            return FileResponse(js_path, media_type="application/javascript")
-        return {"error": "JS not found"}
+    async def webapp_js(request: Request):
+        """Нехэшированный путь для HTML, закэшированного до перехода на хэши"""
+        return webapp_assets.response(request, "/webapp/script.js")
     
-    # Монтируем статические файлы для остальных ресурсов
-    app.mount("/webapp/assets", StaticFiles(directory=webapp_path), name="webapp-assets")
+    @app.get("/webapp/assets/{file_name}")
+    async def webapp_asset(file_name: str, request: Request):
+        """Хэшированные ассеты (script.<hash>.js, cveti.<hash>.png), кэшируются навсегда"""
+        return webapp_assets.response(request, f"/webapp/assets/{file_name}")
     
     # Раздача логотипа
     @app.get("/webapp/cveti.png")
-    async def webapp_logo():
+    async def webapp_logo(request: Request):
         """Логотип студии"""
-        logo_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cveti.png")
-        if os.path.exists(logo_path):
-            return FileResponse(logo_path, media_type="image/png")
-        return {"error": "Logo not found"}
+        return webapp_assets.response(request, "/webapp/cveti.png")
     
     # Обработка favicon.ico (чтобы не было 404)
     @app.get("/favicon.ico")
-    async def favicon():
+    async def favicon(request: Request):
         """Favicon для браузера"""
-        logo_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cveti.png")
-        if os.path.exists(logo_path):
-            return FileResponse(logo_path, media_type="image/png")
+        if webapp_assets.get("/webapp/cveti.png") is not None:
+            return webapp_assets.response(request, "/webapp/cveti.png")
         # Возвращаем пустой ответ вместо 404
-        from fastapi.responses import Response
         return Response(status_code=204)
     
     # Страница регистрации для YCLIENTS
     @app.get("/yclients/register")
-    async def yclients_register():
+    async def yclients_register(request: Request):
         """Страница регистрации для YCLIENTS интеграции"""
-        register_path = os.path.join(webapp_path, "register.html")
-        if os.path.exists(register_path):
-            logger.info("Returning registration page")
-            return FileResponse(register_path, media_type="text/html")
-        logger.error(f"Registration page not found at {register_path}")
-        return {"error": "Registration page not found", "path": register_path}
+        return webapp_assets.response(request, "register.html")
 
 # Подключаем маршруты API (после webapp)
 app.include_router(webhooks.router)
@@ -172,10 +168,9 @@ app.include_router(admin_routes.router)
 app.include_router(settings_routes.router)
 
 @app.get("/")
-async def root():
-    index_path = os.path.join(webapp_path, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path, media_type="text/html")
+async def root(request: Request):
+    if webapp_assets.get("index.html") is not None:
+        return webapp_assets.response(request, "index.html")
     return {"message": "API is running", "version": "1.0.0"}
 
 @app.get("/health")
@@ -197,42 +192,66 @@ async def health():
         "version": "1.0.0"
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(request: Request):
+    """Метрики в формате Prometheus: внешние вызовы (YClients, Supabase) и входящие запросы"""
+    if settings.METRICS_TOKEN:
+        auth_header = request.headers.get("authorization", "")
+        if not secrets.compare_digest(auth_header, f"Bearer {settings.METRICS_TOKEN}"):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+    elif not settings.METRICS_PUBLIC:
+        # Без токена метрики (маршруты, внешние вызовы, очереди) не отдаем
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(
+        metrics.render_prometheus(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
 # Глобальный Bot экземпляр для рассылок и уведомлений
 _broadcast_bot: Bot = None
 
-async def check_scheduled_broadcasts_periodically():
-    """Периодически проверяет запланированные рассылки"""
-    while True:
-        try:
-            await admin_routes.check_scheduled_broadcasts()
-        except Exception as e:
-            logger.error(f"Error in scheduled broadcasts check: {e}", exc_info=True)
-        # Проверяем каждые 60 секунд
-        await asyncio.sleep(60)
+# Фоновые циклы процесса (отменяются при остановке, чтобы освободить аренды)
+_background_tasks: list[asyncio.Task] = []
 
 @app.on_event("startup")
 async def startup_event():
     """Инициализация при запуске приложения"""
     
     global _broadcast_bot
+    start_access_log()
     try:
         # Создаем Bot экземпляр для рассылок
-        _broadcast_bot = Bot(token=settings.BOT_TOKEN)
+        _broadcast_bot = create_bot()
         # Устанавливаем Bot в модулях
         admin_routes.set_broadcast_bot(_broadcast_bot)
         webhooks.set_notification_bot(_broadcast_bot)
         logger.info("Broadcast bot initialized")
-        
-        # Запускаем периодическую проверку запланированных рассылок
-        asyncio.create_task(check_scheduled_broadcasts_periodically())
-        logger.info("Scheduled broadcasts checker started")
-        
-        # Запускаем периодическую синхронизацию с YClients
-        asyncio.create_task(run_periodic_sync())
-        logger.info("Periodic YClients sync task started")
+
+        if not telegram_updates_in_worker():
+            # Воркеры обновлений Telegram: webhook только ставит обновление в очередь
+            update_queue.start(dp, _broadcast_bot)
+
+        if worker_mode():
+            # Фоновые задачи выполняет процесс python -m bot.worker
+            logger.info("BACKGROUND_MODE=worker: background jobs are handled by bot.worker")
+        else:
+            # Периодические задачи по расписанию: синхронизация с YClients, сгорание баллов,
+            # запланированные рассылки (выполняет владелец аренды "scheduler")
+            register_jobs(scheduler)
+            _background_tasks.append(asyncio.create_task(scheduler.run()))
+
+        # Сброс локальных кэшей (настройки, меню, каталог) при изменениях на других воркерах
+        _background_tasks.append(asyncio.create_task(run_cache_version_watcher()))
         
     except Exception as e:
         logger.error(f"Error initializing broadcast bot: {e}", exc_info=True)
+
+    try:
+        # Долгоживущий S3 клиент: загрузки не создают сессию и клиент на каждый файл
+        await get_storage_service().start()
+        logger.info("Storage clients started")
+    except Exception as e:
+        logger.error(f"Error starting storage clients: {e}", exc_info=True)
         
 
 @app.on_event("shutdown")
@@ -240,6 +259,18 @@ async def shutdown_event():
     """Закрываем соединения при завершении приложения"""
     
     global _broadcast_bot
+    # Останавливаем фоновые циклы: аренды задач освобождаются для других экземпляров
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+    try:
+        # Дообрабатываем принятые обновления, пока сессия бота открыта
+        await update_queue.stop()
+    except Exception as e:
+        logger.error(f"Error stopping Telegram update queue: {e}")
+
     try:
         # Закрываем Bot экземпляр
         if _broadcast_bot:
@@ -257,4 +288,12 @@ async def shutdown_event():
         
     except Exception as e:
         logger.error(f"Error closing Supabase client: {e}")
+    
+    try:
+        await get_storage_service().close()
+    except Exception as e:
+        logger.error(f"Error closing storage clients: {e}")
+    
+    shutdown_image_pool()
+    stop_access_log()
         
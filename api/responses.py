@@ -0,0 +1,19 @@
+"""
+Класс ответа API с быстрой сериализацией (bot/services/fast_json.py).
+"""
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from bot.services import fast_json
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse через orjson (или stdlib json без него).
+    Используется как ответ по умолчанию; обработчики с большими выборками из PostgREST
+    возвращают его напрямую, чтобы пропустить jsonable_encoder - данные уже JSON-совместимы.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return fast_json.dumps(content)
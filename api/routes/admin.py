@@ -5,8 +5,15 @@ from bot.services.notifications import send_broadcast_message
 from bot.services.storage import get_storage_service, rewrite_storage_public_url
 from bot.services.loyalty import apply_yclients_manual_transaction, get_user_available_balance, sync_user_with_yclients
 from bot.services.settings import get_setting
+from bot.services.tracing import recent_slow_traces, get_slow_trace
+from bot.services.images import attach_image_variants, create_image_variants
+from bot.services.segments import SegmentError, count_segment, parse_segment, segment_from_broadcast, select_segment_tg_ids
+from bot.services.jobs import JOB_BROADCAST, enqueue_job, worker_mode
+from bot.services.leader import INSTANCE_ID
+from bot.services.scheduler import SCHEDULER_LEASE, scheduler
 from bot.config import settings
-from typing import Optional, List, Dict, Any
+from api.responses import FastJSONResponse
+from typing import Optional, Dict, Any
 from aiogram import Bot
 import logging
 import json
@@ -15,26 +22,60 @@ from datetime import datetime
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 logger = logging.getLogger(__name__)
-def _coerce_order(value):
+# Колонки сводки визитов в списке пользователей
+USER_LIST_STATS_COLUMNS = "visit_count,total_spent,last_visit_at,top_master"
+
+# Таблицы, порядок которых меняется через reorder_items/set_items_order (миграция 022)
+ORDERABLE_TABLES = {"masters": "Master", "services": "Service", "promotions": "Promotion"}
+
+def _parse_item_id(item_id: Any) -> int:
     try:
-        return int(value)
+        return int(item_id)
     except (TypeError, ValueError):
-        return None
+        raise HTTPException(status_code=400, detail=f"Invalid id: {item_id}")
 
-async def _normalize_orders(table_name: str, items: List[Dict[str, Any]]):
-    if not items:
-        return
-    def _sort_key(item: Dict[str, Any]):
-        order_val = _coerce_order(item.get("order"))
-        if order_val is None:
-            order_val = 10**12
-        return (order_val, str(item.get("id")))
-    sorted_items = sorted(items, key=_sort_key)
-    for idx, item in enumerate(sorted_items):
-        item_id = item.get("id")
-        if not item_id:
-            continue
-        await supabase.table(table_name).update({"order": idx}).eq("id", item_id).execute()
+async def _move_item(table_name: str, item_id: str, direction: str):
+    """Сдвиг на одну позицию одним RPC (в одной транзакции на стороне БД)"""
+    try:
+        res = await supabase.rpc("reorder_items", {
+            "p_table": table_name,
+            "p_id": _parse_item_id(item_id),
+            "p_direction": direction
+        }).execute()
+        result = res.data or {}
+        if result.get("status") == "not_found":
+            raise HTTPException(status_code=404, detail=f"{ORDERABLE_TABLES[table_name]} not found")
+        if result.get("status") == "edge":
+            return {"status": "ok", "message": "Already at edge"}
+        return {"status": "ok"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error moving {table_name} item {item_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+async def _set_items_order(table_name: str, payload: Dict[str, Any]):
+    """Порядок списком id одним RPC; не перечисленные элементы остаются после них"""
+    ids = payload.get("ids") if isinstance(payload, dict) else None
+    if not isinstance(ids, list) or not ids:
+        raise HTTPException(status_code=400, detail="Ids list is required")
+    parsed_ids = [_parse_item_id(item_id) for item_id in ids]
+    if len(set(parsed_ids)) != len(parsed_ids):
+        raise HTTPException(status_code=400, detail="Ids list contains duplicates")
+    try:
+        res = await supabase.rpc("set_items_order", {
+            "p_table": table_name,
+            "p_ids": parsed_ids
+        }).execute()
+        result = res.data or {}
+        return {
+            "status": "ok",
+            "updated": result.get("updated", 0),
+            "unknown_ids": result.get("unknown_ids") or []
+        }
+    except Exception as e:
+        logger.error(f"Error setting {table_name} order: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 def _extract_missing_column_from_error(error: Exception) -> Optional[str]:
     error_str = str(error)
@@ -166,10 +207,18 @@ async def upload_file(
         if not public_url:
             raise HTTPException(status_code=500, detail="Failed to upload file")
 
+        # Уменьшенные WebP/JPEG копии; ошибка здесь не мешает загрузке оригинала
+        variants = None
+        try:
+            variants = await create_image_variants(storage_service, public_url, file_content, folder)
+        except Exception as e:
+            logger.error(f"Error creating image variants: {e}", exc_info=True)
+
         return {
             "url": public_url,
             "filename": file.filename,
-            "size": len(file_content)
+            "size": len(file_content),
+            "variants": variants
         }
     except HTTPException:
         raise
@@ -212,6 +261,7 @@ async def create_master(data: Dict[str, Any], _: int = Depends(get_current_admin
             max_order = max_res.data[0]["order"] if max_res.data and max_res.data[0].get("order") is not None else 0
             data["order"] = max_order + 1
         
+        await attach_image_variants(get_storage_service(), data)
         res = await supabase.table("masters").insert(data).execute()
         return res.data[0] if res.data else {}
     except Exception as e:
@@ -225,6 +275,10 @@ async def update_master(id: str, data: Dict[str, Any], _: int = Depends(get_curr
             data["photo_url"] = rewrite_storage_public_url(data.get("photo_url"))
         if "image_url" in data:
             data["image_url"] = rewrite_storage_public_url(data.get("image_url"))
+        if "image_url" in data or "photo_url" in data:
+            current = await supabase.table("masters").select("image_variants").eq("id", id).execute()
+            existing = current.data[0].get("image_variants") if current.data else None
+            await attach_image_variants(get_storage_service(), data, existing)
         res = await supabase.table("masters").update(data).eq("id", id).execute()
         return res.data[0] if res.data else {}
     except Exception as e:
@@ -243,87 +297,12 @@ async def delete_master(id: str, _: int = Depends(get_current_admin)):
 @router.post("/masters/{id}/move")
 async def move_master(id: str, direction: str = Query(..., pattern="^(up|down)$"), _: int = Depends(get_current_admin)):
     """Перемещает мастера вверх или вниз по порядку"""
-    try:
-        # Получаем текущий элемент
-        current_res = await supabase.table("masters").select("*").eq("id", id).single().execute()
-        current_order = current_res.data.get("order")
-        
-        # Если order равен None, устанавливаем его на основе id
-        if current_order is None:
-            # Получаем все записи и находим максимальный order
-            all_res = await supabase.table("masters").select("*").execute()
-            max_order = 0
-            if all_res.data:
-                for item in all_res.data:
-                    item_order = item.get("order")
-                    if item_order is not None and item_order > max_order:
-                        max_order = item_order
-            current_order = max_order + 1
-            await supabase.table("masters").update({"order": current_order}).eq("id", id).execute()
-        
-        # Получаем все записи для поиска соседа
-        all_res = await supabase.table("masters").select("*").execute()
-        all_items = all_res.data or []
-        valid_items = [item for item in all_items if item.get("order") is not None]
-
-        orders = [_coerce_order(item.get("order")) for item in all_items]
-        unique_orders = len(set([o for o in orders if o is not None]))
-        normalized_orders = False
-        if len(all_items) > 1 and unique_orders <= 1:
-            await _normalize_orders("masters", all_items)
-            normalized_orders = True
-            current_res = await supabase.table("masters").select("*").eq("id", id).single().execute()
-            current_order = current_res.data.get("order") if current_res.data else None
-            all_res = await supabase.table("masters").select("*").execute()
-            all_items = all_res.data or []
-            valid_items = [item for item in all_items if item.get("order") is not None]
-        # Определяем направление и новый порядок
-        # "up" = переместить выше в списке = уменьшить свой order = найти соседа с МЕНЬШИМ order
-        # "down" = переместить ниже в списке = увеличить свой order = найти соседа с БОЛЬШИМ order
-        candidates = []
-        if direction == "up":
-            # Ищем соседа сверху (order меньше текущего)
-            candidates = [item for item in valid_items if item.get("id") != id and item.get("order") is not None and item.get("order") < current_order]
-            if candidates:
-                # Берем ближайшего сверху (максимальный из тех, что меньше)
-                target = max(candidates, key=lambda x: x.get("order", 0))
-                target_res = type('obj', (object,), {'data': [target]})()
-            else:
-                target_res = type('obj', (object,), {'data': []})()
-        else:  # down
-            # Ищем соседа снизу (order больше текущего)
-            candidates = [item for item in valid_items if item.get("id") != id and item.get("order") is not None and item.get("order") > current_order]
-            if candidates:
-                # Берем ближайшего снизу (минимальный из тех, что больше)
-                target = min(candidates, key=lambda x: x.get("order", 0))
-                target_res = type('obj', (object,), {'data': [target]})()
-            else:
-                target_res = type('obj', (object,), {'data': []})()
-        
-        if not target_res.data:
-            return {"status": "ok", "message": "Already at edge"}
-        
-        target = target_res.data[0]
-        target_order = target.get("order")
-        
-        if target_order is None:
-            # Если у целевого элемента тоже нет order, устанавливаем его
-            target_order = target["id"]
-            await supabase.table("masters").update({"order": target_order}).eq("id", target["id"]).execute()
-        
-        # Меняем местами
-        await supabase.table("masters").update({"order": target_order}).eq("id", id).execute()
-        await supabase.table("masters").update({"order": current_order}).eq("id", target["id"]).execute()
-        
-        # Проверяем, что данные действительно обновились
-        await supabase.table("masters").select("id,order").in_("id", [id, target["id"]]).execute()
+    return await _move_item("masters", id, direction)
 
-        return {"status": "ok"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error in move_master: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+@router.post("/masters/order")
+async def set_masters_order(payload: Dict[str, Any], _: int = Depends(get_current_admin)):
+    """Задает порядок мастеров списком id (после drag-and-drop)"""
+    return await _set_items_order("masters", payload)
 
 # --- Services ---
 
@@ -359,6 +338,7 @@ async def create_service(data: Dict[str, Any], _: int = Depends(get_current_admi
             max_order = max_res.data[0]["order"] if max_res.data and max_res.data[0].get("order") is not None else 0
             data["order"] = max_order + 1
         
+        await attach_image_variants(get_storage_service(), data)
         res = await supabase.table("services").insert(data).execute()
         return res.data[0] if res.data else {}
     except Exception as e:
@@ -372,6 +352,10 @@ async def update_service(id: str, data: Dict[str, Any], _: int = Depends(get_cur
             data["image_url"] = rewrite_storage_public_url(data.get("image_url"))
         if "photo_url" in data:
             data["photo_url"] = rewrite_storage_public_url(data.get("photo_url"))
+        if "image_url" in data or "photo_url" in data:
+            current = await supabase.table("services").select("image_variants").eq("id", id).execute()
+            existing = current.data[0].get("image_variants") if current.data else None
+            await attach_image_variants(get_storage_service(), data, existing)
         res = await supabase.table("services").update(data).eq("id", id).execute()
         return res.data[0] if res.data else {}
     except Exception as e:
@@ -390,81 +374,12 @@ async def delete_service(id: str, _: int = Depends(get_current_admin)):
 @router.post("/services/{id}/move")
 async def move_service(id: str, direction: str = Query(..., pattern="^(up|down)$"), _: int = Depends(get_current_admin)):
     """Перемещает услугу вверх или вниз по порядку"""
-    try:
-        current_res = await supabase.table("services").select("*").eq("id", id).single().execute()
-        if not current_res.data:
-            raise HTTPException(status_code=404, detail="Service not found")
-        
-        current_order = current_res.data.get("order")
-        
-        # Если order равен None, устанавливаем его
-        if current_order is None:
-            all_res = await supabase.table("services").select("*").execute()
-            max_order = 0
-            if all_res.data:
-                for item in all_res.data:
-                    item_order = item.get("order")
-                    if item_order is not None and item_order > max_order:
-                        max_order = item_order
-            current_order = max_order + 1
-            await supabase.table("services").update({"order": current_order}).eq("id", id).execute()
-        
-        # Получаем все записи для поиска соседа
-        all_res = await supabase.table("services").select("*").execute()
-        all_items = all_res.data or []
-        valid_items = [item for item in all_items if item.get("order") is not None]
-
-        orders = [_coerce_order(item.get("order")) for item in all_items]
-        unique_orders = len(set([o for o in orders if o is not None]))
-        normalized_orders = False
-        if len(all_items) > 1 and unique_orders <= 1:
-            await _normalize_orders("services", all_items)
-            normalized_orders = True
-            current_res = await supabase.table("services").select("*").eq("id", id).single().execute()
-            current_order = current_res.data.get("order") if current_res.data else None
-            all_res = await supabase.table("services").select("*").execute()
-            all_items = all_res.data or []
-            valid_items = [item for item in all_items if item.get("order") is not None]
-        # "up" = переместить выше = уменьшить свой order = найти соседа с МЕНЬШИМ order
-        # "down" = переместить ниже = увеличить свой order = найти соседа с БОЛЬШИМ order
-        candidates = []
-        if direction == "up":
-            candidates = [item for item in valid_items if item.get("id") != id and item.get("order") is not None and item.get("order") < current_order]
-            if candidates:
-                target = max(candidates, key=lambda x: x.get("order", 0))
-                target_res = type('obj', (object,), {'data': [target]})()
-            else:
-                target_res = type('obj', (object,), {'data': []})()
-        else:
-            candidates = [item for item in valid_items if item.get("id") != id and item.get("order") is not None and item.get("order") > current_order]
-            if candidates:
-                target = min(candidates, key=lambda x: x.get("order", 0))
-                target_res = type('obj', (object,), {'data': [target]})()
-            else:
-                target_res = type('obj', (object,), {'data': []})()
-        
-        if not target_res.data:
-            return {"status": "ok", "message": "Already at edge"}
-        
-        target = target_res.data[0]
-        target_order = target.get("order")
-        
-        if target_order is None:
-            target_order = target["id"]
-            await supabase.table("services").update({"order": target_order}).eq("id", target["id"]).execute()
-        
-        await supabase.table("services").update({"order": target_order}).eq("id", id).execute()
-        await supabase.table("services").update({"order": current_order}).eq("id", target["id"]).execute()
-        
-        # Проверяем, что данные действительно обновились
-        verify_res = await supabase.table("services").select("id,order").in_("id", [id, target["id"]]).execute()
-        
-        return {"status": "ok"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error in move_service: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return await _move_item("services", id, direction)
+
+@router.post("/services/order")
+async def set_services_order(payload: Dict[str, Any], _: int = Depends(get_current_admin)):
+    """Задает порядок услуг списком id (после drag-and-drop)"""
+    return await _set_items_order("services", payload)
 
 # --- Promotions ---
 
@@ -501,6 +416,7 @@ async def create_promotion(data: Dict[str, Any], _: int = Depends(get_current_ad
             max_order = max_res.data[0]["order"] if max_res.data and max_res.data[0].get("order") is not None else 0
             data["order"] = max_order + 1
         
+        await attach_image_variants(get_storage_service(), data)
         res = await supabase.table("promotions").insert(data).execute()
         return res.data[0] if res.data else {}
     except Exception as e:
@@ -514,6 +430,10 @@ async def update_promotion(id: str, data: Dict[str, Any], _: int = Depends(get_c
             data["image_url"] = rewrite_storage_public_url(data.get("image_url"))
         if "photo_url" in data:
             data["photo_url"] = rewrite_storage_public_url(data.get("photo_url"))
+        if "image_url" in data or "photo_url" in data:
+            current = await supabase.table("promotions").select("image_variants").eq("id", id).execute()
+            existing = current.data[0].get("image_variants") if current.data else None
+            await attach_image_variants(get_storage_service(), data, existing)
         res = await supabase.table("promotions").update(data).eq("id", id).execute()
         return res.data[0] if res.data else {}
     except Exception as e:
@@ -532,76 +452,25 @@ async def delete_promotion(id: str, _: int = Depends(get_current_admin)):
 @router.post("/promotions/{id}/move")
 async def move_promotion(id: str, direction: str = Query(..., pattern="^(up|down)$"), _: int = Depends(get_current_admin)):
     """Перемещает акцию вверх или вниз по порядку"""
-    try:
-        current_res = await supabase.table("promotions").select("*").eq("id", id).single().execute()
-        if not current_res.data:
-            raise HTTPException(status_code=404, detail="Promotion not found")
-        
-        current_order = current_res.data.get("order")
-        
-        # Если order равен None, устанавливаем его
-        if current_order is None:
-            all_res = await supabase.table("promotions").select("*").execute()
-            max_order = 0
-            if all_res.data:
-                for item in all_res.data:
-                    item_order = item.get("order")
-                    if item_order is not None and item_order > max_order:
-                        max_order = item_order
-            current_order = max_order + 1
-            await supabase.table("promotions").update({"order": current_order}).eq("id", id).execute()
-        
-        # Получаем все записи для поиска соседа
-        all_res = await supabase.table("promotions").select("*").execute()
-        valid_items = [item for item in all_res.data if item.get("order") is not None]
-
-        # "up" = переместить выше = уменьшить свой order = найти соседа с МЕНЬШИМ order
-        # "down" = переместить ниже = увеличить свой order = найти соседа с БОЛЬШИМ order
-        if direction == "up":
-            candidates = [item for item in valid_items if item.get("id") != id and item.get("order") is not None and item.get("order") < current_order]
-            if candidates:
-                target = max(candidates, key=lambda x: x.get("order", 0))
-                target_res = type('obj', (object,), {'data': [target]})()
-            else:
-                target_res = type('obj', (object,), {'data': []})()
-        else:
-            candidates = [item for item in valid_items if item.get("id") != id and item.get("order") is not None and item.get("order") > current_order]
-            if candidates:
-                target = min(candidates, key=lambda x: x.get("order", 0))
-                target_res = type('obj', (object,), {'data': [target]})()
-            else:
-                target_res = type('obj', (object,), {'data': []})()
-        
-        if not target_res.data:
-            return {"status": "ok", "message": "Already at edge"}
-        
-        target = target_res.data[0]
-        target_order = target.get("order")
-        
-        if target_order is None:
-            target_order = target["id"]
-            await supabase.table("promotions").update({"order": target_order}).eq("id", target["id"]).execute()
-        
-        await supabase.table("promotions").update({"order": target_order}).eq("id", id).execute()
-        await supabase.table("promotions").update({"order": current_order}).eq("id", target["id"]).execute()
-        
-        # Проверяем, что данные действительно обновились
-        verify_res = await supabase.table("promotions").select("id,order").in_("id", [id, target["id"]]).execute()
-        
-        return {"status": "ok"}
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error in move_promotion: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return await _move_item("promotions", id, direction)
+
+@router.post("/promotions/order")
+async def set_promotions_order(payload: Dict[str, Any], _: int = Depends(get_current_admin)):
+    """Задает порядок акций списком id (после drag-and-drop)"""
+    return await _set_items_order("promotions", payload)
 
 # --- Users ---
 
 @router.get("/users")
 async def get_users(_: int = Depends(get_current_admin)):
     try:
-        res = await supabase.table("users").select("*").order("created_at", desc=True).execute()
-        return res.data if res.data else []
+        # Сводка визитов встраивается PostgREST (user_visit_stats.user_id -> users.id), без отдельного запроса
+        res = await supabase.table("users")\
+            .select(f"*,user_visit_stats({USER_LIST_STATS_COLUMNS})")\
+            .order("created_at", desc=True)\
+            .execute()
+        # Строки PostgREST уже JSON-совместимы: отдаем без jsonable_encoder
+        return FastJSONResponse(res.data if res.data else [])
     except Exception as e:
         logger.error(f"Error in get_users: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -713,8 +582,9 @@ async def check_scheduled_broadcasts():
         from datetime import timezone
         now = datetime.now(timezone.utc)
         # Ищем рассылки со статусом 'scheduled' где scheduled_at <= now()
-        # Форматируем дату для Supabase (ISO формат с Z для UTC)
-        now_str = now.strftime('%Y-%m-%dT%H:%M:%S')
+        # Полный ISO формат: планировщик будит проверку ровно в scheduled_at, и отсечение
+        # долей секунды оставило бы рассылку со временем 12:00:00.5 до следующей проверки
+        now_str = now.isoformat()
         
         res = await supabase.table("broadcasts")\
             .select("*")\
@@ -738,6 +608,20 @@ async def check_scheduled_broadcasts():
     except Exception as e:
         logger.error(f"Error checking scheduled broadcasts: {e}", exc_info=True)
 
+async def next_scheduled_broadcast_at() -> Optional[datetime]:
+    """Время ближайшей запланированной рассылки (срок задачи scheduled_broadcasts)"""
+    res = await supabase.table("broadcasts")\
+        .select("scheduled_at")\
+        .eq("status", "scheduled")\
+        .order("scheduled_at")\
+        .limit(1)\
+        .execute()
+    if not res.data or not res.data[0].get("scheduled_at"):
+        return None
+    from datetime import timezone
+    scheduled_at = datetime.fromisoformat(res.data[0]["scheduled_at"].replace("Z", "+00:00"))
+    return scheduled_at if scheduled_at.tzinfo else scheduled_at.replace(tzinfo=timezone.utc)
+
 async def process_broadcast(broadcast_id: str):
     """Фоновая задача для отправки рассылки"""
     try:
@@ -749,7 +633,6 @@ async def process_broadcast(broadcast_id: str):
         
         broadcast = broadcast_res.data or {}
         message = broadcast.get("message") or broadcast.get("content") or broadcast.get("title") or ""
-        recipient_type = broadcast.get("recipient_type", "all")
         image_url = broadcast.get("image_url")
 
         # Обновляем статус на "sending"
@@ -758,44 +641,18 @@ async def process_broadcast(broadcast_id: str):
         except Exception as e:
             logger.warning(f"Could not set broadcast {broadcast_id} status to 'sending': {e}")
         
-        # Получаем список получателей
+        # Получаем список получателей: список id или сегмент (один RPC, миграция 024)
         recipients = []
+        segment = segment_from_broadcast(broadcast)
         
-        if recipient_type == "all":
-            # Все пользователи
-            users_res = await supabase.table("users").select("tg_id").execute()
-            recipients = [user["tg_id"] for user in (users_res.data or []) if user.get("tg_id")]
-        
-        elif recipient_type == "selected":
+        if segment is None:
             # Выбранные пользователи
             recipient_ids = broadcast.get("recipient_ids", [])
             if recipient_ids:
                 users_res = await supabase.table("users").select("tg_id").in_("id", recipient_ids).execute()
                 recipients = [user["tg_id"] for user in (users_res.data or []) if user.get("tg_id")]
-        
-        elif recipient_type == "by_balance":
-            # По балансу баллов
-            balance_min = broadcast.get("filter_balance_min")
-            balance_max = broadcast.get("filter_balance_max")
-            query = supabase.table("users").select("tg_id")
-            if balance_min is not None:
-                query = query.gt("balance", balance_min - 1)  # >= balance_min
-            if balance_max is not None:
-                query = query.lt("balance", balance_max + 1)  # <= balance_max
-            users_res = await query.execute()
-            recipients = [user["tg_id"] for user in (users_res.data or []) if user.get("tg_id")]
-        
-        elif recipient_type == "by_date":
-            # По дате регистрации
-            date_from = broadcast.get("filter_date_from")
-            date_to = broadcast.get("filter_date_to")
-            query = supabase.table("users").select("tg_id")
-            if date_from:
-                query = query.gt("created_at", date_from)
-            if date_to:
-                query = query.lt("created_at", date_to)
-            users_res = await query.execute()
-            recipients = [user["tg_id"] for user in (users_res.data or []) if user.get("tg_id")]
+        else:
+            recipients = await select_segment_tg_ids(segment)
         
         # Отправляем сообщения
         sent_count = 0
@@ -848,6 +705,10 @@ async def create_broadcast(data: Dict[str, Any], background_tasks: BackgroundTas
         scheduled_at = data.get("scheduled_at")
         # Если указана запланированная дата, статус должен быть 'scheduled'
         status = "scheduled" if scheduled_at else "pending"
+        try:
+            segment = parse_segment(data.get("segment")) if data.get("recipient_type") == "segment" else None
+        except SegmentError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         broadcast_data = {
             "message": data.get("message", ""),
@@ -857,6 +718,7 @@ async def create_broadcast(data: Dict[str, Any], background_tasks: BackgroundTas
             "filter_balance_max": data.get("filter_balance_max"),
             "filter_date_from": data.get("filter_date_from"),
             "filter_date_to": data.get("filter_date_to"),
+            "segment": segment,
             "scheduled_at": scheduled_at,
             "status": status,
             "created_by": admin_id
@@ -893,6 +755,10 @@ async def create_broadcast(data: Dict[str, Any], background_tasks: BackgroundTas
             try:
                 res = await supabase.table("broadcasts").insert(pending_data).execute()
                 # НЕ запускаем отправку автоматически - пользователь должен нажать "Отправить" или дождаться scheduled_at
+                if status == "scheduled":
+                    # Планировщик этого процесса пересчитает срок scheduled_broadcasts
+                    # (в режиме worker воркер увидит рассылку при следующей перепроверке)
+                    scheduler.wake()
                 return res.data[0] if res.data else {}
             except Exception as insert_error:
                 last_error = insert_error
@@ -918,10 +784,28 @@ async def create_broadcast(data: Dict[str, Any], background_tasks: BackgroundTas
                 raise
         if last_error:
             raise last_error
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in create_broadcast: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@router.post("/broadcasts/preview")
+async def preview_broadcast_audience(data: Dict[str, Any], _: int = Depends(get_current_admin)):
+    """Размер аудитории рассылки до отправки (те же поля, что и при создании)"""
+    try:
+        segment = segment_from_broadcast(data)
+    except SegmentError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        if segment is None:
+            recipient_ids = data.get("recipient_ids") or []
+            return {"count": len(set(recipient_ids)), "segment": None}
+        return {"count": await count_segment(segment), "segment": segment}
+    except Exception as e:
+        logger.error(f"Error in preview_broadcast_audience: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
 @router.get("/broadcasts")
 async def get_broadcasts(_: int = Depends(get_current_admin)):
     """Получает список всех рассылок"""
@@ -973,8 +857,12 @@ async def send_broadcast(id: str, background_tasks: BackgroundTasks, _: int = De
             "scheduled_at": None  # Убираем запланированную дату при ручной отправке
         })
         
-        # Запускаем отправку в фоне
-        background_tasks.add_task(process_broadcast, id)
+        # Запускаем отправку в фоне (или отдаем процессу воркера)
+        if worker_mode():
+            # Без повторов: упавшая на середине рассылка не должна отправиться дважды
+            await enqueue_job(JOB_BROADCAST, {"broadcast_id": id}, max_attempts=1)
+        else:
+            background_tasks.add_task(process_broadcast, id)
         
         return {"status": "ok", "message": "Broadcast sending started"}
     except HTTPException:
@@ -1079,13 +967,10 @@ async def reorder_bot_buttons(payload: Dict[str, Any], _: int = Depends(get_curr
                     "order_in_row": index
                 })
 
-        for item in normalized:
-            await supabase.table("bot_buttons").update({
-                "row_number": item["row_number"],
-                "order_in_row": item["order_in_row"]
-            }).eq("id", item["id"]).execute()
+        # Один UPDATE на все кнопки (RPC bulk_patch)
+        updated = await supabase.bulk_update("bot_buttons", normalized)
 
-        return {"status": "ok", "updated": len(normalized)}
+        return {"status": "ok", "updated": updated}
     except HTTPException:
         raise
     except Exception as e:
@@ -1101,3 +986,43 @@ async def delete_bot_button(id: int, _: int = Depends(get_current_admin)):
     except Exception as e:
         logger.error(f"Error in delete_bot_button: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# --- Traces ---
+
+@router.get("/traces")
+async def get_traces(
+    name: Optional[str] = Query(None, description="Подстрока маршрута, например /api/app/profile"),
+    min_ms: float = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=200),
+    spans: bool = Query(False, description="Включить все spans, а не только сводку"),
+    _: int = Depends(get_current_admin),
+):
+    """Последние медленные трассы (дольше TRACE_SLOW_MS) со сводкой времени по участкам"""
+    traces = recent_slow_traces(limit=limit, name=name, min_ms=min_ms)
+    return {
+        "slow_threshold_ms": settings.TRACE_SLOW_MS,
+        "items": [trace.to_dict(include_spans=spans) for trace in traces],
+    }
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str, _: int = Depends(get_current_admin)):
+    """Трасса целиком: все spans с отступом от начала и длительностью"""
+    trace = get_slow_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_dict()
+
+@router.get("/jobs")
+async def get_jobs(_: int = Depends(get_current_admin)):
+    """Периодические задачи: расписание, время следующего и последнего запуска, ошибки"""
+    try:
+        jobs_res = await supabase.table("scheduled_jobs").select("*").order("name").execute()
+        lease_res = await supabase.table("job_leases").select("*").eq("name", SCHEDULER_LEASE).execute()
+        return {
+            "instance_id": INSTANCE_ID,
+            "leader": lease_res.data[0] if lease_res.data else None,
+            "jobs": jobs_res.data or [],
+        }
+    except Exception as e:
+        logger.error(f"Error in get_jobs: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
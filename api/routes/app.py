@@ -4,15 +4,58 @@ from bot.services.supabase_client import supabase
 from bot.services.loyalty import get_user_available_balance, sync_user_with_yclients
 from bot.services.settings import get_setting
 from bot.services.storage import rewrite_storage_public_url
+from bot.services.images import build_srcset
 from bot.services.yclients_api import yclients
-from bot.services.visits import get_user_visits, sync_user_visits
+from bot.services.visits import get_user_visits, get_user_visit_stats, sync_user_visits
+from bot.services.interactions import touch_user_interaction
+from bot.services import cache_versions
 from bot.config import settings
-from typing import Optional
+from api.responses import FastJSONResponse
+from typing import Any, Dict, Optional
 import logging
+import time
 
 router = APIRouter(prefix="/api/app", tags=["mini-app"])
 logger = logging.getLogger(__name__)
 
+# Кэш каталога (услуги, мастера, акции) для /content: сбрасывается по TTL
+# и при изменении таблиц каталога на любом воркере (cache_versions "catalog")
+CATALOG_CACHE_TTL_SECONDS = 300
+_catalog_cache: Optional[Dict[str, Any]] = None
+_catalog_cached_at = 0.0
+
+
+def clear_catalog_cache():
+    global _catalog_cache
+    _catalog_cache = None
+
+
+cache_versions.on_change("catalog", clear_catalog_cache)
+
+
+async def _load_catalog() -> Dict[str, Any]:
+    """Активные услуги и акции, все мастера - с публичными URL и srcset изображений"""
+    global _catalog_cache, _catalog_cached_at
+    if _catalog_cache is not None and time.monotonic() - _catalog_cached_at < CATALOG_CACHE_TTL_SECONDS:
+        return _catalog_cache
+    # Сортируем по order, затем по id для стабильности
+    services_res = await supabase.table("services").select("*").eq("is_active", True).order("order").order("id").execute()
+    masters_res = await supabase.table("masters").select("*").order("order").order("id").execute()
+    promotions_res = await supabase.table("promotions").select("*").eq("is_active", True).order("order").order("id").execute()
+
+    services = services_res.data if services_res.data else []
+    masters = masters_res.data if masters_res.data else []
+    promotions = promotions_res.data if promotions_res.data else []
+    for item in services + masters + promotions:
+        item["image_url"] = rewrite_storage_public_url(item.get("image_url"))
+        item["photo_url"] = rewrite_storage_public_url(item.get("photo_url"))
+        # srcset по полям: {"image_url": {"webp": "... 160w, ... 480w", "jpeg": "...", "src": "..."}}
+        item["image_srcset"] = build_srcset(item.pop("image_variants", None))
+
+    _catalog_cache = {"services": services, "masters": masters, "promotions": promotions}
+    _catalog_cached_at = time.monotonic()
+    return _catalog_cache
+
 @router.get("/profile")
 async def get_app_profile(x_tg_init_data: Optional[str] = Header(None)):
     """Получает профиль пользователя для Mini App"""
@@ -26,6 +69,7 @@ async def get_app_profile(x_tg_init_data: Optional[str] = Header(None)):
         if not tg_id:
             logger.warning("Could not extract tg_id from initData")
             raise HTTPException(status_code=401, detail="Invalid initData")
+        touch_user_interaction(tg_id)
         
         # 2. Поиск в БД
         try:
@@ -42,7 +86,7 @@ async def get_app_profile(x_tg_init_data: Optional[str] = Header(None)):
         
         # Синхронизируем баланс с YClients в приоритете
         try:
-            sync_result = await sync_user_with_yclients(user["id"])
+            sync_result = await sync_user_with_yclients(user["id"], user=user)
             if sync_result:
                 if sync_result.get("no_card"):
                     user["balance"] = 0
@@ -83,7 +127,8 @@ async def get_app_profile(x_tg_init_data: Optional[str] = Header(None)):
                 user["id"],
                 limit=10,
                 force=not visits,
-                min_interval_minutes=30
+                min_interval_minutes=30,
+                user=user
             )
             if sync_result.get("visits"):
                 visits = sync_result["visits"]
@@ -101,12 +146,20 @@ async def get_app_profile(x_tg_init_data: Optional[str] = Header(None)):
                     visits = await yclients.get_client_visits(yclients_id, limit=10)
         except Exception as e:
             logger.warning(f"Could not fetch visits: {e}")
+
+        # 5. Сводка визитов (user_visit_stats, обновляется триггером после синка визитов)
+        visit_stats = None
+        try:
+            visit_stats = await get_user_visit_stats(user["id"])
+        except Exception as e:
+            logger.warning(f"Could not fetch visit stats: {e}")
         
         return {
             "user": user,
             "is_admin": is_admin,
             "history": tx_res.data if hasattr(tx_res, 'data') else [],
-            "visits": visits
+            "visits": visits,
+            "visit_stats": visit_stats
         }
     except HTTPException:
         raise
@@ -118,38 +171,23 @@ async def get_app_profile(x_tg_init_data: Optional[str] = Header(None)):
 async def get_app_content():
     """Получает общий контент: услуги, мастера, акции"""
     try:
-        # Сортируем по order, затем по id для стабильности
-        services_res = await supabase.table("services").select("*").eq("is_active", True).order("order").order("id").execute()
-        masters_res = await supabase.table("masters").select("*").order("order").order("id").execute()
-        promotions_res = await supabase.table("promotions").select("*").eq("is_active", True).order("order").order("id").execute()
+        catalog = await _load_catalog()
         loyalty_max_spend_percentage = await get_setting('loyalty_max_spend_percentage', settings.LOYALTY_MAX_SPEND_PERCENTAGE)
         loyalty_expiration_days = await get_setting('loyalty_expiration_days', settings.LOYALTY_EXPIRATION_DAYS)
-
-        services = services_res.data if services_res.data else []
-        masters = masters_res.data if masters_res.data else []
-        promotions = promotions_res.data if promotions_res.data else []
-        for item in services:
-            item["image_url"] = rewrite_storage_public_url(item.get("image_url"))
-            item["photo_url"] = rewrite_storage_public_url(item.get("photo_url"))
-        for item in masters:
-            item["photo_url"] = rewrite_storage_public_url(item.get("photo_url"))
-            item["image_url"] = rewrite_storage_public_url(item.get("image_url"))
-        for item in promotions:
-            item["image_url"] = rewrite_storage_public_url(item.get("image_url"))
-            item["photo_url"] = rewrite_storage_public_url(item.get("photo_url"))
         
         storage_public_url_base = settings.SUPABASE_STORAGE_PUBLIC_URL_BASE or settings.SUPABASE_URL
         if settings.SUPABASE_STORAGE_S3_ENDPOINT:
             storage_public_url_base = settings.SUPABASE_STORAGE_S3_ENDPOINT
-        return {
-            "services": services,
-            "masters": masters,
-            "promotions": promotions,
+        # Строки PostgREST уже JSON-совместимы: отдаем без jsonable_encoder
+        return FastJSONResponse({
+            "services": catalog["services"],
+            "masters": catalog["masters"],
+            "promotions": catalog["promotions"],
             "booking_url": settings.YCLIENTS_BOOKING_URL,
             "storage_public_url_base": storage_public_url_base,
             "loyalty_max_spend_percentage": loyalty_max_spend_percentage,
             "loyalty_expiration_days": loyalty_expiration_days
-        }
+        })
     except Exception as e:
         logger.error(f"Database error in get_app_content: {e}", exc_info=True)
         # Возвращаем пустые списки при ошибке БД
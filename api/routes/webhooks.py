@@ -3,9 +3,20 @@ from api.models.yclients import YClientsWebhookData
 from bot.services.supabase_client import supabase
 from bot.services.loyalty import process_loyalty_payment
 from bot.services.notifications import send_loyalty_notification
+from bot.services.tracing import span
+from bot.services.update_queue import update_queue, update_chat_id, webhook_reply_payload
+from bot.services.metrics import metrics
+from bot.services.jobs import (
+    JOB_TELEGRAM_UPDATE,
+    JOB_YCLIENTS_PAYMENT,
+    enqueue_job,
+    telegram_updates_in_worker,
+    worker_mode,
+)
 from bot.config import settings
 from bot.dispatcher import dp
 from aiogram import Bot
+from aiogram.methods import TelegramMethod
 from aiogram.types import Update
 import logging
 
@@ -130,7 +141,10 @@ async def yclients_webhook(
     
     # Мы отвечаем YClients "200 OK" сразу, чтобы они не слали повторно, 
     # а тяжелую логику делаем в фоне (BackgroundTasks)
-    background_tasks.add_task(handle_payment_webhook, payload)
+    if worker_mode():
+        await enqueue_job(JOB_YCLIENTS_PAYMENT, payload.model_dump(mode="json"))
+    else:
+        background_tasks.add_task(handle_payment_webhook, payload)
     return {"status": "accepted"}
 
 @router.post("/yclients/callback")
@@ -167,6 +181,20 @@ async def yclients_callback(
     
     return {"status": "ok"}
 
+async def _webhook_reply(method: TelegramMethod, update_type: str | None):
+    """Метод API в теле ответа вебхука; с файлами - отдельным запросом"""
+    payload = webhook_reply_payload(_telegram_bot, method)
+    if payload is None:
+        if update_queue.running:
+            # Запрос завершится в фоне, update_queue.stop() дождется его при остановке
+            update_queue.send_in_background(method)
+        else:
+            await dp.silent_call_request(bot=_telegram_bot, result=method)
+        return {"ok": True}
+    metrics.record_telegram_update(update_type, "webhook_reply")
+    return payload
+
+
 @router.post("/telegram")
 async def telegram_webhook(
     request: Request,
@@ -187,33 +215,47 @@ async def telegram_webhook(
     try:
         # Получаем JSON от Telegram
         update_data = await request.json()
+        update_type, chat_id = update_chat_id(update_data)
         update_id = update_data.get("update_id")
-        chat_id = None
-        update_type = None
-        if "message" in update_data:
-            update_type = "message"
-            chat_id = update_data.get("message", {}).get("chat", {}).get("id")
-        elif "callback_query" in update_data:
-            update_type = "callback_query"
-            chat_id = update_data.get("callback_query", {}).get("message", {}).get("chat", {}).get("id")
-        elif "my_chat_member" in update_data:
-            update_type = "my_chat_member"
-            chat_id = update_data.get("my_chat_member", {}).get("chat", {}).get("id")
-
-        print(f"[tg_webhook] entry id={update_id} type={update_type} chat_id={chat_id} text={update_data.get('message', {}).get('text')}")
+
+        logger.debug(f"Telegram webhook: update_id={update_id} type={update_type} chat_id={chat_id}")
 
         # Создаем объект Update из данных с контекстом бота
         update = Update.model_validate(update_data, context={"bot": _telegram_bot})
-        
-        # Передаем обновление в Dispatcher для обработки
-        print(f"[tg_webhook] dispatching id={update_id} type={update_type}")
-        await dp.feed_update(_telegram_bot, update)
-        print(f"[tg_webhook] dispatched id={update_id} type={update_type}")
-
-        logger.debug(f"Telegram webhook processed: update_id={update.update_id}")
-        return {"ok": True}
-        
     except Exception as e:
-        logger.error(f"Error processing Telegram webhook: {e}", exc_info=True)
-        # Telegram ожидает {"ok": true} даже при ошибках, иначе будет повторять запрос
+        logger.error(f"Invalid Telegram update: {e}", exc_info=True)
+        # Telegram ожидает 200 даже при ошибках, иначе будет повторять запрос
         return {"ok": False}
+
+    if telegram_updates_in_worker():
+        # Обновления обрабатывает процесс bot.worker (ответ в теле вебхука в этом режиме не используется)
+        try:
+            await enqueue_job(JOB_TELEGRAM_UPDATE, update_data)
+        except Exception as e:
+            logger.error(f"Could not enqueue Telegram update {update_id}: {e}")
+            raise HTTPException(status_code=503, detail="Could not enqueue update")
+        return {"ok": True}
+
+    if not update_queue.running:
+        # Очередь не запущена (например, при запуске без startup) - обрабатываем сразу
+        try:
+            with span("aiogram.feed_update", update_type=update_type, update_id=update_id):
+                result = await dp.feed_update(_telegram_bot, update)
+            return await _webhook_reply(result, update_type) if isinstance(result, TelegramMethod) else {"ok": True}
+        except Exception as e:
+            logger.error(f"Error processing Telegram webhook: {e}", exc_info=True)
+            return {"ok": False}
+
+    if settings.TELEGRAM_WEBHOOK_REPLY:
+        # Шард чата свободен - обрабатываем сразу и, если получится, отвечаем методом API в теле вебхука
+        handled, result = await update_queue.process_inline(
+            update, chat_id, update_type, settings.TELEGRAM_WEBHOOK_REPLY_TIMEOUT_MS / 1000
+        )
+        if handled:
+            return await _webhook_reply(result, update_type) if result is not None else {"ok": True}
+
+    # Обработку выполняют воркеры очереди, Telegram получает ответ сразу
+    if not update_queue.enqueue(update, chat_id, update_type):
+        logger.warning(f"Telegram update queue is full, rejecting update_id={update_id}")
+        raise HTTPException(status_code=503, detail="Update queue is full")
+    return {"ok": True}
@@ -0,0 +1,264 @@
+"""
+Статика Mini App: хэшированные имена, предсжатие gzip/brotli, раздача из памяти.
+
+scripts/build_webapp.py собирает webapp/dist (script.<hash>.js, cveti.<hash>.png,
+index.html со ссылками на хэшированные файлы, .gz/.br и manifest.json).
+Если сборки нет (локальная разработка), то же самое делается в памяти при первом запросе.
+
+Хэшированные файлы отдаются с Cache-Control: immutable, HTML - с no-cache и ETag,
+чтобы клиент получал 304 и сразу видел новые ссылки после деплоя.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import threading
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость, без нее только gzip
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # без rjsmin script.js отдается как есть (но сжатый)
+    rjsmin = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+HASHED_PREFIX = "/webapp/assets/"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+HTML_CACHE = "no-cache"
+# Старые нехэшированные пути (/webapp/script.js) - для HTML, закэшированного до деплоя
+LEGACY_CACHE = "public, max-age=300"
+
+# Меньше этого размера сжатие не дает выигрыша
+MIN_COMPRESS_SIZE = 512
+
+# Исходники: логическое имя -> путь относительно корня проекта
+HASHED_SOURCES = {
+    "script.js": os.path.join("webapp", "script.js"),
+    "cveti.png": "cveti.png",
+}
+HTML_SOURCES = {
+    "index.html": os.path.join("webapp", "index.html"),
+    "register.html": os.path.join("webapp", "register.html"),
+}
+# Уже сжатые форматы повторно не сжимаем
+_INCOMPRESSIBLE_TYPES = ("image/png", "image/jpeg", "image/webp", "image/gif")
+
+
+@dataclass
+class Asset:
+    """Файл в памяти со всеми вариантами кодирования"""
+
+    name: str
+    content_type: str
+    body: bytes
+    digest: str
+    cache_control: str
+    encoded: Dict[str, bytes] = field(default_factory=dict)  # "br"/"gzip" -> тело
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def etags(self) -> Iterable[str]:
+        yield self.etag()
+        for encoding in self.encoded:
+            yield self.etag(encoding)
+
+
+def content_digest(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:12]
+
+
+def hashed_name(name: str, digest: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+def guess_content_type(name: str) -> str:
+    if name.endswith(".js"):
+        return "application/javascript; charset=utf-8"
+    if name.endswith(".html"):
+        return "text/html; charset=utf-8"
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def minify(name: str, body: bytes) -> bytes:
+    if name.endswith(".js") and rjsmin is not None:
+        return rjsmin.jsmin(body.decode("utf-8")).encode("utf-8")
+    return body
+
+
+def compress(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """Варианты br/gzip, если они меньше исходного файла"""
+    if len(body) < MIN_COMPRESS_SIZE or content_type.startswith(_INCOMPRESSIBLE_TYPES):
+        return {}
+    variants: Dict[str, bytes] = {}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+    return {encoding: data for encoding, data in variants.items() if len(data) < len(body)}
+
+
+def build_assets(project_root: str) -> Dict[str, Asset]:
+    """
+    Собирает все ассеты в память. Ключи - URL-пути, по которым они раздаются:
+    /webapp/assets/<hashed>, /webapp/<logical> (legacy) и HTML-страницы по логическому имени.
+    """
+    assets: Dict[str, Asset] = {}
+    replacements: Dict[str, str] = {}
+    for name, relative_path in HASHED_SOURCES.items():
+        path = os.path.join(project_root, relative_path)
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as source:
+            body = minify(name, source.read())
+        digest = content_digest(body)
+        content_type = guess_content_type(name)
+        encoded = compress(content_type, body)
+        url = HASHED_PREFIX + hashed_name(name, digest)
+        assets[url] = Asset(name, content_type, body, digest, IMMUTABLE_CACHE, encoded)
+        assets[f"/webapp/{name}"] = Asset(name, content_type, body, digest, LEGACY_CACHE, encoded)
+        replacements[f"/webapp/{name}"] = url
+
+    for name, relative_path in HTML_SOURCES.items():
+        path = os.path.join(project_root, relative_path)
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as source:
+            html = source.read()
+        for original, url in replacements.items():
+            html = html.replace(original, url)
+        body = html.encode("utf-8")
+        content_type = guess_content_type(name)
+        assets[name] = Asset(name, content_type, body, content_digest(body), HTML_CACHE, compress(content_type, body))
+    return assets
+
+
+def write_dist(assets: Dict[str, Asset], dist_dir: str) -> Dict[str, dict]:
+    """Записывает ассеты и manifest.json в dist_dir, возвращает манифест"""
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest: Dict[str, dict] = {}
+    for key, asset in assets.items():
+        file_name = os.path.basename(key)
+        if key.startswith("/webapp/") and not key.startswith(HASHED_PREFIX):
+            # Legacy-путь ссылается на тот же файл, что и хэшированный (он записан раньше)
+            hashed_key = HASHED_PREFIX + hashed_name(asset.name, asset.digest)
+            manifest[key] = dict(manifest[hashed_key], cache_control=asset.cache_control)
+            continue
+        _write_file(os.path.join(dist_dir, file_name), asset.body)
+        for encoding, data in asset.encoded.items():
+            _write_file(os.path.join(dist_dir, f"{file_name}.{'br' if encoding == 'br' else 'gz'}"), data)
+        manifest[key] = {
+            "name": asset.name,
+            "file": file_name,
+            "content_type": asset.content_type,
+            "digest": asset.digest,
+            "cache_control": asset.cache_control,
+            "encodings": sorted(asset.encoded),
+            "size": len(asset.body),
+        }
+    _write_file(os.path.join(dist_dir, MANIFEST_NAME), json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return manifest
+
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as target:
+        target.write(data)
+
+
+def load_dist(dist_dir: str) -> Optional[Dict[str, Asset]]:
+    """Читает собранную dist-директорию; None, если сборки нет"""
+    manifest_path = os.path.join(dist_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    assets: Dict[str, Asset] = {}
+    for key, entry in manifest.items():
+        file_path = os.path.join(dist_dir, entry["file"])
+        with open(file_path, "rb") as source:
+            body = source.read()
+        encoded = {}
+        for encoding in entry.get("encodings", []):
+            with open(f"{file_path}.{'br' if encoding == 'br' else 'gz'}", "rb") as source:
+                encoded[encoding] = source.read()
+        assets[key] = Asset(entry["name"], entry["content_type"], body, entry["digest"], entry["cache_control"], encoded)
+    return assets
+
+
+class StaticAssetStore:
+    """Ассеты в памяти: dist, если собран, иначе сборка из исходников при первом обращении"""
+
+    def __init__(self, project_root: str, dist_dir: Optional[str] = None):
+        self.project_root = project_root
+        self.dist_dir = dist_dir or os.path.join(project_root, "webapp", "dist")
+        self._assets: Optional[Dict[str, Asset]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def assets(self) -> Dict[str, Asset]:
+        if self._assets is None:
+            with self._lock:
+                if self._assets is None:
+                    assets = load_dist(self.dist_dir)
+                    if assets is None:
+                        logger.info("webapp/dist not found, building static assets in memory")
+                        assets = build_assets(self.project_root)
+                    self._assets = assets
+        return self._assets
+
+    def get(self, key: str) -> Optional[Asset]:
+        return self.assets.get(key)
+
+    def response(self, request: Request, key: str) -> Response:
+        """Ответ с учетом If-None-Match и Accept-Encoding; 404, если ассета нет"""
+        asset = self.get(key)
+        if asset is None:
+            return Response(status_code=404)
+        encoding = _pick_encoding(request.headers.get("accept-encoding", ""), asset)
+        headers = {
+            "Cache-Control": asset.cache_control,
+            "ETag": asset.etag(encoding),
+            "Vary": "Accept-Encoding",
+        }
+        if _etag_matches(request.headers.get("if-none-match"), asset):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(asset.encoded[encoding], media_type=asset.content_type, headers=headers)
+        return Response(asset.body, media_type=asset.content_type, headers=headers)
+
+
+def _pick_encoding(accept_encoding: str, asset: Asset) -> Optional[str]:
+    if not asset.encoded:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(token.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in asset.encoded and encoding in accepted:
+            return encoding
+    return None
+
+
+def _etag_matches(if_none_match: Optional[str], asset: Asset) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in candidates:
+        return True
+    return any(tag in candidates for tag in asset.etags())
@@ -0,0 +1,19 @@
+"""
+Локальные заглушки внешних сервисов для нагрузочных тестов:
+YClients API, PostgREST и Telegram Bot API.
+"""
+from bench.fakes.common import FakeServer, RateLimiter, UpstreamStats, free_port
+from bench.fakes.postgrest import FakePostgREST, InMemoryDB
+from bench.fakes.telegram import FakeTelegram
+from bench.fakes.yclients import FakeYClients
+
+__all__ = [
+    "FakePostgREST",
+    "FakeServer",
+    "FakeTelegram",
+    "FakeYClients",
+    "InMemoryDB",
+    "RateLimiter",
+    "UpstreamStats",
+    "free_port",
+]
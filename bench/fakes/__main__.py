@@ -0,0 +1,61 @@
+"""
+Запуск заглушек отдельно от сценариев, например чтобы направить на них
+uvicorn api.main:app или внешний генератор нагрузки.
+
+    python -m bench.fakes --users 500 --yclients-latency-ms 100
+
+Печатает переменные окружения для приложения и работает до Ctrl+C.
+"""
+import argparse
+import asyncio
+
+from bench.fakes import FakePostgREST, FakeServer, FakeTelegram, FakeYClients
+
+
+async def serve(args: argparse.Namespace) -> None:
+    from bench.load import BOT_TOKEN, COMPANY_ID, WEBHOOK_SECRET, configure_environment, seed
+
+    postgrest = FakePostgREST(latency_ms=args.db_latency_ms)
+    yclients = FakeYClients(latency_ms=args.yclients_latency_ms, rps_quota=args.yclients_rps)
+    telegram = FakeTelegram(latency_ms=args.telegram_latency_ms, rps_quota=args.telegram_rps)
+    servers = [FakeServer(postgrest.app), FakeServer(yclients.app), FakeServer(telegram.app)]
+    for server in servers:
+        await server.start()
+    configure_environment(*servers)
+    seed(postgrest, yclients, args)
+
+    print(f"TELEGRAM_BOT_TOKEN={BOT_TOKEN}")
+    print(f"TELEGRAM_API_SERVER={servers[2].url}")
+    print(f"SUPABASE_URL={servers[0].url}")
+    print("SUPABASE_REST_PATH=rest/v1")
+    print(f"YCLIENTS_BASE_URL={servers[1].url}")
+    print(f"YCLIENTS_COMPANY_ID={COMPANY_ID}")
+    print(f"WEBHOOK_SECRET={WEBHOOK_SECRET}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for server in servers:
+            await server.stop()
+        for stats in (postgrest.stats, yclients.stats, telegram.stats):
+            print(stats.name, stats.snapshot())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run YClients/PostgREST/Telegram stand-ins")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--transactions-per-user", type=int, default=10)
+    parser.add_argument("--visits-per-user", type=int, default=20)
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--yclients-latency-ms", type=float, default=80.0)
+    parser.add_argument("--yclients-rps", type=float, default=0.0)
+    parser.add_argument("--telegram-latency-ms", type=float, default=40.0)
+    parser.add_argument("--telegram-rps", type=float, default=30.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Общие части заглушек: счетчики запросов, искусственная задержка, квоты
+и запуск FastAPI-приложения через uvicorn в текущем event loop.
+"""
+import asyncio
+import random
+import socket
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.routing import Match
+
+
+def free_port() -> int:
+    """Свободный TCP-порт на localhost"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class RateLimiter:
+    """Token bucket: не больше rate запросов в секунду (rate <= 0 - без ограничения)"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def allow(self) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class UpstreamStats:
+    """Счетчики запросов к заглушке: по шаблону маршрута и по статусу ответа"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.routes: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def total(self) -> int:
+        return sum(self.routes.values())
+
+    def reset(self) -> None:
+        self.routes.clear()
+        self.statuses.clear()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "max_in_flight": self.max_in_flight,
+            "statuses": dict(sorted(self.statuses.items())),
+            "routes": dict(self.routes.most_common()),
+        }
+
+
+def _route_template(app: FastAPI, scope: Dict[str, Any], expand: Tuple[str, ...] = ()) -> str:
+    for route in app.router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            template = getattr(route, "path", scope["path"])
+            # Параметры из expand подставляем значением (например, имя таблицы)
+            for name, value in child_scope.get("path_params", {}).items():
+                if name in expand:
+                    template = template.replace(f"{{{name}}}", str(value))
+            return template
+    return scope["path"]
+
+
+def install_upstream_middleware(
+    app: FastAPI,
+    stats: UpstreamStats,
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    limiter: Optional[RateLimiter] = None,
+    throttled_response: Optional[Callable[[], JSONResponse]] = None,
+    expand_params: Tuple[str, ...] = (),
+) -> None:
+    """
+    Считает запросы, добавляет задержку latency_ms +- jitter_ms и отвечает
+    throttled_response, если запрос не проходит по квоте.
+    Параметры пути из expand_params попадают в ключ счетчика значением.
+    """
+
+    @app.middleware("http")
+    async def upstream_middleware(request: Request, call_next):
+        key = f"{request.method} {_route_template(app, request.scope, expand_params)}"
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+        try:
+            delay = latency_ms + (random.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0.0)
+            if delay > 0:
+                await asyncio.sleep(delay / 1000)
+            if limiter is not None and not limiter.allow():
+                response = throttled_response() if throttled_response else JSONResponse(
+                    {"error": "Too Many Requests"}, status_code=429
+                )
+            else:
+                response = await call_next(request)
+        finally:
+            stats.in_flight -= 1
+        stats.routes[key] += 1
+        stats.statuses[response.status_code] += 1
+        return response
+
+
+class FakeServer:
+    """FastAPI-приложение, поднятое uvicorn на localhost в текущем event loop"""
+
+    def __init__(self, app: FastAPI, port: Optional[int] = None):
+        self.app = app
+        self.port = port or free_port()
+        self._server: Optional[uvicorn.Server] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self) -> None:
+        config = uvicorn.Config(
+            self.app,
+            host="127.0.0.1",
+            port=self.port,
+            log_level="warning",
+            access_log=False,
+            lifespan="off",
+        )
+        self._server = uvicorn.Server(config)
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                self._task.result()
+            await asyncio.sleep(0.01)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.should_exit = True
+        if self._task is not None:
+            await self._task
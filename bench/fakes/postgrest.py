@@ -0,0 +1,468 @@
+"""
+PostgREST-совместимая заглушка поверх таблиц в памяти.
+
+Покрывает подмножество API, которое использует bot/services/supabase_client.py:
+select=, фильтры eq/neq/lt/lte/gt/gte/in/is, order, limit/offset,
+POST (объект или массив), PATCH, DELETE и RPC. RPC лояльности, сегментов и синхронизации реализованы
+на Python с той же семантикой, что и SQL-функции в migrations/.
+
+Для замеров против настоящей БД можно направить SUPABASE_URL на реальный
+PostgREST - драйверы в bench/load.py от заглушки не зависят.
+"""
+import itertools
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from bench.fakes.common import UpstreamStats, install_upstream_middleware
+
+# Уникальные колонки (кроме id): нарушение -> 409, как у PostgREST
+UNIQUE_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "users": ("tg_id", "phone"),
+    "yclients_visits": ("visit_id",),
+    "webhook_log": ("webhook_id",),
+    "loyalty_balances": ("user_id",),
+    "app_settings": ("key",),
+}
+
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(value: datetime) -> str:
+    return value.isoformat()
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _coerce(raw: str, sample: Any) -> Any:
+    """Приводит значение фильтра к типу значения в строке таблицы"""
+    if isinstance(sample, bool):
+        return raw.lower() == "true"
+    if isinstance(sample, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return float(raw)
+    if isinstance(sample, float):
+        return float(raw)
+    return raw
+
+
+def _compare(op: str, value: Any, raw: str) -> bool:
+    if op == "is":
+        expected = {"null": None, "true": True, "false": False}.get(raw.lower(), raw)
+        return value is expected
+    if op == "in":
+        options = [item.strip().strip('"') for item in raw.strip("()").split(",") if item.strip()]
+        return value is not None and any(value == _coerce(option, value) for option in options)
+    if value is None:
+        return False
+    target = _coerce(raw, value)
+    try:
+        if op == "eq":
+            return value == target
+        if op == "neq":
+            return value != target
+        if op == "lt":
+            return value < target
+        if op == "lte":
+            return value <= target
+        if op == "gt":
+            return value > target
+        if op == "gte":
+            return value >= target
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class InMemoryDB:
+    """Таблицы PostgREST в памяти"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self._ids: Dict[str, Iterable[int]] = {}
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        return self.tables.setdefault(table, [])
+
+    def next_id(self, table: str) -> int:
+        counter = self._ids.get(table)
+        if counter is None:
+            start = max((row.get("id") or 0 for row in self.rows(table)), default=0) + 1
+            counter = self._ids[table] = itertools.count(start)
+        return next(counter)
+
+    def insert(self, table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        rows = self.rows(table)
+        stored = dict(row)
+        if "id" not in stored and table not in ("loyalty_balances", "app_settings"):
+            stored["id"] = self.next_id(table)
+        stored.setdefault("created_at", _iso(_now()))
+        for column in UNIQUE_COLUMNS.get(table, ()):
+            value = stored.get(column)
+            if value is not None and any(existing.get(column) == value for existing in rows):
+                raise KeyError(f'duplicate key value violates unique constraint "{table}_{column}_key"')
+        rows.append(stored)
+        return stored
+
+    def filter(self, table: str, filters: List[Tuple[str, str, str]]) -> List[Dict[str, Any]]:
+        return [
+            row for row in self.rows(table)
+            if all(_compare(op, row.get(column), raw) for column, op, raw in filters)
+        ]
+
+
+def _parse_filters(request: Request) -> List[Tuple[str, str, str]]:
+    filters = []
+    for key, value in request.query_params.multi_items():
+        if key in _RESERVED_PARAMS:
+            continue
+        op, _, raw = value.partition(".")
+        filters.append((key, op, raw))
+    return filters
+
+
+def _apply_order(rows: List[Dict[str, Any]], order: Optional[str]) -> List[Dict[str, Any]]:
+    if not order:
+        return rows
+    for part in reversed(order.split(",")):
+        column, _, direction = part.partition(".")
+        desc = direction.startswith("desc")
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        present.sort(key=lambda row: row[column], reverse=desc)
+        rows = present + missing if not desc else missing + present
+    return rows
+
+
+def _split_select(select: str) -> List[str]:
+    """Разбивает select по запятым верхнего уровня (встраивания table(a,b) не режутся)"""
+    parts, depth, current = [], 0, ""
+    for char in select:
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    parts.append(current.strip())
+    return [part for part in parts if part]
+
+
+def _project(
+    rows: List[Dict[str, Any]],
+    select: Optional[str],
+    db: Optional["InMemoryDB"] = None,
+    table: str = "",
+) -> List[Dict[str, Any]]:
+    if not select or select == "*":
+        return [dict(row) for row in rows]
+    columns, embeds = [], []
+    for part in _split_select(select):
+        name, _, inner = part.partition("(")
+        if inner and db is not None:
+            embeds.append((name.strip(), inner.rstrip(")")))
+        else:
+            columns.append(part)
+    result = []
+    for row in rows:
+        item = dict(row) if "*" in columns else {column: row.get(column) for column in columns}
+        # Встраивание один-к-одному по внешнему ключу <таблица в ед. числе>_id (users -> user_id)
+        foreign_key = f"{table.rstrip('s')}_id"
+        for embedded, inner in embeds:
+            related = [
+                other for other in db.rows(embedded)
+                if other.get(foreign_key) is not None and other.get(foreign_key) == row.get("id")
+            ]
+            item[embedded] = _project(related[:1], inner)[0] if related else None
+        result.append(item)
+    return result
+
+
+class FakePostgREST:
+    """FastAPI-приложение заглушки и реализации RPC"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, prefix: str = "/rest/v1"):
+        self.db = InMemoryDB()
+        self.stats = UpstreamStats("postgrest")
+        self.rpcs: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            "get_user_available_balance": self._rpc_get_user_available_balance,
+            "refresh_user_balance": self._rpc_get_user_available_balance,
+            "adjust_loyalty_balance": self._rpc_adjust_loyalty_balance,
+            "spend_loyalty_points": self._rpc_spend_loyalty_points,
+            "expire_loyalty_points": self._rpc_expire_loyalty_points,
+            "select_segment_users": self._rpc_select_segment_users,
+            "select_sync_candidates": self._rpc_select_sync_candidates,
+            "touch_user_interaction": self._rpc_touch_user_interaction,
+            "bulk_patch": self._rpc_bulk_patch,
+        }
+        self.app = self._build_app(latency_ms, jitter_ms, prefix.rstrip("/"))
+
+    # --- RPC лояльности -------------------------------------------------
+
+    def _active_earns(self, user_id: int) -> List[Dict[str, Any]]:
+        now = _iso(_now())
+        earns = [
+            row for row in self.db.rows("loyalty_transactions")
+            if row.get("user_id") == user_id
+            and row.get("transaction_type") == "earn"
+            and (row.get("remaining_amount") or 0) > 0
+            and (row.get("expires_at") or "") > now
+        ]
+        earns.sort(key=lambda row: (row["expires_at"], row["id"]))
+        return earns
+
+    def _available(self, user_id: int) -> int:
+        return sum(row["remaining_amount"] for row in self._active_earns(user_id))
+
+    def _set_user_balance(self, user_id: int, balance: int) -> None:
+        for user in self.db.filter("users", [("id", "eq", str(user_id))]):
+            user["balance"] = balance
+            user["updated_at"] = _iso(_now())
+
+    def _burn(self, user_id: int, amount: int) -> int:
+        left = amount
+        for row in self._active_earns(user_id):
+            if left <= 0:
+                break
+            burned = min(row["remaining_amount"], left)
+            row["remaining_amount"] -= burned
+            left -= burned
+        return amount - left
+
+    def _add_transaction(self, user_id: int, amount: int, kind: str, description: str, **extra: Any) -> None:
+        self.db.insert("loyalty_transactions", {
+            "user_id": user_id,
+            "amount": amount,
+            "transaction_type": kind,
+            "description": description,
+            "remaining_amount": extra.pop("remaining_amount", 0),
+            **extra,
+        })
+
+    def _rpc_get_user_available_balance(self, params: Dict[str, Any]) -> int:
+        return self._available(int(params["p_user_id"]))
+
+    def _rpc_adjust_loyalty_balance(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        user_id = int(params["p_user_id"])
+        amount = int(params["p_amount"])
+        if amount > 0:
+            days = int(params.get("p_expiration_days") or 90)
+            self._add_transaction(
+                user_id, amount, "earn", params.get("p_description") or "",
+                expires_at=_iso(_now() + timedelta(days=days)),
+                remaining_amount=amount,
+            )
+        elif amount < 0:
+            self._burn(user_id, -amount)
+            self._add_transaction(user_id, amount, "sync_correction", params.get("p_description") or "")
+        balance = self._available(user_id)
+        self._set_user_balance(user_id, balance)
+        return {"success": True, "new_balance": balance}
+
+    def _rpc_spend_loyalty_points(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        user_id = int(params["p_user_id"])
+        amount = int(params["p_amount_to_spend"])
+        percentage = float(params.get("p_max_spend_percentage") or 0.3)
+        max_allowed = int(int(params["p_total_bill_amount"]) * percentage)
+        if amount > max_allowed:
+            return {"success": False, "error": f"Можно оплатить баллами максимум {max_allowed} баллов"}
+        available = self._available(user_id)
+        if amount > available:
+            return {"success": False, "error": f"Недостаточно баллов. Доступно: {available}, требуется: {amount}"}
+        self._burn(user_id, amount)
+        self._add_transaction(user_id, -amount, "spend", params.get("p_description") or f"Списание {amount} баллов")
+        self._set_user_balance(user_id, available - amount)
+        return {"success": True, "spent_amount": amount, "remaining_balance": available - amount}
+
+    def _rpc_expire_loyalty_points(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        batch_size = int(params.get("p_batch_size") or 1000)
+        now = _iso(_now())
+        expired: Dict[int, int] = {}
+        rows = 0
+        for row in self.db.rows("loyalty_transactions"):
+            if rows >= batch_size:
+                break
+            if row.get("transaction_type") == "earn" and (row.get("remaining_amount") or 0) > 0 \
+                    and (row.get("expires_at") or "") <= now:
+                expired[row["user_id"]] = expired.get(row["user_id"], 0) + row["remaining_amount"]
+                row["remaining_amount"] = 0
+                rows += 1
+        for user_id, points in expired.items():
+            self._add_transaction(user_id, -points, "expire", f"Сгорание {points} баллов (истек срок действия)")
+            self._set_user_balance(user_id, self._available(user_id))
+        return {"expired_rows": rows, "expired_points": sum(expired.values()), "users": len(expired)}
+
+    # --- RPC сегментов рассылок (миграция 024) -------------------------
+
+    def _rpc_select_segment_users(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        segment = params.get("p_segment") or {}
+        balances = {row["user_id"]: row.get("available") for row in self.db.rows("loyalty_balances")}
+        visits: Dict[int, List[Dict[str, Any]]] = {}
+        for visit in self.db.rows("yclients_visits"):
+            if visit.get("status") == "Визит состоялся":
+                visits.setdefault(visit["user_id"], []).append(visit)
+
+        def in_range(value: Any, low_key: str, high_key: str, parse: Callable[[Any], Any]) -> bool:
+            if segment.get(low_key) is not None and (value is None or value < parse(segment[low_key])):
+                return False
+            # Даты: граница "до" исключающая, числа - включительно
+            if segment.get(high_key) is not None:
+                high = parse(segment[high_key])
+                if value is None or (value >= high if isinstance(high, datetime) else value > high):
+                    return False
+            return True
+
+        tg_ids = []
+        for user in self.db.rows("users"):
+            if user.get("tg_id") is None:
+                continue
+            user_visits = visits.get(user["id"], [])
+            balance = balances.get(user["id"])
+            balance = user.get("balance") or 0 if balance is None else balance
+            last_visit = max((_parse_ts(v.get("visit_datetime")) for v in user_visits if v.get("visit_datetime")), default=None)
+            masters = {v.get("master") for v in user_visits if v.get("master")}
+            services = {name for v in user_visits for name in (v.get("services") or []) if name}
+            if not (
+                in_range(balance, "balance_min", "balance_max", int)
+                and in_range(_parse_ts(user.get("created_at")), "registered_from", "registered_to", _parse_ts)
+                and in_range(last_visit, "last_visit_from", "last_visit_to", _parse_ts)
+                and in_range(len(user_visits), "visits_min", "visits_max", int)
+                and in_range(sum(float(v.get("amount") or 0) for v in user_visits), "spent_min", "spent_max", float)
+                and (not segment.get("masters") or masters & set(segment["masters"]))
+                and (not segment.get("services") or services & set(segment["services"]))
+            ):
+                continue
+            tg_ids.append(user["tg_id"])
+        if params.get("p_count_only"):
+            return {"count": len(tg_ids)}
+        return {"count": len(tg_ids), "tg_ids": sorted(tg_ids)}
+
+    # --- RPC синхронизации (миграция 029) -------------------------------
+
+    def _rpc_select_sync_candidates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        now = _now()
+        hot_since = _iso(now - timedelta(days=int(params.get("p_hot_days") or 7)))
+        hot_until = _iso(now + timedelta(days=int(params.get("p_hot_days") or 7)))
+        warm_since = _iso(now - timedelta(days=int(params.get("p_warm_days") or 90)))
+        appointments: Dict[int, str] = {}
+        for visit in self.db.rows("yclients_visits"):
+            at = visit.get("visit_datetime") or ""
+            if at > _iso(now) and visit.get("status") not in ("Отменено", "Визит состоялся", "Не пришли"):
+                user_id = visit["user_id"]
+                appointments[user_id] = min(at, appointments.get(user_id, at))
+        candidates = []
+        for user in self.db.rows("users"):
+            if not user.get("active", True) or (user.get("sync_next_due_at") or "") > _iso(now):
+                continue
+            appointment = appointments.get(user["id"])
+            interaction = user.get("last_interaction_at") or ""
+            if (appointment and appointment <= hot_until) or interaction >= hot_since:
+                tier = 0
+            elif appointment or interaction >= warm_since:
+                tier = 1
+            else:
+                tier = 2
+            candidates.append({**user, "sync_tier": tier, "next_appointment_at": appointment})
+        candidates.sort(key=lambda row: (
+            row["sync_tier"],
+            row["next_appointment_at"] or "~",
+            row.get("sync_next_due_at") or "",
+            row["id"],
+        ))
+        return candidates[:int(params.get("p_limit") or 100)]
+
+    def _rpc_touch_user_interaction(self, params: Dict[str, Any]) -> None:
+        now = _now()
+        due = now + timedelta(seconds=int(params.get("p_sync_due_seconds") or 0))
+        for user in self.db.filter("users", [("tg_id", "eq", str(params["p_tg_id"]))]):
+            user["last_interaction_at"] = _iso(now)
+            current = _parse_ts(user.get("sync_next_due_at")) or now
+            user["sync_next_due_at"] = _iso(min(current, due))
+        return None
+
+    def _rpc_bulk_patch(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        updated = 0
+        for item in params.get("p_rows") or []:
+            for row in self.db.filter(params["p_table"], [("id", "eq", str(item["id"]))]):
+                row.update({key: value for key, value in item.items() if key != "id"})
+                updated += 1
+        return {"updated": updated}
+
+    # --- HTTP -----------------------------------------------------------
+
+    def _build_app(self, latency_ms: float, jitter_ms: float, prefix: str) -> FastAPI:
+        app = FastAPI()
+        install_upstream_middleware(
+            app,
+            self.stats,
+            latency_ms=latency_ms,
+            jitter_ms=jitter_ms,
+            expand_params=("table", "name"),
+        )
+
+        def error(status: int, code: str, message: str) -> JSONResponse:
+            return JSONResponse({"code": code, "details": None, "hint": None, "message": message}, status_code=status)
+
+        @app.post(prefix + "/rpc/{name}")
+        async def call_rpc(name: str, request: Request):
+            handler = self.rpcs.get(name)
+            if handler is None:
+                return error(404, "PGRST202", f"Could not find the function public.{name}")
+            params = await request.json() if await request.body() else {}
+            return JSONResponse(handler(params))
+
+        @app.get(prefix + "/{table}")
+        async def select_rows(table: str, request: Request):
+            params = request.query_params
+            rows = _apply_order(self.db.filter(table, _parse_filters(request)), params.get("order"))
+            offset = int(params.get("offset") or 0)
+            limit = params.get("limit")
+            rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+            return JSONResponse(_project(rows, params.get("select"), self.db, table))
+
+        @app.post(prefix + "/{table}")
+        async def insert_rows(table: str, request: Request):
+            payload = await request.json()
+            items = payload if isinstance(payload, list) else [payload]
+            inserted = []
+            try:
+                for item in items:
+                    inserted.append(self.db.insert(table, item))
+            except KeyError as exc:
+                # PostgREST выполняет вставку в транзакции: откатываем уже добавленные строки
+                for row in inserted:
+                    self.db.rows(table).remove(row)
+                return error(409, "23505", str(exc.args[0]))
+            return JSONResponse([dict(row) for row in inserted], status_code=201)
+
+        @app.patch(prefix + "/{table}")
+        async def update_rows(table: str, request: Request):
+            changes = await request.json()
+            rows = self.db.filter(table, _parse_filters(request))
+            for row in rows:
+                row.update(changes)
+            return JSONResponse([dict(row) for row in rows])
+
+        @app.delete(prefix + "/{table}")
+        async def delete_rows(table: str, request: Request):
+            rows = self.db.filter(table, _parse_filters(request))
+            if rows:
+                doomed = {id(row) for row in rows}
+                self.db.tables[table] = [row for row in self.db.rows(table) if id(row) not in doomed]
+            return Response(status_code=204)
+
+        return app
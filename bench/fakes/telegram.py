@@ -0,0 +1,88 @@
+"""
+Заглушка Telegram Bot API: принимает вызовы методов, ничего не отправляет.
+
+Умеет имитировать лимит Telegram (429 с retry_after) и пользователей,
+заблокировавших бота (403).
+"""
+import time
+from typing import Any, Dict, Set
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from bench.fakes.common import RateLimiter, UpstreamStats, install_upstream_middleware
+
+
+class FakeTelegram:
+    """Приемник вызовов Bot API"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        rps_quota: float = 0.0,
+    ):
+        self.blocked_chats: Set[int] = set()
+        self.sent_messages = 0
+        self._message_id = 0
+        self.stats = UpstreamStats("telegram")
+        self.app = self._build_app(latency_ms, jitter_ms, RateLimiter(rps_quota))
+
+    async def _read_params(self, request: Request) -> Dict[str, Any]:
+        content_type = request.headers.get("content-type", "")
+        if "application/json" in content_type:
+            return await request.json()
+        form = await request.form()
+        return {key: value for key, value in form.items()}
+
+    def _message(self, chat_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._message_id += 1
+        self.sent_messages += 1
+        message: Dict[str, Any] = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
+
+    def _build_app(self, latency_ms: float, jitter_ms: float, limiter: RateLimiter) -> FastAPI:
+        app = FastAPI()
+        install_upstream_middleware(
+            app,
+            self.stats,
+            latency_ms=latency_ms,
+            jitter_ms=jitter_ms,
+            limiter=limiter,
+            expand_params=("method",),
+            throttled_response=lambda: JSONResponse(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                },
+                status_code=429,
+            ),
+        )
+
+        @app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+        async def call_method(token: str, method: str, request: Request):
+            params = await self._read_params(request)
+            name = method.lower()
+            if name == "getme":
+                return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+            chat_id = params.get("chat_id")
+            if chat_id is not None and int(chat_id) in self.blocked_chats:
+                return JSONResponse(
+                    {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"},
+                    status_code=403,
+                )
+            if name.startswith("send") and chat_id is not None:
+                return {"ok": True, "result": self._message(chat_id, params)}
+            return {"ok": True, "result": True}
+
+        return app
@@ -0,0 +1,123 @@
+"""
+Заглушка YClients API v1 с настраиваемой задержкой и квотой запросов.
+
+Поддерживает вызовы, которые делает bot/services/yclients_api.py:
+поиск клиента по телефону, карточку клиента, карты лояльности,
+ручные операции по карте и историю записей.
+"""
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from bench.fakes.common import RateLimiter, UpstreamStats, install_upstream_middleware
+
+
+class FakeYClients:
+    """Данные и FastAPI-приложение заглушки YClients"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        rps_quota: float = 0.0,
+    ):
+        self.clients_by_phone: Dict[str, Dict[str, Any]] = {}
+        self.clients: Dict[int, Dict[str, Any]] = {}
+        self.cards: Dict[int, Dict[str, Any]] = {}
+        self.records: Dict[int, List[Dict[str, Any]]] = {}
+        self.stats = UpstreamStats("yclients")
+        self.app = self._build_app(latency_ms, jitter_ms, RateLimiter(rps_quota))
+
+    def add_client(
+        self,
+        client_id: int,
+        phone: str,
+        balance: int = 0,
+        visits: int = 0,
+        with_card: bool = True,
+    ) -> None:
+        client = {"id": client_id, "name": f"Клиент {client_id}", "phone": phone}
+        self.clients[client_id] = client
+        self.clients_by_phone[phone] = client
+        if with_card:
+            self.cards[client_id] = {
+                "id": 500_000 + client_id,
+                "number": f"{client_id:010d}",
+                "balance": balance,
+                "points": balance,
+                "type": {"id": 1, "title": "Бонусная карта"},
+            }
+        if visits:
+            # bench.visit_normalize импортирует bot.config: импортируем после настройки окружения
+            from bench.visit_normalize import make_records
+
+            records = make_records(visits, seed=client_id)
+            for index, record in enumerate(records):
+                record["id"] = client_id * 10_000 + index
+            self.records[client_id] = records
+
+    def _card_by_id(self, card_id: int) -> Optional[Dict[str, Any]]:
+        for card in self.cards.values():
+            if card["id"] == card_id:
+                return card
+        return None
+
+    def _build_app(self, latency_ms: float, jitter_ms: float, limiter: RateLimiter) -> FastAPI:
+        app = FastAPI()
+        install_upstream_middleware(
+            app,
+            self.stats,
+            latency_ms=latency_ms,
+            jitter_ms=jitter_ms,
+            limiter=limiter,
+            throttled_response=lambda: JSONResponse(
+                {"success": False, "data": None, "meta": {"message": "Too many requests"}},
+                status_code=429,
+            ),
+        )
+
+        @app.get("/clients/{company_id}")
+        async def find_clients(company_id: str, phone: str = ""):
+            client = self.clients_by_phone.get(phone)
+            return {"success": True, "data": [client] if client else [], "meta": {}}
+
+        @app.get("/clients/{company_id}/{client_id}")
+        async def get_client(company_id: str, client_id: int):
+            client = self.clients.get(client_id)
+            if not client:
+                return JSONResponse({"success": False, "meta": {"message": "Client not found"}}, status_code=404)
+            return {"success": True, "data": client, "meta": {}}
+
+        @app.get("/loyalty/client_cards/{client_id}")
+        async def get_client_cards(client_id: int):
+            card = self.cards.get(client_id)
+            return {"success": True, "data": [card] if card else [], "meta": {}}
+
+        @app.post("/company/{company_id}/loyalty/cards/{card_id}/manual_transaction")
+        async def manual_transaction(company_id: str, card_id: int, request: Request):
+            card = self._card_by_id(card_id)
+            if not card:
+                return JSONResponse({"success": False, "meta": {"message": "Card not found"}}, status_code=404)
+            payload = await request.json()
+            amount = float(payload.get("amount") or 0)
+            if payload.get("operation_type") in ("debit", "withdrawal"):
+                amount = -abs(amount)
+            card["balance"] = card["points"] = int(card["balance"] + amount)
+            return {"success": True, "data": {"card_id": card_id, "balance": card["balance"]}, "meta": {}}
+
+        @app.get("/records/{company_id}")
+        async def get_records(company_id: str, client_id: int = 0, count: int = 50, page: int = 1):
+            records = self.records.get(client_id, [])
+            start = (max(page, 1) - 1) * count
+            return {"success": True, "data": records[start:start + count], "meta": {"count": len(records)}}
+
+        @app.get("/companies")
+        async def get_companies():
+            return {"success": True, "data": [{"id": 1, "title": "Bench"}], "meta": {}}
+
+        @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+        async def not_found(path: str):
+            return JSONResponse({"success": False, "meta": {"message": "Not found"}}, status_code=404)
+
+        return app
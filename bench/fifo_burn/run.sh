@@ -0,0 +1,61 @@
+#!/usr/bin/env bash
+# Сравнение FIFO-списания: цикл PL/pgSQL (миграции до 019) и один UPDATE (миграция 020).
+# Нужен локальный PostgreSQL с psql/pgbench/createdb. Создает две временные БД.
+#
+#   bench/fifo_burn/run.sh
+#   USERS=20 ROWS_PER_USER=2000 BURN=5000 CLIENTS=16 DURATION=60 bench/fifo_burn/run.sh
+#
+# USERS - пользователей, ROWS_PER_USER - длина истории earn-транзакций,
+# BURN - сколько баллов списывать за раз. Второй прогон идет по HOT_USERS
+# пользователям: клиенты ждут блокировку одной строки, и разница задержек
+# между прогонами показывает время удержания блокировки.
+set -euo pipefail
+
+ROOT="$(cd "$(dirname "$0")/../.." && pwd)"
+HERE="$ROOT/bench/fifo_burn"
+
+USERS="${USERS:-200}"
+ROWS_PER_USER="${ROWS_PER_USER:-500}"
+BURN="${BURN:-1000}"
+CLIENTS="${CLIENTS:-8}"
+DURATION="${DURATION:-30}"
+HOT_USERS="${HOT_USERS:-2}"
+DB_PREFIX="${DB_PREFIX:-cveti_fifo_bench}"
+
+run_variant() {
+    local name="$1"
+    local last_migration="$2"
+    local db="${DB_PREFIX}_${name}"
+
+    dropdb --if-exists "$db"
+    createdb "$db"
+
+    for migration in "$ROOT"/migrations/*.sql; do
+        local number
+        number="$(basename "$migration" | cut -c1-3)"
+        if [[ "$number" > "$last_migration" ]]; then
+            break
+        fi
+        psql -q -v ON_ERROR_STOP=1 -d "$db" -f "$migration" > /dev/null
+    done
+
+    psql -q -v ON_ERROR_STOP=1 -d "$db" \
+        -v users="$USERS" -v rows_per_user="$ROWS_PER_USER" \
+        -f "$HERE/seed.sql" > /dev/null
+
+    local target_users
+    for target_users in "$USERS" "$HOT_USERS"; do
+        echo "=== $name (migrations up to $last_migration), users in play: $target_users ==="
+        # -r: средняя задержка по каждому запросу (вместе с ожиданием блокировок)
+        pgbench -n -r -c "$CLIENTS" -j "$CLIENTS" -T "$DURATION" \
+            -D users="$target_users" -D burn="$BURN" \
+            -f "$HERE/spend.sql" "$db" \
+            | grep -E "tps|latency average|spend_loyalty_points|adjust_loyalty_balance|transactions actually"
+    done
+
+    dropdb "$db"
+}
+
+echo "users=$USERS rows_per_user=$ROWS_PER_USER burn=$BURN clients=$CLIENTS duration=${DURATION}s"
+run_variant loop 019
+run_variant set_based 020
@@ -0,0 +1,24 @@
+-- Заполнение БД для бенчмарка FIFO-списания
+-- Переменные psql: users (количество пользователей), rows_per_user (earn-транзакций на пользователя)
+
+TRUNCATE loyalty_transactions, loyalty_balances, users RESTART IDENTITY CASCADE;
+
+INSERT INTO users (tg_id, phone, name)
+SELECT g, '7900' || lpad(g::TEXT, 7, '0'), 'bench ' || g
+FROM generate_series(1, :users) AS g;
+
+-- По 10 баллов в строке, истечение растет с номером строки (FIFO-порядок)
+INSERT INTO loyalty_transactions (user_id, amount, transaction_type, description, expires_at, remaining_amount)
+SELECT u, 10, 'earn', 'bench', NOW() + INTERVAL '30 days' + (r || ' minutes')::INTERVAL, 10
+FROM generate_series(1, :users) AS u, generate_series(1, :rows_per_user) AS r;
+
+SELECT refresh_user_balance(id) FROM users;
+
+UPDATE users
+SET balance = lb.available
+FROM loyalty_balances lb
+WHERE lb.user_id = users.id;
+
+VACUUM ANALYZE loyalty_transactions;
+VACUUM ANALYZE loyalty_balances;
+VACUUM ANALYZE users;
@@ -0,0 +1,5 @@
+-- pgbench: списание :burn баллов по FIFO и возврат той же суммы начислением,
+-- чтобы баланс не иссякал за время прогона
+\set uid random(1, :users)
+SELECT spend_loyalty_points(:uid, :burn, :burn * 10, 0.3, 'bench spend');
+SELECT adjust_loyalty_balance(:uid, :burn, 'bench refill', 90);
@@ -0,0 +1,141 @@
+"""
+Микробенчмарк JSON на payload'ах эндпоинтов /api/admin/users и /api/app/content.
+
+Для каждого эндпоинта сравнивает путь "как раньше" (httpx response.json() через
+stdlib json, jsonable_encoder FastAPI и JSONResponse) с быстрым путем
+(fast_json.loads и FastJSONResponse без jsonable_encoder).
+Без установленного orjson быстрый путь тоже идет через stdlib json.
+
+Использование:
+    python -m bench.json_encode
+    python -m bench.json_encode --users 20000 --content-items 300 --repeat 10
+"""
+import argparse
+import gc
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api.responses import FastJSONResponse
+from bot.services import fast_json
+
+
+def make_users(count: int, seed: int = 11) -> List[Dict[str, Any]]:
+    """Строки таблицы users в том виде, в каком их отдает PostgREST"""
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    users = []
+    for index in range(count):
+        created = now - timedelta(days=rnd.randint(1, 900), seconds=rnd.randint(0, 86400))
+        users.append({
+            "id": f"{rnd.getrandbits(128):032x}",
+            "tg_id": 100_000_000 + index,
+            "phone": f"+7900{index:07d}",
+            "name": f"Клиент {index}",
+            "balance": rnd.randint(0, 5000),
+            "yclients_id": rnd.randint(1, 10**8) if rnd.random() < 0.8 else None,
+            "loyalty_card_number": f"{rnd.randint(10**11, 10**12 - 1)}" if rnd.random() < 0.5 else None,
+            "loyalty_status": rnd.choice(["active", "inactive", None]),
+            "loyalty_last_sync": (created + timedelta(days=1)).isoformat(),
+            "visits_last_sync": (created + timedelta(days=2)).isoformat() if rnd.random() < 0.7 else None,
+            "support_mode": rnd.random() < 0.02,
+            "active": True,
+            "created_at": created.isoformat(),
+            "updated_at": (created + timedelta(days=3)).isoformat(),
+        })
+    return users
+
+
+def make_content(count: int, seed: int = 13) -> Dict[str, Any]:
+    """Ответ /api/app/content: услуги, мастера, акции"""
+    rnd = random.Random(seed)
+    base = "https://storage.example.com/storage/v1/object/public/images"
+
+    def item(kind: str, index: int) -> Dict[str, Any]:
+        return {
+            "id": index,
+            "title": f"{kind} {index}",
+            "name": f"{kind} {index}",
+            "description": "Описание " * rnd.randint(5, 40),
+            "price": rnd.choice([1500, 2500, "от 3000", None]),
+            "image_url": f"{base}/{kind}/{index}.jpg",
+            "photo_url": f"{base}/{kind}/{index}_photo.jpg",
+            "order": index,
+            "is_active": True,
+            "created_at": "2024-05-01T10:00:00+00:00",
+        }
+
+    return {
+        "services": [item("service", index) for index in range(count)],
+        "masters": [item("master", index) for index in range(max(count // 5, 1))],
+        "promotions": [item("promo", index) for index in range(max(count // 10, 1))],
+        "booking_url": "https://n12345.yclients.com/",
+        "storage_public_url_base": base,
+        "loyalty_max_spend_percentage": 0.3,
+        "loyalty_expiration_days": 90,
+    }
+
+
+def _measure(func: Callable[[], Any], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _stdlib_path(body: bytes) -> bytes:
+    """PostgREST body -> stdlib json -> jsonable_encoder -> JSONResponse"""
+    data = json.loads(body)
+    return JSONResponse(jsonable_encoder(data)).body
+
+
+def _fast_path(body: bytes) -> bytes:
+    """PostgREST body -> fast_json.loads -> FastJSONResponse"""
+    return FastJSONResponse(fast_json.loads(body)).body
+
+
+def run(users_count: int, content_items: int, repeat: int) -> None:
+    payloads = {
+        "/api/admin/users": json.dumps(make_users(users_count)).encode("utf-8"),
+        "/api/app/content": json.dumps(make_content(content_items)).encode("utf-8"),
+    }
+    backend = "orjson" if fast_json.HAS_ORJSON else "stdlib json (orjson not installed)"
+    print(f"fast_json backend: {backend}, repeat: {repeat}")
+    for endpoint, body in payloads.items():
+        if json.loads(_stdlib_path(body)) != json.loads(_fast_path(body)):
+            raise SystemExit(f"Fast path output differs for {endpoint}")
+        print(f"\n{endpoint}: {len(body) / 1024:.0f} KiB")
+        stages = (
+            ("decode  stdlib json.loads", lambda: json.loads(body)),
+            ("decode  fast_json.loads", lambda: fast_json.loads(body)),
+            ("full    stdlib + jsonable_encoder", lambda: _stdlib_path(body)),
+            ("full    fast_json + FastJSONResponse", lambda: _fast_path(body)),
+        )
+        for label, func in stages:
+            timings = _measure(func, repeat)
+            print(
+                f"  {label:<38} median {statistics.median(timings) * 1000:8.2f} ms"
+                f"  min {min(timings) * 1000:8.2f} ms"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark JSON decode/encode for admin users and content endpoints")
+    parser.add_argument("--users", type=int, default=5000, help="Rows in the users list")
+    parser.add_argument("--content-items", type=int, default=100, help="Services in the content payload")
+    parser.add_argument("--repeat", type=int, default=7, help="Measurements per variant")
+    args = parser.parse_args()
+    run(args.users, args.content_items, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
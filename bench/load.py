@@ -0,0 +1,409 @@
+"""
+Нагрузочные сценарии против локальных заглушек YClients, PostgREST и Telegram.
+
+Поднимает заглушки (bench/fakes) на свободных портах, направляет на них
+приложение через переменные окружения и гоняет сценарий:
+
+    profile    GET /api/app/profile с подписанным initData (через ASGI)
+    webhook    POST /webhook/yclients (вместе с фоновой обработкой платежа)
+    broadcast  process_broadcast по всем пользователям
+    sync       один проход периодической синхронизации (sync_all_users)
+
+Выводит p50/p99/max задержки, пропускную способность и число запросов
+к каждому внешнему сервису (по маршрутам и статусам).
+
+Использование:
+    python -m bench.load profile --users 200 --requests 1000 --concurrency 20
+    python -m bench.load webhook --requests 300 --yclients-latency-ms 120 --yclients-rps 5
+    python -m bench.load broadcast --users 2000 --telegram-rps 30
+    python -m bench.load sync --users 100 --yclients-latency-ms 80
+    python -m bench.load profile --json > profile.json
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+from urllib.parse import urlencode
+
+from bench.fakes import FakePostgREST, FakeServer, FakeTelegram, FakeYClients
+
+BOT_TOKEN = "123456:BENCH-TOKEN"
+WEBHOOK_SECRET = "bench-secret"
+COMPANY_ID = "1"
+
+
+class LatencyRecorder:
+    """Задержки операций сценария (секунды)"""
+
+    def __init__(self):
+        self.samples: List[float] = []
+        self.errors = 0
+
+    async def measure(self, operation: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        try:
+            return await operation()
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+        return ordered[index]
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        count = len(self.samples)
+        return {
+            "operations": count,
+            "errors": self.errors,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_ops": round(count / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(max(self.samples, default=0.0) * 1000, 2),
+            "mean_ms": round(statistics.fmean(self.samples) * 1000, 2) if count else 0.0,
+        }
+
+
+def sign_init_data(tg_id: int, bot_token: str = BOT_TOKEN) -> str:
+    """initData Telegram WebApp с корректной подписью (как проверяет bot/services/auth.py)"""
+    fields = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"bench-{tg_id}",
+        "user": json.dumps({"id": tg_id, "first_name": "Bench"}, separators=(",", ":")),
+    }
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def seed(postgrest: FakePostgREST, yclients: FakeYClients, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Пользователи в БД и соответствующие клиенты в YClients"""
+    rnd = random.Random(7)
+    db = postgrest.db
+    now = datetime.now(timezone.utc)
+    users = []
+    for index in range(1, args.users + 1):
+        phone_digits = f"7900{index:07d}"
+        yclients_id = 1000 + index
+        balance = rnd.randint(0, 3000)
+        user = db.insert("users", {
+            "tg_id": 100_000 + index,
+            "phone": f"+{phone_digits}",  # формат normalize_phone
+            "name": f"Bench {index}",
+            "yclients_id": yclients_id if index % 5 else None,
+            "balance": balance,
+            "active": True,
+            "created_at": (now - timedelta(days=rnd.randint(1, 700))).isoformat(),
+        })
+        for _ in range(args.transactions_per_user):
+            amount = rnd.randint(10, 300)
+            db.insert("loyalty_transactions", {
+                "user_id": user["id"],
+                "amount": amount,
+                "transaction_type": "earn",
+                "description": "bench",
+                "expires_at": (now + timedelta(days=rnd.randint(-30, 90))).isoformat(),
+                "remaining_amount": amount,
+            })
+        # Баланс в YClients немного расходится с локальным, чтобы синхронизация что-то писала
+        yclients.add_client(yclients_id, phone_digits, balance=balance + rnd.choice([0, 0, 0, 50]), visits=args.visits_per_user)
+        users.append(user)
+    return users
+
+
+def configure_environment(postgrest: FakeServer, yclients: FakeServer, telegram: FakeServer) -> None:
+    """Переменные окружения для bot.config (до импорта модулей приложения)"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_WEBHOOK_SECRET": "",
+        "TELEGRAM_API_SERVER": telegram.url,
+        "SUPABASE_URL": postgrest.url,
+        "SUPABASE_KEY": "bench",
+        "SUPABASE_REST_PATH": "rest/v1",
+        "YCLIENTS_BASE_URL": yclients.url,
+        "YCLIENTS_PARTNER_TOKEN": "bench",
+        "YCLIENTS_USER_TOKEN": "bench",
+        "YCLIENTS_COMPANY_ID": COMPANY_ID,
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "ADMIN_IDS": "",
+    })
+
+
+async def run_concurrent(
+    recorder: LatencyRecorder,
+    total: int,
+    concurrency: int,
+    operation: Callable[[int], Awaitable[Any]],
+) -> float:
+    """Выполняет total операций не более чем concurrency одновременно, возвращает время"""
+    counter = iter(range(total))
+
+    async def worker():
+        for index in counter:
+            try:
+                await recorder.measure(lambda: operation(index))
+            except Exception as exc:
+                logging.getLogger(__name__).debug(f"Operation {index} failed: {exc}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return time.perf_counter() - started
+
+
+async def scenario_profile(args: argparse.Namespace, users: List[Dict[str, Any]], recorder: LatencyRecorder) -> float:
+    import httpx
+    from api.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def request_profile(index: int):
+            user = users[index % len(users)]
+            response = await client.get(
+                "/api/app/profile",
+                headers={"X-Tg-Init-Data": sign_init_data(user["tg_id"])},
+            )
+            response.raise_for_status()
+
+        return await run_concurrent(recorder, args.requests, args.concurrency, request_profile)
+
+
+async def scenario_webhook(args: argparse.Namespace, users: List[Dict[str, Any]], recorder: LatencyRecorder) -> float:
+    import httpx
+    from api.main import app
+    from api.routes import webhooks
+    from bot.dispatcher import create_bot
+
+    bot = create_bot()
+    webhooks.set_notification_bot(bot)
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def post_payment(index: int):
+                user = users[index % len(users)]
+                payload = {
+                    "resource": "payment",
+                    "resource_id": 900_000 + index,
+                    "status": "create",
+                    "data": {
+                        "client": {"phone": user["phone"]},
+                        "amount": 1000 + index % 5000,
+                        "visit_id": 800_000 + index,
+                    },
+                }
+                # ASGITransport дожидается BackgroundTasks, поэтому задержка включает обработку платежа
+                response = await client.post(
+                    "/webhook/yclients",
+                    json=payload,
+                    headers={"X-Webhook-Secret": WEBHOOK_SECRET},
+                )
+                response.raise_for_status()
+
+            return await run_concurrent(recorder, args.requests, args.concurrency, post_payment)
+    finally:
+        await bot.session.close()
+
+
+async def _send_broadcast(admin_routes, postgrest: FakePostgREST, broadcast_id: int) -> None:
+    """process_broadcast не бросает исключений: проваленную рассылку определяем по ее строке"""
+    await admin_routes.process_broadcast(str(broadcast_id))
+    row = postgrest.db.filter("broadcasts", [("id", "eq", str(broadcast_id))])[0]
+    if row.get("status") != "completed" or not row.get("sent_count"):
+        raise RuntimeError(
+            f"Broadcast {broadcast_id} finished with status={row.get('status')}, sent_count={row.get('sent_count')}"
+        )
+
+
+async def scenario_broadcast(args: argparse.Namespace, postgrest: FakePostgREST, recorder: LatencyRecorder) -> float:
+    from api.routes import admin as admin_routes
+    from bot.dispatcher import create_bot
+
+    bot = create_bot()
+    admin_routes.set_broadcast_bot(bot)
+    try:
+        elapsed = 0.0
+        for _ in range(args.repeat):
+            broadcast = postgrest.db.insert("broadcasts", {
+                "message": "Бенчмарк рассылки",
+                "recipient_type": "all",
+                "recipient_ids": [],
+                "status": "pending",
+                "sent_count": 0,
+                "failed_count": 0,
+                "created_by": 1,
+            })
+            started = time.perf_counter()
+            try:
+                await recorder.measure(lambda: _send_broadcast(admin_routes, postgrest, broadcast["id"]))
+            except RuntimeError as e:
+                logging.getLogger("bench").error(str(e))
+            elapsed += time.perf_counter() - started
+        return elapsed
+    finally:
+        await bot.session.close()
+
+
+async def scenario_sync(args: argparse.Namespace, postgrest: FakePostgREST, recorder: LatencyRecorder) -> float:
+    from bot.tasks import sync as sync_task
+
+    sync_task.SYNC_USER_DELAY_SECONDS = args.sync_delay
+    # Замеряем каждого пользователя отдельно: оборачиваем функции, которые вызывает sync_all_users
+    original_loyalty = sync_task.sync_user_with_yclients
+
+    async def timed_loyalty_sync(*call_args, **call_kwargs):
+        return await recorder.measure(lambda: original_loyalty(*call_args, **call_kwargs))
+
+    sync_task.sync_user_with_yclients = timed_loyalty_sync
+    try:
+        elapsed = 0.0
+        for _ in range(args.repeat):
+            # Каждый прогон - по всем пользователям: сбрасываем сроки следующей синхронизации
+            for user in postgrest.db.rows("users"):
+                user["sync_next_due_at"] = None
+            started = time.perf_counter()
+            await sync_task.sync_all_users(request_budget=args.sync_budget)
+            elapsed += time.perf_counter() - started
+        return elapsed
+    finally:
+        sync_task.sync_user_with_yclients = original_loyalty
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    scenario = report["scenario"]
+    print(f"scenario: {scenario['name']}  " + "  ".join(f"{key}={value}" for key, value in scenario["params"].items()))
+    result = report["result"]
+    print(
+        f"  {result['operations']} ops ({result['errors']} errors) in {result['elapsed_s']} s, "
+        f"{result['throughput_ops']} ops/s"
+    )
+    print(f"  latency: p50={result['p50_ms']} ms  p99={result['p99_ms']} ms  max={result['max_ms']} ms")
+    for name, stats in report["upstreams"].items():
+        statuses = ", ".join(f"{status}: {count}" for status, count in stats["statuses"].items())
+        print(f"  {name}: {stats['total']} requests (max in flight {stats['max_in_flight']}) [{statuses}]")
+        for route, count in stats["routes"].items():
+            print(f"    {count:>7}  {route}")
+    for key, value in report.get("extra", {}).items():
+        print(f"  {key}: {value}")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    postgrest = FakePostgREST(latency_ms=args.db_latency_ms, jitter_ms=args.db_jitter_ms)
+    yclients = FakeYClients(
+        latency_ms=args.yclients_latency_ms,
+        jitter_ms=args.yclients_jitter_ms,
+        rps_quota=args.yclients_rps,
+    )
+    telegram = FakeTelegram(
+        latency_ms=args.telegram_latency_ms,
+        jitter_ms=args.telegram_jitter_ms,
+        rps_quota=args.telegram_rps,
+    )
+    servers = {
+        "postgrest": FakeServer(postgrest.app),
+        "yclients": FakeServer(yclients.app),
+        "telegram": FakeServer(telegram.app),
+    }
+    for server in servers.values():
+        await server.start()
+    configure_environment(servers["postgrest"], servers["yclients"], servers["telegram"])
+
+    users = seed(postgrest, yclients, args)
+    if args.blocked_ratio:
+        blocked = random.Random(3).sample(users, int(len(users) * args.blocked_ratio))
+        telegram.blocked_chats.update(user["tg_id"] for user in blocked)
+
+    recorder = LatencyRecorder()
+    try:
+        if args.scenario == "profile":
+            elapsed = await scenario_profile(args, users, recorder)
+        elif args.scenario == "webhook":
+            elapsed = await scenario_webhook(args, users, recorder)
+        elif args.scenario == "broadcast":
+            elapsed = await scenario_broadcast(args, postgrest, recorder)
+        else:
+            elapsed = await scenario_sync(args, postgrest, recorder)
+    finally:
+        for server in servers.values():
+            await server.stop()
+
+    params = {
+        "users": args.users,
+        "db_latency_ms": args.db_latency_ms,
+        "yclients_latency_ms": args.yclients_latency_ms,
+        "yclients_rps": args.yclients_rps,
+        "telegram_latency_ms": args.telegram_latency_ms,
+        "telegram_rps": args.telegram_rps,
+    }
+    if args.scenario in ("profile", "webhook"):
+        params.update({"requests": args.requests, "concurrency": args.concurrency})
+    else:
+        params["repeat"] = args.repeat
+
+    report: Dict[str, Any] = {
+        "scenario": {"name": args.scenario, "params": params},
+        "result": recorder.summary(elapsed),
+        "upstreams": {
+            "postgrest": postgrest.stats.snapshot(),
+            "yclients": yclients.stats.snapshot(),
+            "telegram": telegram.stats.snapshot(),
+        },
+    }
+    if args.scenario == "broadcast":
+        report["extra"] = {
+            "messages_sent": telegram.sent_messages,
+            "messages_per_s": round(telegram.sent_messages / elapsed, 2) if elapsed else 0.0,
+        }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load scenarios against local YClients/PostgREST/Telegram stand-ins")
+    parser.add_argument("scenario", choices=["profile", "webhook", "broadcast", "sync"])
+    parser.add_argument("--users", type=int, default=200, help="Seeded users")
+    parser.add_argument("--transactions-per-user", type=int, default=10, help="Seeded earn transactions per user")
+    parser.add_argument("--visits-per-user", type=int, default=20, help="YClients records per client")
+    parser.add_argument("--requests", type=int, default=500, help="Requests for profile/webhook")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent requests for profile/webhook")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs for broadcast/sync")
+    parser.add_argument("--sync-delay", type=float, default=0.0, help="Pause between users in sync (prod: 0.5)")
+    parser.add_argument(
+        "--sync-budget", type=int, default=1_000_000, help="YClients requests per sync pass (prod: YCLIENTS_SYNC_REQUEST_BUDGET)"
+    )
+    parser.add_argument("--blocked-ratio", type=float, default=0.0, help="Share of users who blocked the bot")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--db-jitter-ms", type=float, default=1.0)
+    parser.add_argument("--yclients-latency-ms", type=float, default=80.0)
+    parser.add_argument("--yclients-jitter-ms", type=float, default=30.0)
+    parser.add_argument("--yclients-rps", type=float, default=0.0, help="YClients quota, requests/s (0 = unlimited)")
+    parser.add_argument("--telegram-latency-ms", type=float, default=40.0)
+    parser.add_argument("--telegram-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--telegram-rps", type=float, default=30.0, help="Telegram quota, requests/s (0 = unlimited)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--log-level", default="WARNING", help="Application log level")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
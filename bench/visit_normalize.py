@@ -0,0 +1,192 @@
+"""
+Микробенчмарк нормализации визитов YClients.
+
+Сравнивает поштучную нормализацию (normalize_visit - прежняя реализация
+YClientsAPI, оставлена здесь как эталон) с пакетным normalize_visits_batch
+на синтетической странице записей.
+
+Использование:
+    python -m bench.visit_normalize
+    python -m bench.visit_normalize --records 100000 --repeat 5
+"""
+import argparse
+import gc
+import random
+import statistics
+import time
+from typing import Any, Dict, List
+
+from bot.services.yclients_api import normalize_visits_batch
+
+
+# Эталон: поштучная нормализация записи YClients в формат UI
+def format_visit_status(raw: Dict[str, Any]) -> str:
+    if raw.get("deleted") or raw.get("canceled"):
+        return "Отменено"
+    attendance = raw.get("attendance")
+    if attendance is None:
+        attendance = raw.get("visit_attendance")
+    if isinstance(attendance, str) and attendance.lstrip("-").isdigit():
+        attendance = int(attendance)
+    if attendance == 2:
+        return "Подтверждено"
+    if attendance == 1:
+        return "Визит состоялся"
+    if attendance == 0:
+        return "Ожидается"
+    if attendance == -1:
+        return "Не пришли"
+    if raw.get("confirmed") is False:
+        return "Не подтверждено"
+    return "Запись"
+
+
+def normalize_visit(raw: Dict[str, Any]) -> Dict[str, Any]:
+    services_titles: List[str] = []
+    services_total = None
+    services = raw.get("services") or []
+    if isinstance(services, list):
+        for service in services:
+            if not isinstance(service, dict):
+                continue
+            title = service.get("title") or service.get("name")
+            if title:
+                services_titles.append(str(title))
+            cost = service.get("cost")
+            if cost is None:
+                cost = service.get("first_cost")
+            if cost is None:
+                cost = service.get("manual_cost")
+            amount = service.get("amount", 1)
+            if cost is not None and not isinstance(cost, bool):
+                try:
+                    cost_value = float(cost)
+                    amount_value = float(amount) if amount is not None else 1.0
+                    services_total = (services_total or 0) + cost_value * amount_value
+                except (ValueError, TypeError):
+                    pass
+
+    amount = None
+    amount_candidates = [
+        raw.get("amount"),
+        raw.get("sum"),
+        raw.get("total_cost"),
+        raw.get("cost"),
+        raw.get("prepaid"),
+        raw.get("paid_full")
+    ]
+    for candidate in amount_candidates:
+        if candidate is None or isinstance(candidate, bool):
+            continue
+        try:
+            amount = float(candidate)
+            if amount <= 0:
+                amount = None
+                continue
+            break
+        except (ValueError, TypeError):
+            continue
+    if amount is None and services_total is not None:
+        amount = services_total
+
+    staff = raw.get("staff") or {}
+    master = None
+    if isinstance(staff, dict):
+        master = staff.get("name") or staff.get("title")
+    if not master:
+        master = raw.get("staff_name")
+
+    visit_datetime = raw.get("datetime") or raw.get("date") or raw.get("create_date")
+
+    return {
+        "item_type": "visit",
+        "visit_id": raw.get("id") or raw.get("visit_id"),
+        "visit_datetime": visit_datetime,
+        "services": services_titles,
+        "master": master,
+        "amount": amount,
+        "status": format_visit_status(raw)
+    }
+
+
+def make_records(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Генерирует записи, похожие на ответ GET /records/{company_id}"""
+    rnd = random.Random(seed)
+    attendance_values = [2, 1, 0, -1, "1", "-1", None]
+    records = []
+    for index in range(count):
+        services = []
+        for service_index in range(rnd.randint(0, 3)):
+            service: Dict[str, Any] = {
+                "id": service_index,
+                "title": f"Услуга {rnd.randint(1, 200)}",
+                "amount": rnd.choice([1, 1, 2, "1"]),
+            }
+            cost_key = rnd.choice(["cost", "first_cost", "manual_cost"])
+            service[cost_key] = rnd.choice([1500, 2500.0, "3200", 0])
+            services.append(service)
+        record: Dict[str, Any] = {
+            "id": 10_000_000 + index,
+            "datetime": f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}T12:00:00+03:00",
+            "services": services,
+            "staff": {"id": rnd.randint(1, 20), "name": f"Мастер {rnd.randint(1, 20)}"},
+            "attendance": rnd.choice(attendance_values),
+            "deleted": rnd.random() < 0.05,
+            "confirmed": rnd.choice([True, False]),
+        }
+        amount_key = rnd.choice(["amount", "sum", "total_cost", "cost", None])
+        if amount_key:
+            record[amount_key] = rnd.choice([0, 1800, "2400", 3100.5])
+        records.append(record)
+    return records
+
+
+def _measure(func, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run(records_count: int, repeat: int) -> None:
+    records = make_records(records_count)
+
+    expected = [normalize_visit(record) for record in records]
+    actual = normalize_visits_batch(records).to_visits()
+    if expected != actual:
+        raise SystemExit("Batch normalizer output differs from normalize_visit")
+
+    per_record = _measure(lambda: [normalize_visit(record) for record in records], repeat)
+    batch_only = _measure(lambda: normalize_visits_batch(records), repeat)
+    batch_rows = _measure(
+        lambda: normalize_visits_batch(records).to_rows(1, 1, "2024-01-01T00:00:00+00:00"),
+        repeat
+    )
+
+    print(f"records: {records_count}, repeat: {repeat}")
+    for label, timings in (
+        ("normalize_visit (per record)", per_record),
+        ("normalize_visits_batch", batch_only),
+        ("normalize_visits_batch + to_rows", batch_rows),
+    ):
+        best = min(timings)
+        print(
+            f"{label:<36} best={best * 1000:8.1f} ms  "
+            f"median={statistics.median(timings) * 1000:8.1f} ms  "
+            f"{records_count / best:,.0f} rec/s"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark YClients visit normalization")
+    parser.add_argument("--records", type=int, default=100_000, help="Synthetic records count")
+    parser.add_argument("--repeat", type=int, default=5, help="Measurements per variant")
+    args = parser.parse_args()
+    run(args.records, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
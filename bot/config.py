@@ -15,6 +15,11 @@ class Settings(BaseSettings):
     # Telegram
     BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
     TELEGRAM_WEBHOOK_SECRET: str = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+    TELEGRAM_API_SERVER: str = os.getenv("TELEGRAM_API_SERVER", "")  # Свой Bot API сервер (локальный или заглушка из bench/), пусто = api.telegram.org
+    TELEGRAM_UPDATE_WORKERS: int = int(os.getenv("TELEGRAM_UPDATE_WORKERS", "8"))  # Воркеры (шарды по chat_id) очереди обновлений webhook
+    TELEGRAM_UPDATE_QUEUE_SIZE: int = int(os.getenv("TELEGRAM_UPDATE_QUEUE_SIZE", "200"))  # Обновлений в очереди шарда; при переполнении webhook отвечает 503
+    TELEGRAM_WEBHOOK_REPLY: bool = Field(default=True)  # Отвечать методом API в теле вебхука (return message.answer(...) в обработчике)
+    TELEGRAM_WEBHOOK_REPLY_TIMEOUT_MS: int = int(os.getenv("TELEGRAM_WEBHOOK_REPLY_TIMEOUT_MS", "250"))  # Сколько ждать обработчик в запросе вебхука, дальше - в фоне; пока ждем, Telegram не получает ответ
     
     # Supabase
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
@@ -30,12 +35,17 @@ class Settings(BaseSettings):
     SUPABASE_STORAGE_PUBLIC_URL_BASE: str = os.getenv("SUPABASE_STORAGE_PUBLIC_URL_BASE", "")
     STORAGE_PUBLIC_URL_TEMPLATE: str = os.getenv("STORAGE_PUBLIC_URL_TEMPLATE", "")
     S3_SUPABASE_FALLBACK_ENABLED: bool = Field(default=False)
+    STORAGE_PROBE_PUBLIC_URL: bool = Field(default=False)  # HEAD-проверка публичного URL после первой загрузки
+    IMAGE_VARIANTS_ENABLED: bool = Field(default=True)  # WebP/JPEG варианты thumb/card/full при загрузке через админку
+    IMAGE_VARIANT_WORKERS: int = int(os.getenv("IMAGE_VARIANT_WORKERS", "2"))  # Процессы для ресайза изображений
     
     # YClients
     YCLIENTS_PARTNER_TOKEN: str = os.getenv("YCLIENTS_PARTNER_TOKEN", "")  # Токен партнера (разработчика)
     YCLIENTS_USER_TOKEN: str = os.getenv("YCLIENTS_USER_TOKEN", "")  # User Token системного пользователя (создается при подключении интеграции)
     YCLIENTS_COMPANY_ID: str = os.getenv("YCLIENTS_COMPANY_ID", "443477")  # ID филиала/компании (НЕ партнера! Находится в URL: /company/443477 или в настройках приложения)
+    YCLIENTS_BASE_URL: str = os.getenv("YCLIENTS_BASE_URL", "https://api.yclients.com/api/v1")  # Базовый URL API (переопределяется для нагрузочных тестов)
     YCLIENTS_BOOKING_URL: str = os.getenv("YCLIENTS_BOOKING_URL", "https://n12345.yclients.com/")  # Ссылка на онлайн-запись
+    VISITS_STORE_RAW_PAYLOAD: bool = Field(default=False)  # Сохранять копию визита в yclients_visits.raw_payload
     
     # Security
     WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "") # Секрет для защиты вебхука
@@ -46,6 +56,39 @@ class Settings(BaseSettings):
     CORS_ALLOW_ORIGINS: list[str] = Field(default_factory=list)
     CORS_ALLOW_ORIGIN_REGEX: str = os.getenv("CORS_ALLOW_ORIGIN_REGEX", "")
     
+    # Monitoring
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")  # Bearer-токен для /metrics; без токена эндпоинт закрыт (404)
+    METRICS_PUBLIC: bool = Field(default=False)  # Явно открыть /metrics без токена (например, в закрытой сети)
+    UPSTREAM_CALL_BUDGET: int = int(os.getenv("UPSTREAM_CALL_BUDGET", "20"))  # Предупреждение, если запрос сделал больше внешних вызовов (0 = выключено)
+    ACCESS_LOG_SAMPLE_RATE: float = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1.0"))  # Доля запросов в access log (5xx и медленные пишутся всегда)
+    ACCESS_LOG_SLOW_MS: int = int(os.getenv("ACCESS_LOG_SLOW_MS", "1000"))  # Порог медленного запроса для access log
+    TRACE_SLOW_MS: int = int(os.getenv("TRACE_SLOW_MS", "500"))  # Трассы дольше попадают в буфер /api/admin/traces
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", "200"))  # Сколько медленных трасс хранить в памяти
+    TRACING_OTLP_ENDPOINT: str = os.getenv("TRACING_OTLP_ENDPOINT", "")  # OTLP/HTTP collector, например http://localhost:4318 (пусто = без экспорта)
+    TRACING_SERVICE_NAME: str = os.getenv("TRACING_SERVICE_NAME", "cveti")
+
+    # Несколько воркеров / реплик
+    INSTANCE_ID: str = os.getenv("INSTANCE_ID", "")  # Имя экземпляра в job_leases, пусто = hostname:pid:random
+    LEADER_LEASE_TTL_SECONDS: int = int(os.getenv("LEADER_LEASE_TTL_SECONDS", "60"))  # Аренда фоновой задачи; после падения владельца задачу подхватят через это время
+    LEADER_POLL_SECONDS: int = int(os.getenv("LEADER_POLL_SECONDS", "20"))  # Как часто продлевать / пытаться захватить аренду
+    CACHE_VERSION_POLL_SECONDS: int = int(os.getenv("CACHE_VERSION_POLL_SECONDS", "15"))  # Как часто проверять cache_versions (сброс кэшей настроек, меню, каталога)
+    BACKGROUND_MODE: str = os.getenv("BACKGROUND_MODE", "inline")  # inline - фоновые задачи в процессе API, worker - в python -m bot.worker (API только ставит задачи в job_queue)
+    TELEGRAM_UPDATES_IN_WORKER: bool = Field(default=False)  # При BACKGROUND_MODE=worker передавать и обновления Telegram в bot.worker (без ответа в теле вебхука)
+    WORKER_CONCURRENCY: int = int(os.getenv("WORKER_CONCURRENCY", "4"))  # Сколько задач job_queue воркер выполняет одновременно
+    WORKER_POLL_INTERVAL_MS: int = int(os.getenv("WORKER_POLL_INTERVAL_MS", "500"))  # Пауза между опросами пустой очереди
+    WORKER_JOB_STALE_SECONDS: int = int(os.getenv("WORKER_JOB_STALE_SECONDS", "300"))  # Задачи воркера без heartbeat дольше этого возвращаются в очередь
+    WORKER_SHUTDOWN_TIMEOUT_SECONDS: int = int(os.getenv("WORKER_SHUTDOWN_TIMEOUT_SECONDS", "30"))  # Сколько ждать выполняемые задачи при остановке
+    SCHEDULER_TIMEZONE: str = os.getenv("SCHEDULER_TIMEZONE", "Europe/Moscow")  # Часовой пояс cron-расписаний фоновых задач
+    SYNC_CRON: str = os.getenv("SYNC_CRON", "15 * * * *")  # Проход синхронизации с YClients (пользователи, у которых наступил sync_next_due_at)
+    YCLIENTS_SYNC_REQUEST_BUDGET: int = int(os.getenv("YCLIENTS_SYNC_REQUEST_BUDGET", "600"))  # Сколько запросов к YClients может сделать один проход синхронизации
+    SYNC_HOT_DAYS: int = int(os.getenv("SYNC_HOT_DAYS", "7"))  # Активные: запись в ближайшие N дней или действие в боте/Mini App за N дней
+    SYNC_WARM_DAYS: int = int(os.getenv("SYNC_WARM_DAYS", "90"))  # Недавние: действие или визит за N дней; остальные - спящие
+    SYNC_HOT_INTERVAL_HOURS: int = int(os.getenv("SYNC_HOT_INTERVAL_HOURS", "6"))  # Как часто синхронизировать активных
+    SYNC_WARM_INTERVAL_HOURS: int = int(os.getenv("SYNC_WARM_INTERVAL_HOURS", "24"))  # Как часто синхронизировать недавних
+    SYNC_DORMANT_INTERVAL_HOURS: int = int(os.getenv("SYNC_DORMANT_INTERVAL_HOURS", "168"))  # Как часто синхронизировать спящих (раз в неделю)
+    EXPIRY_CRON: str = os.getenv("EXPIRY_CRON", "0 * * * *")  # Сгорание истекших баллов
+    JOB_PURGE_CRON: str = os.getenv("JOB_PURGE_CRON", "30 4 * * *")  # Очистка завершенных задач job_queue
+    
     # Loyalty
     LOYALTY_PERCENTAGE: float = float(os.getenv("LOYALTY_PERCENTAGE", "0.05"))  # 5% кэшбек по умолчанию
     LOYALTY_MAX_SPEND_PERCENTAGE: float = float(os.getenv("LOYALTY_MAX_SPEND_PERCENTAGE", "0.3"))  # Максимум 30% от чека можно оплатить баллами
@@ -2,8 +2,17 @@
 Общий Dispatcher для бота.
 Используется как для polling (локальная разработка), так и для webhook (продакшен).
 """
-from aiogram import Dispatcher
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from bot.config import settings
 from bot.handlers import start, profile, book, info
+from bot.middleware.interaction import InteractionMiddleware
+from bot.middleware.tracing import (
+    HandlerTracingMiddleware,
+    TelegramRequestTracingMiddleware,
+    UpdateTracingMiddleware,
+)
 
 # Создаем глобальный Dispatcher
 dp = Dispatcher()
@@ -15,3 +24,21 @@ dp.include_router(profile.router)
 dp.include_router(book.router)
 dp.include_router(info.router)  # Информационные разделы (контакты, услуги, бонусы, поддержка)
 dp.include_router(start.router)  # /start в конце, чтобы не перехватывать другие сообщения
+
+# Трассировка: update (для polling), каждый обработчик (middleware родителя действуют и во вложенных роутерах)
+dp.update.outer_middleware(UpdateTracingMiddleware())
+# Активность пользователя для приоритетной синхронизации с YClients
+dp.update.outer_middleware(InteractionMiddleware())
+for _event_name, _observer in dp.observers.items():
+    if _event_name not in ("update", "error"):
+        _observer.middleware(HandlerTracingMiddleware())
+
+
+def create_bot() -> Bot:
+    """Создает Bot; при заданном TELEGRAM_API_SERVER запросы идут на этот сервер"""
+    if settings.TELEGRAM_API_SERVER:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_SERVER.rstrip('/')))
+    else:
+        session = AiohttpSession()
+    session.middleware(TelegramRequestTracingMiddleware())
+    return Bot(token=settings.BOT_TOKEN, session=session)
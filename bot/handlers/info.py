@@ -42,27 +42,29 @@ async def _forward_support_message(message: types.Message, user: dict) -> bool:
 
 
 async def send_button_response(message: types.Message, button_text: str, inline_keyboard=None):
-    """Отправляет ответ для кнопки, используя текст из БД"""
+    """
+    Ответ для кнопки с текстом из БД.
+    Возвращает неотправленный метод: обработчик возвращает его, и ответ уходит в теле вебхука
+    """
     response_text = await get_button_response(button_text)
     
     if response_text:
         response_text = await _apply_placeholders(response_text)
         
-        await message.answer(
+        return message.answer(
             response_text,
             reply_markup=inline_keyboard,
             parse_mode="Markdown"
         )
-    else:
-        # Fallback на дефолтные ответы
-        logger.warning(f"No response text found for button: {button_text}")
-        await message.answer("❌ Информация временно недоступна.")
+    # Fallback на дефолтные ответы
+    logger.warning(f"No response text found for button: {button_text}")
+    return message.answer("❌ Информация временно недоступна.")
 
 
 @router.message(F.text == "📍 Контакты")
 async def show_contacts(message: types.Message):
     """Показывает контактную информацию студии"""
-    await send_button_response(message, "📍 Контакты", get_contacts_inline_keyboard())
+    return await send_button_response(message, "📍 Контакты", get_contacts_inline_keyboard())
 
 
 @router.message(F.text == "🎁 Бонусы")
@@ -80,15 +82,14 @@ async def show_bonuses(message: types.Message):
                 f"\n\n💳 Можно оплатить до {_format_percent(loyalty_max_spend_percentage)}% от суммы чека"
                 f"\n⏰ Баллы действуют {int(loyalty_expiration_days)} дней"
             )
-        await message.answer(response_text, parse_mode="Markdown")
-    else:
-        await message.answer("❌ Информация временно недоступна.")
+        return message.answer(response_text, parse_mode="Markdown")
+    return message.answer("❌ Информация временно недоступна.")
 
 
 @router.message(F.text == "🌸 Наши услуги")
 async def show_services(message: types.Message):
     """Показывает информацию об услугах"""
-    await send_button_response(message, "🌸 Наши услуги", get_services_inline_keyboard())
+    return await send_button_response(message, "🌸 Наши услуги", get_services_inline_keyboard())
 
 
 @router.message(F.text == "💬 Поддержка")
@@ -184,7 +185,6 @@ def _format_percent(value: float) -> int:
 async def show_custom_button_response(message: types.Message):
     """Fallback для пользовательских кнопок из БД."""
     button_text = message.text or ""
-    print(f"[tg_text_fallback] len={len(button_text)} starts_with_slash={button_text.startswith('/')}")
     if button_text.startswith("/"):
         return
     if not button_text:
@@ -3,6 +3,7 @@ from bot.services.supabase_client import supabase
 from bot.services.phone_normalize import normalize_phone
 from bot.services.settings import get_setting
 from bot.services.loyalty import sync_user_with_yclients, apply_yclients_manual_transaction
+from bot.services.visits import get_user_visit_stats
 from bot.keyboards import get_main_menu, get_profile_inline_keyboard
 from bot.config import settings
 import logging
@@ -154,13 +155,33 @@ async def show_profile(message: types.Message):
             "vip": "VIP"
         }
         level = user.get('level', 'new')
+
+        # Сводка визитов из user_visit_stats (без запроса в YClients)
+        visits_text = ""
+        try:
+            stats = await get_user_visit_stats(user["id"])
+        except Exception as e:
+            logger.warning(f"Could not load visit stats for user {user['id']}: {e}")
+            stats = None
+        if stats and stats.get("visit_count"):
+            visits_text = f"**Визитов:** {stats['visit_count']}"
+            if stats.get("last_visit_at"):
+                try:
+                    last_visit = datetime.fromisoformat(stats["last_visit_at"].replace('Z', '+00:00'))
+                    visits_text += f" (последний {last_visit.strftime('%d.%m.%Y')})"
+                except ValueError:
+                    pass
+            visits_text += "\n"
+            if stats.get("top_master"):
+                visits_text += f"**Любимый мастер:** {stats['top_master']}\n"
         
         text = (
             f"👤 **Мой профиль**\n\n"
             f"**Имя:** {user.get('name', 'Не указано')}\n"
             f"**Телефон:** {user.get('phone', 'Не указан')}\n"
             f"**Баланс:** {current_balance} баллов\n"
-            f"**Уровень:** {level_emoji.get(level, '⭐')} {level_text.get(level, 'Новый')}\n\n"
+            f"**Уровень:** {level_emoji.get(level, '⭐')} {level_text.get(level, 'Новый')}\n"
+            f"{visits_text}\n"
             "💡 Вы можете использовать баллы для оплаты услуг в нашем салоне!\n\n"
             "📜 Нажмите кнопку ниже, чтобы посмотреть историю начислений:"
         )
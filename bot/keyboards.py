@@ -5,10 +5,39 @@ from aiogram import types
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from bot.config import settings
 from bot.services.supabase_client import supabase
+from bot.services import cache_versions
+from typing import Any, Dict, List, Optional
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Кэш активных кнопок меню: главное меню и ответы кнопок читаются на каждое сообщение.
+# Сбрасывается по TTL и при изменении bot_buttons на любом воркере (cache_versions "menu")
+MENU_CACHE_TTL_SECONDS = 300
+_buttons_cache: Optional[List[Dict[str, Any]]] = None
+_buttons_cached_at = 0.0
+
+
+def clear_menu_cache():
+    """Сбрасывает кэш кнопок меню"""
+    global _buttons_cache
+    _buttons_cache = None
+
+
+cache_versions.on_change("menu", clear_menu_cache)
+
+
+async def _get_active_buttons() -> List[Dict[str, Any]]:
+    """Активные кнопки из bot_buttons (из кэша, если он свежий)"""
+    global _buttons_cache, _buttons_cached_at
+    if _buttons_cache is not None and time.monotonic() - _buttons_cached_at < MENU_CACHE_TTL_SECONDS:
+        return _buttons_cache
+    res = await supabase.table("bot_buttons").select("*").eq("is_active", True).order("row_number").order("order_in_row").execute()
+    _buttons_cache = res.data or []
+    _buttons_cached_at = time.monotonic()
+    return _buttons_cache
+
 
 def get_registration_keyboard() -> types.ReplyKeyboardMarkup:
     """Клавиатура для регистрации (запрос номера телефона)"""
@@ -25,15 +54,12 @@ async def get_main_menu(is_admin: bool = False) -> types.ReplyKeyboardMarkup:
     builder = ReplyKeyboardBuilder()
     
     try:
-        # Загружаем активные кнопки из БД
-        query = supabase.table("bot_buttons").select("*").eq("is_active", True).order("row_number").order("order_in_row")
+        # Загружаем активные кнопки из БД (через кэш)
+        buttons = await _get_active_buttons()
         
         # Если не админ, исключаем админские кнопки
         if not is_admin:
-            query = query.eq("is_admin_only", False)
-        
-        res = await query.execute()
-        buttons = res.data if res.data else []
+            buttons = [button for button in buttons if not button.get("is_admin_only")]
         
         # Группируем кнопки по строкам
         rows = {}
@@ -125,9 +151,9 @@ async def get_main_menu(is_admin: bool = False) -> types.ReplyKeyboardMarkup:
 async def get_button_response(button_text: str) -> str:
     """Получить текст ответа для кнопки из БД"""
     try:
-        res = await supabase.table("bot_buttons").select("response_text").eq("button_text", button_text).eq("is_active", True).single().execute()
-        if res.data:
-            return res.data.get("response_text", "")
+        for button in await _get_active_buttons():
+            if button.get("button_text") == button_text:
+                return button.get("response_text") or ""
     except Exception as e:
         logger.error(f"Error loading button response: {e}", exc_info=True)
     return ""
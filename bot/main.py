@@ -3,9 +3,7 @@ import bot.patches  # noqa: F401
 
 import asyncio
 import logging
-from aiogram import Bot
-from bot.config import settings
-from bot.dispatcher import dp
+from bot.dispatcher import dp, create_bot
 
 async def main():
     """
@@ -14,7 +12,7 @@ async def main():
     """
     logging.basicConfig(level=logging.INFO)
     
-    bot = Bot(token=settings.BOT_TOKEN)
+    bot = create_bot()
     
     # Запуск бота через polling (только для локальной разработки)
     await dp.start_polling(bot)
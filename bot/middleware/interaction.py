@@ -0,0 +1,24 @@
+"""
+Middleware aiogram: отмечает активность пользователя (bot/services/interactions.py).
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from bot.services.interactions import touch_user_interaction
+
+
+class InteractionMiddleware(BaseMiddleware):
+    """Отмечает last_interaction_at автора update (event_from_user заполняет Dispatcher)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            touch_user_interaction(user.id)
+        return await handler(event, data)
@@ -0,0 +1,70 @@
+"""
+Middleware aiogram для трассировки (bot/services/tracing.py):
+span на каждый обработчик и на каждый вызов Telegram Bot API.
+При polling трассы нет, поэтому ее открывает UpdateTracingMiddleware.
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject, Update
+
+from bot.services.tracing import finish_trace, span, start_trace, trace_active
+
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """
+    Открывает трассу на update, если открытой трассы нет (webhook открывает трассу
+    в HTTP middleware, но к медленному обработчику она может быть уже закрыта)
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if trace_active():
+            return await handler(event, data)
+        update_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        token = start_trace(f"telegram update {update_type}", update_type=update_type)
+        failed = False
+        try:
+            return await handler(event, data)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            finish_trace(token, error=failed)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Span вокруг обработчика: имя функции-обработчика"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        name = getattr(callback, "__qualname__", None) or type(event).__name__
+        module = getattr(callback, "__module__", "")
+        with span(f"handler {name}", module=module):
+            return await handler(event, data)
+
+
+class TelegramRequestTracingMiddleware(BaseRequestMiddleware):
+    """Span вокруг вызова Bot API (sendMessage, answerCallbackQuery, ...)"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        with span(f"telegram {method.__api_method__}"):
+            return await make_request(bot, method)
@@ -0,0 +1,61 @@
+"""
+Сброс локальных кэшей на всех воркерах (миграция 026).
+
+Триггеры увеличивают версию в cache_versions при изменении app_settings (settings),
+bot_buttons (menu) и masters/services/promotions (catalog). Каждый процесс раз в
+CACHE_VERSION_POLL_SECONDS читает версии одним запросом и вызывает обработчики
+тех кэшей, версия которых изменилась.
+"""
+from typing import Callable, Dict, List
+import asyncio
+import logging
+
+from bot.config import settings
+from bot.services.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+# Последние прочитанные версии и обработчики сброса по имени кэша
+_versions: Dict[str, int] = {}
+_listeners: Dict[str, List[Callable[[], None]]] = {}
+
+
+def on_change(name: str, callback: Callable[[], None]) -> None:
+    """Регистрирует сброс локального кэша при изменении версии name"""
+    _listeners.setdefault(name, []).append(callback)
+
+
+def invalidate_local(name: str) -> None:
+    """Сбрасывает кэш name в текущем процессе (остальные увидят новую версию при опросе)"""
+    for callback in _listeners.get(name, []):
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Error invalidating cache '{name}': {e}", exc_info=True)
+
+
+async def poll_cache_versions() -> List[str]:
+    """Читает версии и сбрасывает изменившиеся кэши; возвращает их имена"""
+    res = await supabase.table("cache_versions").select("name,version").execute()
+    changed = []
+    for row in res.data or []:
+        name, version = row.get("name"), row.get("version")
+        previous = _versions.get(name)
+        _versions[name] = version
+        # Первое чтение только запоминает версию: кэши процесса еще пустые или свежие
+        if previous is not None and previous != version:
+            changed.append(name)
+            invalidate_local(name)
+    if changed:
+        logger.debug(f"Caches invalidated by version change: {', '.join(changed)}")
+    return changed
+
+
+async def run_cache_version_watcher() -> None:
+    """Фоновая задача каждого процесса: опрос версий кэшей"""
+    while True:
+        try:
+            await poll_cache_versions()
+        except Exception as e:
+            logger.warning(f"Could not poll cache versions: {e}")
+        await asyncio.sleep(settings.CACHE_VERSION_POLL_SECONDS)
@@ -0,0 +1,96 @@
+"""
+Разбор cron-выражений из пяти полей: минута, час, день месяца, месяц, день недели.
+
+Поддерживаются *, числа, диапазоны a-b, шаг */n и a-b/n, списки через запятую.
+День недели: 0-6 (0 и 7 - воскресенье). Если заданы и день месяца, и день недели,
+достаточно совпадения любого из них (как в классическом cron).
+"""
+from datetime import datetime, timedelta
+from typing import FrozenSet, Tuple
+
+# (минимум, максимум) для каждого поля
+_FIELD_RANGES: Tuple[Tuple[int, int], ...] = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+_FIELD_NAMES = ("minute", "hour", "day", "month", "weekday")
+
+# Ограничение поиска следующего запуска (4 года покрывают 29 февраля)
+_MAX_SEARCH_DAYS = 366 * 4
+
+
+class CronError(ValueError):
+    """Некорректное cron-выражение"""
+
+
+def _parse_field(text: str, index: int) -> FrozenSet[int]:
+    low, high = _FIELD_RANGES[index]
+    values = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            raise CronError(f"{_FIELD_NAMES[index]}: empty value")
+        base, _, step_text = part.partition("/")
+        try:
+            step = int(step_text) if step_text else 1
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start_text, end_text = base.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(base)
+                end = high if step_text else start
+        except ValueError:
+            raise CronError(f"{_FIELD_NAMES[index]}: invalid value '{part}'")
+        if step < 1 or start < low or end > high or start > end:
+            raise CronError(f"{_FIELD_NAMES[index]}: '{part}' is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    if index == 4 and 7 in values:
+        values.discard(7)
+        values.add(0)
+    return frozenset(values)
+
+
+class CronExpression:
+    """Разобранное cron-выражение"""
+
+    __slots__ = ("expression", "minutes", "hours", "days", "months", "weekdays", "_any_day", "_any_weekday")
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise CronError(f"Expected 5 fields, got {len(fields)}: '{expression}'")
+        self.expression = " ".join(fields)
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            _parse_field(field, index) for index, field in enumerate(fields)
+        )
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        # Python: понедельник = 0, cron: воскресенье = 0
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return weekday_ok
+        if self._any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайший момент строго после moment (с точностью до минуты, в часовом поясе moment)"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=_MAX_SEARCH_DAYS)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise CronError(f"No run time found for '{self.expression}'")
+
+    def __repr__(self) -> str:
+        return f"CronExpression('{self.expression}')"
@@ -0,0 +1,38 @@
+"""
+Быстрая (де)сериализация JSON: orjson, если установлен, иначе стандартный json.
+Используется в HTTP-клиентах (PostgREST, YClients) и в ответах API.
+"""
+from decimal import Decimal
+from typing import Any, Union
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """Разбирает JSON из bytes/str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value: Any) -> bytes:
+    """Сериализует в компактный UTF-8 JSON (bytes)"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
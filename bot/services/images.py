@@ -0,0 +1,212 @@
+"""
+Адаптивные варианты изображений: при загрузке через админку из оригинала
+делаются размеры thumb/card/full в WebP и JPEG (fallback).
+
+Ресайз идет в пуле процессов (Pillow держит GIL на декодировании и кодировании).
+Варианты лежат в Storage рядом с оригиналом, их URL записываются в media_variants
+(ключ - путь оригинала в бакете) и в image_variants строки services/masters/promotions.
+Mini App получает из /api/app/content готовые srcset (см. build_srcset).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+
+from PIL import Image, ImageOps
+
+from bot.config import settings
+from bot.services.storage import StorageService, rewrite_storage_public_url
+from bot.services.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+# Ширина вариантов (px); больше оригинала не увеличиваем
+VARIANT_WIDTHS: Dict[str, int] = {"thumb": 160, "card": 480, "full": 1080}
+VARIANT_QUALITY: Dict[str, int] = {"webp": 80, "jpeg": 82}
+# Поля строк с картинками, для которых храним варианты
+IMAGE_FIELDS = ("image_url", "photo_url")
+# Размер для src (fallback для клиентов без srcset)
+DEFAULT_SIZE = "card"
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, а не fork: в процессе уже работают потоки (QueueListener логов, httpx),
+        # и копия их блокировок в дочернем процессе может остаться захваченной навсегда
+        _pool = ProcessPoolExecutor(
+            max_workers=max(settings.IMAGE_VARIANT_WORKERS, 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def render_variants(content: bytes) -> List[Tuple[str, str, int, int, bytes]]:
+    """
+    Выполняется в пуле процессов.
+    Возвращает (size, format, width, height, bytes) для каждого размера и формата.
+    """
+    with Image.open(BytesIO(content)) as source:
+        # JPEG декодируется сразу в уменьшенном масштабе, если это возможно
+        source.draft("RGB", (max(VARIANT_WIDTHS.values()), max(VARIANT_WIDTHS.values())))
+        image = ImageOps.exif_transpose(source)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+
+    variants = []
+    seen_widths = set()
+    for size, target_width in sorted(VARIANT_WIDTHS.items(), key=lambda item: item[1]):
+        width = min(target_width, image.width)
+        if width in seen_widths:
+            continue
+        seen_widths.add(width)
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+
+        webp = BytesIO()
+        resized.save(webp, "WEBP", quality=VARIANT_QUALITY["webp"], method=4)
+        variants.append((size, "webp", width, height, webp.getvalue()))
+
+        jpeg_source = resized
+        if has_alpha:
+            # У JPEG нет прозрачности: подкладываем белый фон
+            jpeg_source = Image.new("RGB", resized.size, (255, 255, 255))
+            jpeg_source.paste(resized, mask=resized.getchannel("A"))
+        jpeg = BytesIO()
+        jpeg_source.save(jpeg, "JPEG", quality=VARIANT_QUALITY["jpeg"], optimize=True, progressive=True)
+        variants.append((size, "jpeg", width, height, jpeg.getvalue()))
+    return variants
+
+
+async def generate_variants(content: bytes) -> Optional[List[Tuple[str, str, int, int, bytes]]]:
+    """Ресайз в пуле процессов; None, если формат не читается"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), render_variants, content)
+    except Exception as e:
+        logger.warning(f"Could not render image variants: {type(e).__name__}: {e}")
+        return None
+
+
+async def create_image_variants(
+    storage: StorageService,
+    source_url: str,
+    content: bytes,
+    folder: str = "images",
+) -> Optional[Dict[str, Any]]:
+    """
+    Делает варианты загруженного оригинала, кладет их в Storage рядом с ним
+    и сохраняет в media_variants. Возвращает {format: {size: {url, width, height}}}.
+    """
+    if not settings.IMAGE_VARIANTS_ENABLED:
+        return None
+    source_path = storage.extract_path_from_url(source_url)
+    if not source_path:
+        logger.warning(f"Could not extract storage path from {source_url}, skipping variants")
+        return None
+    rendered = await generate_variants(content)
+    if not rendered:
+        return None
+
+    base_path = source_path.rsplit(".", 1)[0]
+
+    async def _upload(size: str, image_format: str, width: int, height: int, data: bytes):
+        ext = "jpg" if image_format == "jpeg" else image_format
+        url = await storage.upload_file(data, f"{size}.{ext}", folder, file_path=f"{base_path}_{size}.{ext}")
+        return size, image_format, width, height, url
+
+    uploaded = await asyncio.gather(*(_upload(*item) for item in rendered))
+    variants: Dict[str, Any] = {}
+    for size, image_format, width, height, url in uploaded:
+        if not url:
+            logger.warning(f"Variant {size}.{image_format} upload failed for {source_path}")
+            continue
+        variants.setdefault(image_format, {})[size] = {"url": url, "width": width, "height": height}
+    if not variants:
+        return None
+
+    try:
+        await supabase.table("media_variants").insert({
+            "source_path": source_path,
+            "variants": variants,
+        }).execute()
+    except Exception as e:
+        logger.error(f"Failed to save media_variants for {source_path}: {e}")
+    return variants
+
+
+async def attach_image_variants(
+    storage: StorageService,
+    data: Dict[str, Any],
+    existing: Optional[Dict[str, Any]] = None,
+    fields: Iterable[str] = IMAGE_FIELDS,
+) -> None:
+    """
+    Записывает в data["image_variants"] варианты для картинок из data (по media_variants).
+    existing - текущие image_variants строки: варианты полей, которых нет в data, сохраняются.
+    """
+    changed = [field for field in fields if field in data]
+    if not changed:
+        return
+    image_variants = {
+        field: value for field, value in (existing or {}).items() if field not in changed
+    }
+    paths = {}
+    for field in changed:
+        path = storage.extract_path_from_url(data.get(field) or "")
+        if path:
+            paths[field] = path
+    if paths:
+        try:
+            res = await supabase.table("media_variants")\
+                .select("source_path,variants")\
+                .in_("source_path", sorted(set(paths.values())))\
+                .execute()
+            by_path = {row["source_path"]: row["variants"] for row in (res.data or [])}
+        except Exception as e:
+            logger.error(f"Failed to load media_variants: {e}")
+            by_path = {}
+        for field, path in paths.items():
+            if path in by_path:
+                image_variants[field] = by_path[path]
+    data["image_variants"] = image_variants
+
+
+def build_srcset(image_variants: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
+    """
+    {field: {format: {size: {url, width}}}} -> {field: {"webp": srcset, "jpeg": srcset, "src": url}}
+    """
+    result: Dict[str, Dict[str, str]] = {}
+    if not isinstance(image_variants, dict):
+        return result
+    for field, formats in image_variants.items():
+        if not isinstance(formats, dict):
+            continue
+        entry: Dict[str, str] = {}
+        for image_format in ("webp", "jpeg"):
+            sizes = formats.get(image_format) or {}
+            candidates = sorted(
+                (variant for variant in sizes.values() if variant.get("url") and variant.get("width")),
+                key=lambda variant: variant["width"],
+            )
+            if candidates:
+                entry[image_format] = ", ".join(
+                    f"{rewrite_storage_public_url(variant['url'])} {variant['width']}w" for variant in candidates
+                )
+        fallback = (formats.get("jpeg") or {}).get(DEFAULT_SIZE) or next(iter((formats.get("jpeg") or {}).values()), None)
+        if fallback and fallback.get("url"):
+            entry["src"] = rewrite_storage_public_url(fallback["url"])
+        if entry:
+            result[field] = entry
+    return result
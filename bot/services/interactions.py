@@ -0,0 +1,53 @@
+"""
+Отметка активности пользователя (users.last_interaction_at, миграция 029).
+
+По last_interaction_at приоритетная синхронизация с YClients (bot/tasks/sync.py)
+отличает активных клиентов от спящих. Запись в БД делается не чаще раза
+в INTERACTION_TOUCH_INTERVAL_SECONDS на пользователя и в фоне, чтобы не задерживать
+ответ боту и Mini App.
+"""
+from typing import Dict, Set
+import asyncio
+import logging
+import time
+
+from bot.config import settings
+from bot.services.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+INTERACTION_TOUCH_INTERVAL_SECONDS = 3600
+
+# Предел размера таблицы последних отметок (tg_id -> monotonic)
+_MAX_TRACKED_USERS = 50000
+
+_last_touch: Dict[int, float] = {}
+_pending: Set[asyncio.Task] = set()
+
+
+async def _write(tg_id: int) -> None:
+    try:
+        await supabase.rpc("touch_user_interaction", {
+            "p_tg_id": tg_id,
+            "p_sync_due_seconds": settings.SYNC_HOT_INTERVAL_HOURS * 3600
+        }).execute()
+    except Exception as e:
+        # Повторим при следующем действии пользователя
+        _last_touch.pop(tg_id, None)
+        logger.warning(f"Could not record interaction for tg_id={tg_id}: {e}")
+
+
+def touch_user_interaction(tg_id: int) -> None:
+    """Отмечает действие пользователя в боте или Mini App"""
+    if not tg_id:
+        return
+    now = time.monotonic()
+    last = _last_touch.get(tg_id)
+    if last is not None and now - last < INTERACTION_TOUCH_INTERVAL_SECONDS:
+        return
+    if len(_last_touch) >= _MAX_TRACKED_USERS:
+        _last_touch.clear()
+    _last_touch[tg_id] = now
+    task = asyncio.create_task(_write(tg_id))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
@@ -0,0 +1,78 @@
+"""
+Очередь фоновых задач в Postgres (миграция 027).
+
+API ставит задачу (enqueue_job), процесс python -m bot.worker забирает и выполняет.
+Используется при BACKGROUND_MODE=worker; в режиме inline задачи выполняются
+в процессе API, как раньше.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import logging
+
+from bot.config import settings
+from bot.services.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+# Виды задач
+JOB_BROADCAST = "broadcast"                  # {"broadcast_id": ...}
+JOB_YCLIENTS_PAYMENT = "yclients_payment"    # тело вебхука YClients
+JOB_TELEGRAM_UPDATE = "telegram_update"      # JSON обновления Telegram
+
+
+def worker_mode() -> bool:
+    """Фоновая работа вынесена в отдельный процесс bot.worker"""
+    return settings.BACKGROUND_MODE == "worker"
+
+
+def telegram_updates_in_worker() -> bool:
+    """Обновления Telegram обрабатывает bot.worker (через job_queue), а не процесс API"""
+    return worker_mode() and settings.TELEGRAM_UPDATES_IN_WORKER
+
+
+async def enqueue_job(
+    kind: str,
+    payload: Dict[str, Any],
+    run_after: Optional[datetime] = None,
+    max_attempts: int = 3,
+) -> Optional[int]:
+    """Ставит задачу в очередь, возвращает ее id"""
+    job = {"kind": kind, "payload": payload, "max_attempts": max_attempts}
+    if run_after is not None:
+        job["run_after"] = run_after.isoformat()
+    res = await supabase.table("job_queue").insert(job).execute()
+    job_id = res.data[0]["id"] if res.data else None
+    logger.debug(f"Job {kind} enqueued: id={job_id}")
+    return job_id
+
+
+async def claim_jobs(worker_id: str, limit: int, kinds: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Забирает готовые задачи для воркера"""
+    res = await supabase.rpc("claim_jobs", {
+        "p_worker": worker_id,
+        "p_limit": limit,
+        "p_kinds": kinds,
+        "p_stale_seconds": settings.WORKER_JOB_STALE_SECONDS
+    }).execute()
+    return res.data or []
+
+
+async def complete_job(job_id: int, worker_id: str, error: Optional[str] = None) -> Optional[str]:
+    """Отмечает результат задачи; возвращает новый статус (done, pending для повтора, failed)"""
+    res = await supabase.rpc("complete_job", {
+        "p_id": job_id,
+        "p_worker": worker_id,
+        "p_error": error[:2000] if error else None
+    }).execute()
+    return res.data
+
+
+async def heartbeat_jobs(worker_id: str, job_ids: List[int]) -> None:
+    if not job_ids:
+        return
+    await supabase.rpc("heartbeat_jobs", {"p_worker": worker_id, "p_ids": job_ids}).execute()
+
+
+async def purge_finished_jobs(keep_days: int = 7) -> int:
+    res = await supabase.rpc("purge_finished_jobs", {"p_keep_days": keep_days}).execute()
+    return int(res.data or 0)
@@ -0,0 +1,60 @@
+"""
+Аренда фоновых задач между экземплярами приложения (миграция 026).
+
+При нескольких воркерах uvicorn или репликах каждый процесс запускает планировщик
+(bot/services/scheduler.py), но задачи выполняет только владелец аренды в job_leases.
+Владелец продлевает аренду каждые LEADER_POLL_SECONDS, остальные проверяют,
+не истекла ли она. Если владелец упал, задачи подхватит другой экземпляр
+не позже чем через LEADER_LEASE_TTL_SECONDS.
+"""
+import logging
+import os
+import socket
+import uuid
+
+from bot.config import settings
+from bot.services.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор экземпляра (хост, pid и случайный суффикс - перезапуск не наследует аренду)
+INSTANCE_ID = settings.INSTANCE_ID or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobLease:
+    """Аренда одной фоновой задачи"""
+
+    def __init__(self, name: str, ttl_seconds: int):
+        self.name = name
+        self.ttl_seconds = max(ttl_seconds, 1)
+        self.held = False
+
+    async def acquire(self) -> bool:
+        """Захватывает или продлевает аренду; при ошибке БД считаем, что аренды нет"""
+        try:
+            res = await supabase.rpc("try_acquire_job_lease", {
+                "p_name": self.name,
+                "p_holder": INSTANCE_ID,
+                "p_ttl_seconds": self.ttl_seconds
+            }).execute()
+            acquired = res.data is True
+        except Exception as e:
+            logger.warning(f"Could not acquire lease '{self.name}': {e}")
+            acquired = False
+        if acquired != self.held:
+            logger.info(f"Lease '{self.name}' {'acquired' if acquired else 'lost'} by {INSTANCE_ID}")
+        self.held = acquired
+        return acquired
+
+    async def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        try:
+            await supabase.rpc("release_job_lease", {
+                "p_name": self.name,
+                "p_holder": INSTANCE_ID
+            }).execute()
+        except Exception as e:
+            logger.warning(f"Could not release lease '{self.name}': {e}")
+
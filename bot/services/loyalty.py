@@ -10,21 +10,45 @@ from bot.services.supabase_client import supabase
 from bot.services.phone_normalize import normalize_phone
 from bot.services.settings import get_setting
 from bot.services.yclients_api import yclients
+from bot.services.visits import is_sync_due
 from bot.config import settings
 from typing import Optional, Tuple, Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def sync_user_with_yclients(user_id: int) -> Optional[Dict[str, Any]]:
+# Как часто интерактивная синхронизация обновляет loyalty_last_sync, если данные не менялись
+LOYALTY_SYNC_TOUCH_MINUTES = 30
+
+
+async def _apply_user_updates(user_id: int, user: Dict[str, Any], updates: Dict[str, Any]) -> None:
+    """Одно обновление users со всеми накопленными изменениями (ничего не пишет, если изменений нет)"""
+    if not updates:
+        return
+    updates["updated_at"] = datetime.now(timezone.utc).isoformat()
+    await supabase.table("users").update(updates).eq("id", user_id).execute()
+    user.update(updates)
+
+
+async def sync_user_with_yclients(
+    user_id: int,
+    user: Optional[Dict[str, Any]] = None,
+    touch_sync_timestamp: bool = True
+) -> Optional[Dict[str, Any]]:
     """
     Синхронизирует данные пользователя с YClients:
     1. Ищет клиента в YClients по телефону
     2. Получает актуальный баланс и детали карты
-    3. Обновляет данные в нашей базе
+    3. Обновляет данные в нашей базе (одним запросом и только если что-то изменилось)
     4. Логирует изменения баланса если они произошли извне
     
+    Args:
+        user_id: ID пользователя
+        user: Уже загруженная строка users (чтобы не читать ее повторно)
+        touch_sync_timestamp: Обновлять ли loyalty_last_sync. Периодическая задача
+            передает False и проставляет время пачкой для всех пользователей.
+    
     Returns:
         dict с ключами:
           - balance: актуальный баланс по данным YClients
@@ -32,13 +56,15 @@ async def sync_user_with_yclients(user_id: int) -> Optional[Dict[str, Any]]:
     """
     try:
         # Получаем данные пользователя из нашей базы
-        user_res = await supabase.table("users").select("*").eq("id", user_id).execute()
-        if not user_res.data:
-            return None
+        if user is None:
+            user_res = await supabase.table("users").select("*").eq("id", user_id).execute()
+            if not user_res.data:
+                return None
+            user = user_res.data[0]
         
-        user = user_res.data[0]
         phone = user.get("phone")
         yclients_id = user.get("yclients_id")
+        updates: Dict[str, Any] = {}
         # Берем локальный баланс через RPC (учитывает истекшие баллы)
         old_balance = user.get("balance") or 0
         try:
@@ -49,10 +75,10 @@ async def sync_user_with_yclients(user_id: int) -> Optional[Dict[str, Any]]:
         # 1. Если нет yclients_id, ищем по телефону
         if not yclients_id and phone:
             client = await yclients.get_client_by_phone(phone)
-            if client:
-                yclients_id = client.get("id")
-                # Сохраняем найденный ID
-                await supabase.table("users").update({"yclients_id": yclients_id}).eq("id", user_id).execute()
+            if client and client.get("id"):
+                yclients_id = client["id"]
+                # Сохраняем найденный ID вместе с остальными изменениями
+                updates["yclients_id"] = yclients_id
         
         if not yclients_id:
             logger.warning(f"Could not find YClients ID for user {user_id}")
@@ -62,6 +88,7 @@ async def sync_user_with_yclients(user_id: int) -> Optional[Dict[str, Any]]:
         loyalty_card = await yclients.get_client_loyalty_card(yclients_id)
         if not loyalty_card:
             logger.info(f"No loyalty card found for user {user_id} (yclients_id: {yclients_id})")
+            await _apply_user_updates(user_id, user, updates)
             return {"balance": old_balance, "diff": 0, "no_card": True}
 
         # 3. Получаем информацию о лояльности
@@ -96,37 +123,40 @@ async def sync_user_with_yclients(user_id: int) -> Optional[Dict[str, Any]]:
                 
                 try:
                     # Используем RPC для атомарной корректировки баланса и FIFO-остатков
+                    # (RPC сам обновляет users.balance)
                     await supabase.rpc("adjust_loyalty_balance", {
                         "p_user_id": user_id,
                         "p_amount": diff,
                         "p_description": f"Синхронизация с YClients ({'+' if diff > 0 else ''}{diff} баллов)",
                         "p_expiration_days": expiration_days
                     }).execute()
+                    user["balance"] = balance
                     logger.info(f"Balance adjusted via sync for user {user_id}: {diff}")
                 except Exception as sync_err:
                     logger.error(f"Error calling adjust_loyalty_balance for user {user_id}: {sync_err}")
                     # Fallback на простое обновление если RPC не сработал
-                    await supabase.table("users").update({"balance": balance}).eq("id", user_id).execute()
-            else:
-                # Если локальный баланс мог устареть (например, истекли баллы), обновляем его
-                if user.get("balance") != old_balance:
-                    await supabase.table("users").update({
-                        "balance": old_balance,
-                        "updated_at": datetime.utcnow().isoformat()
-                    }).eq("id", user_id).execute()
-
-            # 5. Обновляем дополнительные поля (номер карты, статус, время синхронизации)
-            await supabase.table("users").update({
-                "loyalty_card_number": card_number,
-                "loyalty_status": card_status,
-                "loyalty_last_sync": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", user_id).execute()
+                    updates["balance"] = balance
+            elif user.get("balance") != old_balance:
+                # Локальный баланс мог устареть (например, истекли баллы)
+                updates["balance"] = old_balance
+
+            # 5. Дополнительные поля карты пишем только при изменении
+            if card_number != user.get("loyalty_card_number"):
+                updates["loyalty_card_number"] = card_number
+            if card_status != user.get("loyalty_status"):
+                updates["loyalty_status"] = card_status
+            if touch_sync_timestamp and (
+                updates or is_sync_due(user.get("loyalty_last_sync"), LOYALTY_SYNC_TOUCH_MINUTES)
+            ):
+                updates["loyalty_last_sync"] = datetime.now(timezone.utc).isoformat()
+
+            await _apply_user_updates(user_id, user, updates)
             
             logger.debug(f"Synced user {user_id}: balance={balance}, card={card_number}")
             return {"balance": balance, "diff": diff}
         else:
             logger.debug(f"No loyalty info found for user {user_id} (yclients_id: {yclients_id})")
+            await _apply_user_updates(user_id, user, updates)
             
     except Exception as e:
         logger.error(f"Error syncing user {user_id} with YClients: {e}", exc_info=True)
@@ -246,6 +276,36 @@ async def apply_yclients_manual_transaction(
         logger.error(f"Error in apply_yclients_manual_transaction: {e}", exc_info=True)
         return False, f"Ошибка операции: {str(e)}", None
 
+# Размер пачки для expire_loyalty_points (строк ledger за один RPC)
+EXPIRE_BATCH_SIZE = 1000
+
+
+async def expire_loyalty_points(batch_size: int = EXPIRE_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Сжигает истекшие баллы через RPC expire_loyalty_points.
+    Вызывает RPC пачками, пока не обработаны все истекшие остатки.
+    
+    Returns:
+        dict: expired_rows, expired_points, users - суммарно по всем пачкам
+    """
+    totals = {"expired_rows": 0, "expired_points": 0, "users": 0}
+    while True:
+        result = await supabase.rpc("expire_loyalty_points", {
+            "p_batch_size": batch_size
+        }).execute()
+        data = result.data or {}
+        for key in totals:
+            totals[key] += int(data.get(key) or 0)
+        if int(data.get("expired_rows") or 0) < batch_size:
+            break
+    if totals["expired_rows"]:
+        logger.info(
+            f"Expired {totals['expired_points']} points in {totals['expired_rows']} "
+            f"transactions for {totals['users']} users"
+        )
+    return totals
+
+
 async def get_user_available_balance(user_id: int) -> int:
     """
     Получает актуальный баланс пользователя (только не истекшие баллы)
@@ -0,0 +1,242 @@
+"""
+Метрики вызовов внешних сервисов (YClients, Supabase/PostgREST) и входящих HTTP-запросов.
+Хранятся в памяти процесса и отдаются в формате Prometheus через /metrics.
+
+Дополнительно для каждого входящего запроса считается "бюджет" внешних вызовов:
+сколько раз запрос сходил в YClients и Supabase (видно в debug-логах).
+"""
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import re
+import threading
+
+# Границы корзин гистограммы задержек (секунды)
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NUMERIC_SEGMENT = re.compile(r"^-?\d+$")
+_HEX_SEGMENT = re.compile(r"^[0-9a-fA-F-]{16,}$")
+
+# Счетчики внешних вызовов текущего входящего запроса
+_call_budget: ContextVar[Optional[Counter]] = ContextVar("upstream_call_budget", default=None)
+
+
+def normalize_path(path: str) -> str:
+    """Шаблон пути без идентификаторов: clients/443477/15 -> clients/{id}/{id}"""
+    path = path.split("?", 1)[0].strip("/")
+    segments = []
+    for segment in path.split("/"):
+        if _NUMERIC_SEGMENT.match(segment) or _HEX_SEGMENT.match(segment):
+            segments.append("{id}")
+        else:
+            segments.append(segment)
+    return "/".join(segments) or "/"
+
+
+class _Histogram:
+    """Счетчик + сумма + корзины для одного набора меток"""
+
+    __slots__ = ("count", "total", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (upstream, method, endpoint) -> гистограмма задержек
+        self.upstream_latency: Dict[Tuple[str, str, str], _Histogram] = {}
+        # (upstream, method, endpoint, status) -> количество вызовов
+        self.upstream_calls: Counter = Counter()
+        # (upstream, method, endpoint) -> байты запроса / ответа
+        self.upstream_request_bytes: Counter = Counter()
+        self.upstream_response_bytes: Counter = Counter()
+        # (method, route) -> гистограмма, (method, route, status) -> количество
+        self.http_latency: Dict[Tuple[str, str], _Histogram] = {}
+        self.http_requests: Counter = Counter()
+        # (update_type, status) -> количество обновлений Telegram, (update_type,) -> ожидание в очереди
+        self.telegram_updates: Counter = Counter()
+        self.telegram_update_lag: Dict[Tuple[str], _Histogram] = {}
+        # Имя -> (описание, функция текущего значения); значения снимаются при отдаче /metrics
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def record_upstream(
+        self,
+        upstream: str,
+        method: str,
+        endpoint: str,
+        status: str,
+        duration: float,
+        request_bytes: int = 0,
+        response_bytes: int = 0,
+    ) -> None:
+        key = (upstream, method, endpoint)
+        with self._lock:
+            histogram = self.upstream_latency.get(key)
+            if histogram is None:
+                histogram = self.upstream_latency[key] = _Histogram()
+            histogram.observe(duration)
+            self.upstream_calls[key + (status,)] += 1
+            self.upstream_request_bytes[key] += request_bytes
+            self.upstream_response_bytes[key] += response_bytes
+        budget = _call_budget.get()
+        if budget is not None:
+            budget[upstream] += 1
+
+    def record_http(self, method: str, route: str, status: int, duration: float) -> None:
+        key = (method, route)
+        with self._lock:
+            histogram = self.http_latency.get(key)
+            if histogram is None:
+                histogram = self.http_latency[key] = _Histogram()
+            histogram.observe(duration)
+            self.http_requests[key + (str(status),)] += 1
+
+    def record_telegram_update(self, update_type: Optional[str], status: str, lag: Optional[float] = None) -> None:
+        key = (update_type or "unknown",)
+        with self._lock:
+            self.telegram_updates[key + (status,)] += 1
+            if lag is not None:
+                histogram = self.telegram_update_lag.get(key)
+                if histogram is None:
+                    histogram = self.telegram_update_lag[key] = _Histogram()
+                histogram.observe(lag)
+
+    def register_gauge(self, name: str, help_text: str, collect: Callable[[], float]) -> None:
+        with self._lock:
+            self._gauges[name] = (help_text, collect)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.upstream_latency.clear()
+            self.upstream_calls.clear()
+            self.upstream_request_bytes.clear()
+            self.upstream_response_bytes.clear()
+            self.http_latency.clear()
+            self.http_requests.clear()
+            self.telegram_updates.clear()
+            self.telegram_update_lag.clear()
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)"""
+        upstream_labels = ("upstream", "method", "endpoint")
+        http_labels = ("method", "route")
+        lines: List[str] = []
+        with self._lock:
+            _render_counter(
+                lines, "cveti_upstream_requests_total", "Upstream HTTP calls",
+                upstream_labels + ("status",), self.upstream_calls,
+            )
+            _render_histogram(
+                lines, "cveti_upstream_request_duration_seconds", "Upstream HTTP call latency",
+                upstream_labels, self.upstream_latency,
+            )
+            _render_counter(
+                lines, "cveti_upstream_request_bytes_total", "Upstream request body bytes",
+                upstream_labels, self.upstream_request_bytes,
+            )
+            _render_counter(
+                lines, "cveti_upstream_response_bytes_total", "Upstream response body bytes",
+                upstream_labels, self.upstream_response_bytes,
+            )
+            _render_counter(
+                lines, "cveti_http_requests_total", "Incoming HTTP requests",
+                http_labels + ("status",), self.http_requests,
+            )
+            _render_histogram(
+                lines, "cveti_http_request_duration_seconds", "Incoming HTTP request latency",
+                http_labels, self.http_latency,
+            )
+            _render_counter(
+                lines, "cveti_telegram_updates_total", "Telegram webhook updates by outcome",
+                ("update_type", "status"), self.telegram_updates,
+            )
+            _render_histogram(
+                lines, "cveti_telegram_update_lag_seconds", "Time a Telegram update waited in the queue",
+                ("update_type",), self.telegram_update_lag,
+            )
+            gauges = list(self._gauges.items())
+        for name, (help_text, collect) in gauges:
+            try:
+                value = float(collect())
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}"
+
+
+def _render_counter(lines: List[str], name: str, help_text: str, label_names: Tuple[str, ...], values: Counter) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for key in sorted(values):
+        lines.append(f"{name}{_labels(label_names, key)} {values[key]}")
+
+
+def _render_histogram(
+    lines: List[str],
+    name: str,
+    help_text: str,
+    label_names: Tuple[str, ...],
+    histograms: Dict[Tuple[str, ...], _Histogram],
+) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for key in sorted(histograms):
+        histogram = histograms[key]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+            cumulative += count
+            bucket_labels = _labels(label_names, key, 'le="%s"' % bound)
+            lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        inf_labels = _labels(label_names, key, 'le="+Inf"')
+        lines.append(f"{name}_bucket{inf_labels} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(label_names, key)} {histogram.total:.6f}")
+        lines.append(f"{name}_count{_labels(label_names, key)} {histogram.count}")
+
+
+def start_call_budget():
+    """Начинает подсчет внешних вызовов для текущего запроса, возвращает токен для finish_call_budget"""
+    return _call_budget.set(Counter())
+
+
+def call_budget_used(upstream: str) -> int:
+    """Сколько вызовов upstream уже сделано с начала текущего подсчета"""
+    budget = _call_budget.get()
+    return budget[upstream] if budget is not None else 0
+
+
+def finish_call_budget(token) -> Counter:
+    """Завершает подсчет и возвращает количество вызовов по сервисам"""
+    budget = _call_budget.get() or Counter()
+    _call_budget.reset(token)
+    return budget
+
+
+# Глобальный реестр
+metrics = MetricsRegistry()
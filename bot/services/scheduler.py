@@ -0,0 +1,239 @@
+"""
+Планировщик периодических задач (миграция 028).
+
+Задача запускается по cron-выражению (в часовом поясе SCHEDULER_TIMEZONE) или по
+динамическому сроку next_due (например, ближайшая запланированная рассылка).
+Вместо опроса с фиксированным интервалом планировщик спит до ближайшего срока;
+wake() будит его раньше (например, после создания запланированной рассылки).
+
+- Время запусков хранится в scheduled_jobs: после перезапуска пропущенный запуск
+  выполняется сразу, а расписание не сдвигается от времени старта процесса.
+- jitter_seconds - случайная задержка cron-запуска, чтобы не нагружать YClients
+  и БД ровно в начале часа.
+- Задача не запускается повторно, пока выполняется предыдущий запуск.
+- При нескольких экземплярах задачи запускает только владелец аренды "scheduler".
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Set
+from zoneinfo import ZoneInfo
+import asyncio
+import logging
+import random
+import time
+
+from bot.config import settings
+from bot.services.cron import CronExpression
+from bot.services.leader import JobLease
+from bot.services.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_LEASE = "scheduler"
+
+# Минимальная пауза между запусками задачи с динамическим сроком
+_MIN_DYNAMIC_INTERVAL = timedelta(seconds=1)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class ScheduledJob:
+    """Периодическая задача и ее состояние в процессе-владельце"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[object]],
+        cron: Optional[str] = None,
+        jitter_seconds: float = 0,
+        next_due: Optional[Callable[[], Awaitable[Optional[datetime]]]] = None,
+        recheck_seconds: float = 60,
+    ):
+        if (cron is None) == (next_due is None):
+            raise ValueError(f"Job '{name}' needs either cron or next_due")
+        self.name = name
+        self.func = func
+        self.cron = CronExpression(cron) if cron else None
+        self.jitter_seconds = max(jitter_seconds, 0)
+        self.next_due = next_due
+        self.recheck_seconds = max(recheck_seconds, 1)
+        self.next_run_at: Optional[datetime] = None
+        self.last_started_at: Optional[datetime] = None
+        self.last_finished_at: Optional[datetime] = None
+        self.running = False
+
+    @property
+    def schedule(self) -> str:
+        if self.cron:
+            return f"{self.cron.expression} ({settings.SCHEDULER_TIMEZONE})"
+        return f"dynamic, recheck {int(self.recheck_seconds)}s"
+
+
+class Scheduler:
+    """Планировщик задач процесса (API при BACKGROUND_MODE=inline или bot.worker)"""
+
+    def __init__(self):
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._planned = False
+
+    def add_job(self, name: str, func: Callable[[], Awaitable[object]], **options) -> ScheduledJob:
+        job = ScheduledJob(name, func, **options)
+        self.jobs[name] = job
+        return job
+
+    def wake(self) -> None:
+        """Пересчитать сроки сейчас (например, появилась новая запланированная рассылка)"""
+        if self._wake is not None:
+            self._wake.set()
+
+    def _cron_next(self, job: ScheduledJob, after: datetime) -> datetime:
+        local = after.astimezone(ZoneInfo(settings.SCHEDULER_TIMEZONE))
+        return job.cron.next_after(local).astimezone(timezone.utc)
+
+    def _with_jitter(self, job: ScheduledJob, moment: datetime) -> datetime:
+        if not job.jitter_seconds:
+            return moment
+        return moment + timedelta(seconds=random.uniform(0, job.jitter_seconds))
+
+    async def _plan(self, job: ScheduledJob, now: datetime) -> None:
+        """Вычисляет next_run_at задачи"""
+        if job.cron:
+            if job.last_started_at is None:
+                job.next_run_at = self._with_jitter(job, self._cron_next(job, now))
+                return
+            due = self._cron_next(job, job.last_started_at)
+            # Запуск пропущен (процесс был остановлен) - выполняем сразу
+            job.next_run_at = due if due <= now else self._with_jitter(job, due)
+            return
+
+        recheck = now + timedelta(seconds=job.recheck_seconds)
+        try:
+            due = await job.next_due()
+        except Exception as e:
+            logger.warning(f"Could not compute next due time for '{job.name}': {e}")
+            due = None
+        if due is not None and job.last_finished_at is not None:
+            due = max(due, job.last_finished_at + _MIN_DYNAMIC_INTERVAL)
+        job.next_run_at = min(due, recheck) if due is not None else recheck
+
+    async def _record(self, job: ScheduledJob, event: str, **fields) -> None:
+        try:
+            await supabase.rpc("record_scheduled_job", {
+                "p_name": job.name,
+                "p_event": event,
+                "p_schedule": job.schedule,
+                "p_next_run_at": job.next_run_at.isoformat() if job.next_run_at else None,
+                **fields
+            }).execute()
+        except Exception as e:
+            logger.warning(f"Could not record scheduled job '{job.name}' ({event}): {e}")
+
+    async def _load_state(self) -> None:
+        """Время последних запусков из scheduled_jobs"""
+        try:
+            res = await supabase.table("scheduled_jobs").select("name,last_started_at,last_finished_at").execute()
+        except Exception as e:
+            logger.warning(f"Could not load scheduled jobs state: {e}")
+            return
+        for row in res.data or []:
+            job = self.jobs.get(row.get("name"))
+            if job:
+                job.last_started_at = _parse_timestamp(row.get("last_started_at"))
+                job.last_finished_at = _parse_timestamp(row.get("last_finished_at"))
+
+    async def _plan_all(self) -> None:
+        await self._load_state()
+        now = _utcnow()
+        for job in self.jobs.values():
+            if not job.running:
+                await self._plan(job, now)
+                await self._record(job, "scheduled")
+                logger.info(f"Job '{job.name}' [{job.schedule}] next run at {job.next_run_at.isoformat()}")
+        self._planned = True
+
+    async def _execute(self, job: ScheduledJob) -> None:
+        job.running = True
+        job.last_started_at = _utcnow()
+        started = time.monotonic()
+        await self._record(job, "started")
+        status, error = "ok", None
+        try:
+            await job.func()
+        except Exception as e:
+            status, error = "error", (str(e) or e.__class__.__name__)[:2000]
+            logger.error(f"Scheduled job '{job.name}' failed: {e}", exc_info=True)
+        finally:
+            job.running = False
+            job.last_finished_at = _utcnow()
+            await self._plan(job, job.last_finished_at)
+            await self._record(
+                job, "finished",
+                p_status=status, p_error=error, p_duration_ms=int((time.monotonic() - started) * 1000)
+            )
+            self.wake()
+
+    async def run(self) -> None:
+        self._wake = asyncio.Event()
+        lease = JobLease(SCHEDULER_LEASE, settings.LEADER_LEASE_TTL_SECONDS)
+        # Аренда продлевается в каждой итерации, а итерация - не реже раза в poll_seconds
+        poll_seconds = max(min(settings.LEADER_POLL_SECONDS, lease.ttl_seconds / 2), 1)
+        logger.info(f"Scheduler started with jobs: {', '.join(self.jobs)}")
+        try:
+            while True:
+                if not await lease.acquire():
+                    # Не владелец: после захвата аренды сроки пересчитаются из scheduled_jobs
+                    self._planned = False
+                    await self._sleep(poll_seconds)
+                    continue
+                if not self._planned:
+                    await self._plan_all()
+
+                now = _utcnow()
+                for job in self.jobs.values():
+                    if job.running or job.next_run_at is None:
+                        continue
+                    if job.next_run_at <= now:
+                        task = asyncio.create_task(self._execute(job), name=f"scheduled-{job.name}")
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                    elif job.next_due is not None and self._wake.is_set():
+                        # Разбудили: срок динамической задачи мог приблизиться
+                        await self._plan(job, now)
+
+                self._wake.clear()
+                pending = [
+                    job.next_run_at for job in self.jobs.values()
+                    if not job.running and job.next_run_at is not None
+                ]
+                delay = poll_seconds
+                if pending:
+                    delay = min(delay, max((min(pending) - _utcnow()).total_seconds(), 0))
+                await self._sleep(delay)
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await lease.release()
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+# Глобальный планировщик процесса; задачи регистрирует bot.tasks.schedule
+scheduler = Scheduler()
@@ -0,0 +1,191 @@
+"""
+Сегменты получателей рассылок.
+
+Сегмент - словарь условий, объединяемых через AND (пустой сегмент - все пользователи):
+
+    {
+        "balance_min": 100, "balance_max": 5000,          # доступные баллы, включительно
+        "registered_from": "2024-01-01", "registered_to": "2024-12-31",
+        "last_visit_from": "2024-06-01", "last_visit_to": "2024-09-01",
+        "visits_min": 2, "visits_max": 10,                # состоявшиеся визиты
+        "spent_min": 10000, "spent_max": 50000,           # сумма состоявшихся визитов
+        "masters": ["Анна"], "services": ["Маникюр"],     # хотя бы один из списка
+    }
+
+Даты - "YYYY-MM-DD" или ISO datetime; дата без времени в *_to включает весь день.
+parse_segment проверяет и нормализует сегмент, а выборка выполняется одним
+RPC select_segment_users (миграция 024) по users, loyalty_balances и user_visit_stats.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+import logging
+import math
+
+from bot.services.supabase_client import supabase
+
+logger = logging.getLogger(__name__)
+
+# Ключ сегмента -> тип значения
+SEGMENT_FIELDS: Dict[str, str] = {
+    "balance_min": "int",
+    "balance_max": "int",
+    "registered_from": "date_from",
+    "registered_to": "date_to",
+    "last_visit_from": "date_from",
+    "last_visit_to": "date_to",
+    "visits_min": "int",
+    "visits_max": "int",
+    "spent_min": "number",
+    "spent_max": "number",
+    "masters": "list",
+    "services": "list",
+}
+
+# Пары (min, max), для которых проверяется min <= max
+_RANGES = (
+    ("balance_min", "balance_max"),
+    ("registered_from", "registered_to"),
+    ("last_visit_from", "last_visit_to"),
+    ("visits_min", "visits_max"),
+    ("spent_min", "spent_max"),
+)
+
+MAX_LIST_ITEMS = 50
+
+
+class SegmentError(ValueError):
+    """Некорректное описание сегмента"""
+
+
+def _parse_number(key: str, value: Any, integer: bool):
+    if isinstance(value, bool):
+        raise SegmentError(f"{key}: expected a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise SegmentError(f"{key}: expected a number")
+    if not math.isfinite(number):
+        raise SegmentError(f"{key}: expected a finite number")
+    if integer:
+        if not number.is_integer():
+            raise SegmentError(f"{key}: expected an integer")
+        return int(number)
+    return int(number) if number.is_integer() else number
+
+
+def _parse_date(key: str, value: Any, end_of_range: bool) -> str:
+    if not isinstance(value, str) or not value.strip():
+        raise SegmentError(f"{key}: expected a date")
+    text = value.strip()
+    try:
+        if len(text) == 10:
+            parsed_date = date.fromisoformat(text)
+            if end_of_range:
+                # Граница "до" исключающая: дата без времени включает весь день.
+                # Результат - datetime, чтобы повторный parse_segment не сдвигал его еще раз
+                return datetime.combine(parsed_date + timedelta(days=1), time()).isoformat()
+            return parsed_date.isoformat()
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).isoformat()
+    except ValueError:
+        raise SegmentError(f"{key}: invalid date '{text}'")
+
+
+def _parse_list(key: str, value: Any) -> List[str]:
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, (list, tuple)):
+        raise SegmentError(f"{key}: expected a list of names")
+    items = []
+    for item in value:
+        name = str(item).strip() if item is not None else ""
+        if name and name not in items:
+            items.append(name)
+    if len(items) > MAX_LIST_ITEMS:
+        raise SegmentError(f"{key}: at most {MAX_LIST_ITEMS} names")
+    return items
+
+
+def _greater(low: Any, high: Any) -> bool:
+    if isinstance(low, str):
+        try:
+            low, high = datetime.fromisoformat(low), datetime.fromisoformat(high)
+            return low > high
+        except (TypeError, ValueError):
+            # Дата с часовым поясом и без него - сравнение оставляем БД
+            return False
+    return low > high
+
+
+def parse_segment(raw: Any) -> Dict[str, Any]:
+    """Проверяет и нормализует сегмент; пустые значения отбрасываются"""
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise SegmentError("Segment must be an object")
+    unknown = sorted(set(raw) - set(SEGMENT_FIELDS))
+    if unknown:
+        raise SegmentError(f"Unknown segment fields: {', '.join(unknown)}")
+
+    segment: Dict[str, Any] = {}
+    for key, kind in SEGMENT_FIELDS.items():
+        value = raw.get(key)
+        if value is None or value == "" or value == []:
+            continue
+        if kind == "int":
+            segment[key] = _parse_number(key, value, integer=True)
+        elif kind == "number":
+            segment[key] = _parse_number(key, value, integer=False)
+        elif kind in ("date_from", "date_to"):
+            segment[key] = _parse_date(key, value, end_of_range=kind == "date_to")
+        else:
+            items = _parse_list(key, value)
+            if items:
+                segment[key] = items
+
+    for low, high in _RANGES:
+        if low in segment and high in segment and _greater(segment[low], segment[high]):
+            raise SegmentError(f"{low} must not be greater than {high}")
+    return segment
+
+
+def segment_from_broadcast(broadcast: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Сегмент рассылки: поле segment или старые recipient_type/filter_*.
+    None - получатели заданы списком (recipient_type = 'selected').
+    """
+    recipient_type = broadcast.get("recipient_type") or "all"
+    if recipient_type == "selected":
+        return None
+    if recipient_type == "segment" or broadcast.get("segment"):
+        return parse_segment(broadcast.get("segment") or {})
+    if recipient_type == "by_balance":
+        return parse_segment({
+            "balance_min": broadcast.get("filter_balance_min"),
+            "balance_max": broadcast.get("filter_balance_max"),
+        })
+    if recipient_type == "by_date":
+        return parse_segment({
+            "registered_from": broadcast.get("filter_date_from"),
+            "registered_to": broadcast.get("filter_date_to"),
+        })
+    return {}
+
+
+async def _select(segment: Dict[str, Any], count_only: bool) -> Dict[str, Any]:
+    res = await supabase.rpc("select_segment_users", {
+        "p_segment": segment,
+        "p_count_only": count_only
+    }).execute()
+    return res.data or {}
+
+
+async def count_segment(segment: Dict[str, Any]) -> int:
+    """Размер аудитории сегмента (для предпросмотра перед отправкой)"""
+    result = await _select(segment, count_only=True)
+    return int(result.get("count") or 0)
+
+
+async def select_segment_tg_ids(segment: Dict[str, Any]) -> List[int]:
+    """tg_id пользователей сегмента"""
+    result = await _select(segment, count_only=False)
+    return [int(tg_id) for tg_id in (result.get("tg_ids") or []) if tg_id]
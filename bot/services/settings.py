@@ -3,6 +3,7 @@
 Поддерживает кэширование для оптимизации производительности
 """
 from bot.services.supabase_client import supabase
+from bot.services import cache_versions
 from typing import Optional, Dict, Any
 import logging
 import json
@@ -177,6 +178,10 @@ def clear_cache():
     _cache_timestamp = None
 
 
+# Настройку изменили на другом воркере - сбрасываем кэш, не дожидаясь TTL
+cache_versions.on_change("settings", clear_cache)
+
+
 def _convert_value(value: str, setting_type: str) -> Any:
     """
     Преобразует строковое значение в нужный тип
@@ -1,9 +1,11 @@
 """
 Сервис для работы с Supabase Storage через нативный клиент Supabase (вместо S3)
 """
+import asyncio
 import logging
 import re
 import hashlib
+from contextlib import AsyncExitStack
 from datetime import datetime
 from urllib.parse import quote, urlparse
 from botocore.config import Config
@@ -15,10 +17,17 @@ import httpx
 import aioboto3
 from bot.config import settings
 from bot.services.supabase_client import supabase
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+# Ошибки S3, после которых пробуем следующий способ загрузки
+RETRYABLE_S3_ERRORS = {"XAmzContentSHA256Mismatch"}
+
+
+class _RetryableUploadError(Exception):
+    """Способ загрузки не сработал, можно попробовать следующий"""
+
 def _debug_log(payload: dict):
     return
 
@@ -87,6 +96,17 @@ class StorageService:
         
         if not self.bucket:
             logger.warning("SUPABASE_STORAGE_BUCKET not set, uploads may fail")
+
+        # Долгоживущие клиенты: открываются в start() или при первой загрузке
+        self._session = aioboto3.Session()
+        self._exit_stack: Optional[AsyncExitStack] = None
+        self._s3_clients: Dict[str, Any] = {}
+        self._http: Optional[httpx.AsyncClient] = None
+        self._client_lock = asyncio.Lock()
+        # Способ загрузки, сработавший последним (s3_signed, s3_unsigned, sigv4_http, supabase_http)
+        self._upload_strategy: Optional[str] = None
+        # None - еще не проверяли; True - отдавать прямые URL S3 вместо публичных
+        self._prefer_s3_url: Optional[bool] = None
     
     def _get_public_url(self, path: str) -> str:
         """Получить публичный URL для файла"""
@@ -115,7 +135,211 @@ class StorageService:
         
         return f"{folder}/{timestamp}_{unique_id}.{ext}"
 
-    async def upload_file(self, file_content: bytes, filename: str, folder: str = "images") -> Optional[str]:
+    @property
+    def s3_configured(self) -> bool:
+        return bool(self.s3_endpoint and self.s3_access_key and self.s3_secret_key)
+
+    async def start(self) -> None:
+        """Открывает долгоживущие клиенты (вызывается при старте приложения)"""
+        await self._get_http()
+        if self.s3_configured:
+            await self._get_s3_client(self._upload_strategy or "s3_signed")
+
+    async def close(self) -> None:
+        """Закрывает S3 и HTTP клиенты"""
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+        self._s3_clients.clear()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def _get_http(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(timeout=30.0)
+        return self._http
+
+    async def _get_s3_client(self, strategy: str):
+        """S3 клиент под стратегию (signed/unsigned), создается один раз на процесс"""
+        client = self._s3_clients.get(strategy)
+        if client is not None:
+            return client
+        async with self._client_lock:
+            client = self._s3_clients.get(strategy)
+            if client is None:
+                if self._exit_stack is None:
+                    self._exit_stack = AsyncExitStack()
+                s3_options = {"addressing_style": "path"}
+                if strategy == "s3_unsigned":
+                    s3_options["payload_signing_enabled"] = False
+                client = await self._exit_stack.enter_async_context(
+                    self._session.client(
+                        "s3",
+                        endpoint_url=self.s3_endpoint,
+                        region_name=self.s3_region,
+                        aws_access_key_id=self.s3_access_key,
+                        aws_secret_access_key=self.s3_secret_key,
+                        config=Config(signature_version="s3v4", s3=s3_options),
+                    )
+                )
+                self._s3_clients[strategy] = client
+        return client
+
+    def _strategy_chain(self) -> List[str]:
+        """
+        Способы загрузки по порядку. Следующий пробуется только после ошибки,
+        которую он может обойти (XAmzContentSHA256Mismatch у S3-совместимых хранилищ)
+        """
+        chain = []
+        if self.s3_configured:
+            chain.extend(["s3_signed", "s3_unsigned", "sigv4_http"])
+        if settings.S3_SUPABASE_FALLBACK_ENABLED:
+            chain.append("supabase_http")
+        return chain
+
+    async def _put_object(self, strategy: str, file_path: str, file_content: bytes, content_type: str) -> None:
+        if strategy in ("s3_signed", "s3_unsigned"):
+            s3 = await self._get_s3_client(strategy)
+            try:
+                await s3.put_object(
+                    Bucket=self.bucket,
+                    Key=file_path,
+                    Body=file_content,
+                    ContentType=content_type,
+                    ContentLength=len(file_content) if file_content else 0
+                )
+            except ClientError as err:
+                error_code = (err.response or {}).get("Error", {}).get("Code")
+                if error_code in RETRYABLE_S3_ERRORS:
+                    raise _RetryableUploadError(f"S3 {strategy} upload failed: {error_code}") from err
+                raise
+        elif strategy == "sigv4_http":
+            await self._put_via_sigv4_http(file_path, file_content, content_type)
+        else:
+            await self._put_via_supabase(file_path, file_content, content_type)
+
+    async def _put_via_sigv4_http(self, file_path: str, file_content: bytes, content_type: str) -> None:
+        """PUT с SigV4-подписью вручную (обход проблем botocore с checksum у S3-совместимых хранилищ)"""
+        endpoint = self.s3_endpoint.rstrip("/")
+        url = f"{endpoint}/{self.bucket}/{quote(file_path, safe='/')}"
+        payload_hash = hashlib.sha256(file_content or b"").hexdigest()
+        headers = {
+            "Host": urlparse(endpoint).netloc,
+            "Content-Type": content_type,
+            "Content-Length": str(len(file_content) if file_content else 0),
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        }
+        request = AWSRequest(method="PUT", url=url, data=file_content, headers=headers)
+        SigV4Auth(
+            Credentials(self.s3_access_key, self.s3_secret_key),
+            "s3",
+            self.s3_region
+        ).add_auth(request)
+        http = await self._get_http()
+        try:
+            response = await http.put(url, headers=dict(request.headers), content=file_content)
+        except httpx.RequestError as e:
+            raise _RetryableUploadError(f"S3 http upload failed: {e}") from e
+        if response.status_code >= 400:
+            match = re.search(r"<Code>([^<]+)</Code>", response.text or "")
+            detail = f"S3 http upload failed: {response.status_code}"
+            if match:
+                detail = f"{detail} {match.group(1)}"
+            raise _RetryableUploadError(detail)
+
+    async def _put_via_supabase(self, file_path: str, file_content: bytes, content_type: str) -> None:
+        """Загрузка через Storage API Supabase"""
+        if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
+            raise Exception("Supabase storage not configured")
+        storage_url = (
+            f"{settings.SUPABASE_URL.rstrip('/')}"
+            f"/storage/v1/object/{self.bucket}/{quote(file_path, safe='/')}"
+        )
+        headers = {
+            "Authorization": f"Bearer {settings.SUPABASE_KEY}",
+            "apikey": settings.SUPABASE_KEY,
+            "Content-Type": content_type,
+            "x-upsert": "true"
+        }
+        http = await self._get_http()
+        response = await http.post(storage_url, headers=headers, content=file_content)
+        if response.status_code >= 400:
+            error_str = response.text or ""
+            if "Bucket not found" in error_str or "The resource was not found" in error_str:
+                logger.error(f"Bucket '{self.bucket}' not found. Please run the SQL creation script.")
+            raise Exception(f"Supabase storage upload failed: {response.status_code}")
+
+    async def _upload(self, file_path: str, file_content: bytes, content_type: str) -> str:
+        """
+        Загружает файл, начиная со способа, который сработал в прошлый раз (один PUT).
+        Возвращает использованный способ
+        """
+        chain = self._strategy_chain()
+        if not chain:
+            raise Exception("Storage is not configured: no S3 credentials and Supabase fallback disabled")
+
+        cached = self._upload_strategy
+        if cached in chain:
+            try:
+                await self._put_object(cached, file_path, file_content, content_type)
+                return cached
+            except Exception as e:
+                logger.warning(f"Cached upload strategy {cached} failed, trying all strategies: {e}")
+                self._upload_strategy = None
+
+        last_error: Optional[Exception] = None
+        for strategy in chain:
+            if strategy == cached:
+                continue
+            try:
+                await self._put_object(strategy, file_path, file_content, content_type)
+            except _RetryableUploadError as e:
+                logger.warning(f"Upload strategy {strategy} failed: {e}")
+                last_error = e
+                continue
+            if strategy != chain[0]:
+                logger.info(f"Upload strategy {strategy} works, using it for next uploads")
+            self._upload_strategy = strategy
+            return strategy
+        raise last_error or Exception("Upload failed")
+
+    async def _probe_status(self, url: str) -> Optional[int]:
+        try:
+            http = await self._get_http()
+            response = await http.head(url, timeout=10.0, follow_redirects=True)
+            return response.status_code
+        except Exception:
+            return None
+
+    async def _resolve_return_url(self, public_url: str, file_path: str) -> str:
+        """
+        Публичный URL может не открываться (401/403/404), а прямой URL S3 - работать.
+        Проверяется HEAD-запросами один раз (STORAGE_PROBE_PUBLIC_URL), результат запоминается
+        """
+        if not self.s3_endpoint:
+            return public_url
+        s3_url = f"{self.s3_endpoint.rstrip('/')}/{self.bucket}/{quote(file_path, safe='/')}"
+        if self._prefer_s3_url is None and settings.STORAGE_PROBE_PUBLIC_URL:
+            public_status, s3_status = await asyncio.gather(
+                self._probe_status(public_url),
+                self._probe_status(s3_url),
+            )
+            if public_status in {401, 403, 404} and s3_status == 200:
+                self._prefer_s3_url = True
+                logger.warning(f"Public storage URL returned {public_status}, using S3 endpoint URLs")
+            elif public_status == 200:
+                self._prefer_s3_url = False
+        return s3_url if self._prefer_s3_url else public_url
+
+    async def upload_file(
+        self,
+        file_content: bytes,
+        filename: str,
+        folder: str = "images",
+        file_path: Optional[str] = None,
+    ) -> Optional[str]:
         """
         Загружает файл в Supabase Storage
         
@@ -123,480 +347,18 @@ class StorageService:
             file_content: Содержимое файла в байтах
             filename: Имя файла
             folder: Папка для сохранения (по умолчанию "images")
+            file_path: Точный путь в бакете (по умолчанию генерируется уникальный в folder)
             
         Returns:
             Публичный URL загруженного файла или None при ошибке
         """
         try:
-            file_path = self._generate_file_path(filename, folder)
-            public_url = self._get_public_url(file_path)
+            file_path = file_path or self._generate_file_path(filename, folder)
             content_type = self._get_content_type(filename)
-            # Предпочитаем S3 API (aioboto3), если настроены креды
-            async def _upload_via_supabase() -> None:
-                if not settings.SUPABASE_URL or not settings.SUPABASE_KEY:
-                    raise Exception("Supabase storage not configured")
-                storage_url = (
-                    f"{settings.SUPABASE_URL.rstrip('/')}"
-                    f"/storage/v1/object/{self.bucket}/{quote(file_path, safe='/')}"
-                )
-                headers = {
-                    "Authorization": f"Bearer {settings.SUPABASE_KEY}",
-                    "apikey": settings.SUPABASE_KEY,
-                    "Content-Type": content_type,
-                    "x-upsert": "true"
-                }
-                # region agent log
-                _debug_log({
-                    "hypothesisId": "H4",
-                    "location": "bot/services/storage.py:upload_file.supabase_http_attempt",
-                    "message": "supabase storage http upload attempt",
-                    "data": {
-                        "bucket": self.bucket,
-                        "key": file_path
-                    }
-                })
-                # endregion
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.post(
-                        storage_url,
-                        headers=headers,
-                        content=file_content
-                    )
-                # region agent log
-                _debug_log({
-                    "hypothesisId": "H4",
-                    "location": "bot/services/storage.py:upload_file.supabase_http_response",
-                    "message": "supabase storage http response",
-                    "data": {
-                        "status_code": response.status_code
-                    }
-                })
-                # endregion
-                if response.status_code >= 400:
-                    raise Exception(f"Supabase storage upload failed: {response.status_code}")
-
-            payload_sha256 = hashlib.sha256(file_content).hexdigest() if file_content else None
-            # region agent log
-            _debug_log({
-                "hypothesisId": "H5",
-                "location": "bot/services/storage.py:upload_file.payload_hash",
-                "message": "payload sha256",
-                "data": {
-                    "content_length": len(file_content) if file_content else 0,
-                    "payload_sha256": payload_sha256
-                }
-            })
-            # endregion
-
-            async def _upload_via_sigv4_http() -> None:
-                if not self.s3_endpoint or not self.s3_access_key or not self.s3_secret_key:
-                    raise Exception("S3 HTTP upload not configured")
-                endpoint = self.s3_endpoint.rstrip("/")
-                key_path = quote(file_path, safe="/")
-                url = f"{endpoint}/{self.bucket}/{key_path}"
-                host = urlparse(endpoint).netloc
-                payload_hash = payload_sha256 or hashlib.sha256(file_content).hexdigest()
-                amz_date = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-                headers = {
-                    "Host": host,
-                    "Content-Type": content_type,
-                    "Content-Length": str(len(file_content) if file_content else 0),
-                    "x-amz-content-sha256": payload_hash,
-                    "x-amz-date": amz_date
-                }
-                request = AWSRequest(method="PUT", url=url, data=file_content, headers=headers)
-                SigV4Auth(
-                    Credentials(self.s3_access_key, self.s3_secret_key),
-                    "s3",
-                    self.s3_region
-                ).add_auth(request)
-                signed_headers = dict(request.headers)
-                # region agent log
-                _debug_log({
-                    "hypothesisId": "H6",
-                    "location": "bot/services/storage.py:upload_file.sigv4_http_attempt",
-                    "message": "sigv4 http put attempt",
-                    "data": {
-                        "endpoint": endpoint,
-                        "region": self.s3_region,
-                        "bucket": self.bucket,
-                        "key": file_path,
-                        "content_length": len(file_content) if file_content else 0
-                    }
-                })
-                # endregion
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.put(
-                        url,
-                        headers=signed_headers,
-                        content=file_content
-                    )
-                error_code = None
-                if response.text:
-                    match = re.search(r"<Code>([^<]+)</Code>", response.text)
-                    if match:
-                        error_code = match.group(1)
-                # region agent log
-                _debug_log({
-                    "hypothesisId": "H6",
-                    "location": "bot/services/storage.py:upload_file.sigv4_http_response",
-                    "message": "sigv4 http response",
-                    "data": {
-                        "status_code": response.status_code,
-                        "error_code": error_code
-                    }
-                })
-                # endregion
-                if response.status_code >= 400:
-                    detail = f"S3 http upload failed: {response.status_code}"
-                    if error_code:
-                        detail = f"{detail} {error_code}"
-                    raise Exception(detail)
-
-            async def _probe_public_url(label: str, url: str) -> dict:
-                try:
-                    async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-                        response = await client.head(url)
-                    status_code = response.status_code
-                    content_type = response.headers.get("content-type")
-                    error_type = None
-                except Exception as probe_error:
-                    status_code = None
-                    content_type = None
-                    error_type = type(probe_error).__name__
-                # region agent log
-                _debug_log({
-                    "hypothesisId": "H7",
-                    "location": "bot/services/storage.py:upload_file.public_url_probe",
-                    "message": "public url head probe",
-                    "data": {
-                        "label": label,
-                        "url": url,
-                        "status_code": status_code,
-                        "content_type": content_type,
-                        "error_type": error_type
-                    }
-                })
-                # endregion
-                return {
-                    "status_code": status_code,
-                    "content_type": content_type,
-                    "error_type": error_type
-                }
-
-            if self.s3_endpoint and self.s3_access_key and self.s3_secret_key:
-                session = aioboto3.Session()
-                attempts = [
-                    {
-                        "label": "signed",
-                        "payload_signing_enabled": True,
-                        "config": Config(
-                            signature_version="s3v4",
-                            s3={"addressing_style": "path"}
-                        )
-                    },
-                    {
-                        "label": "unsigned",
-                        "payload_signing_enabled": False,
-                        "config": Config(
-                            signature_version="s3v4",
-                            s3={"addressing_style": "path", "payload_signing_enabled": False}
-                        )
-                    }
-                ]
-                uploaded = False
-                last_error = None
-                last_error_code = None
-                for attempt in attempts:
-                    # region agent log
-                    _debug_log({
-                        "hypothesisId": "H3",
-                        "location": "bot/services/storage.py:upload_file.s3_attempt",
-                        "message": "s3 put_object attempt",
-                        "data": {
-                            "endpoint": self.s3_endpoint,
-                            "region": self.s3_region,
-                            "bucket": self.bucket,
-                            "content_length": len(file_content) if file_content else 0,
-                            "content_type": content_type,
-                            "attempt": attempt["label"],
-                            "payload_signing_enabled": attempt["payload_signing_enabled"]
-                        }
-                    })
-                    # endregion
-                    print(
-                        "[s3_upload] "
-                        f"attempt={attempt['label']} "
-                        f"payload_signing={attempt['payload_signing_enabled']} "
-                        f"endpoint={self.s3_endpoint} region={self.s3_region} "
-                        f"bucket={self.bucket} bytes={len(file_content) if file_content else 0} "
-                        f"type={content_type}"
-                    )
-                    try:
-                        async with session.client(
-                            "s3",
-                            endpoint_url=self.s3_endpoint,
-                            region_name=self.s3_region,
-                            aws_access_key_id=self.s3_access_key,
-                            aws_secret_access_key=self.s3_secret_key,
-                            config=attempt["config"]
-                        ) as s3:
-                            def _log_s3_headers(event_name: str):
-                                def _handler(request, **kwargs):
-                                    try:
-                                        headers = request.headers or {}
-                                        # region agent log
-                                        _debug_log({
-                                            "hypothesisId": "H5",
-                                            "location": "bot/services/storage.py:upload_file.s3_headers",
-                                            "message": "s3 request headers",
-                                            "data": {
-                                                "attempt": attempt["label"],
-                                                "event": event_name,
-                                                "x_amz_content_sha256": headers.get("x-amz-content-sha256") or headers.get("X-Amz-Content-SHA256"),
-                                                "x_amz_decoded_content_length": headers.get("x-amz-decoded-content-length") or headers.get("X-Amz-Decoded-Content-Length"),
-                                                "content_length": headers.get("content-length") or headers.get("Content-Length"),
-                                                "transfer_encoding": headers.get("transfer-encoding") or headers.get("Transfer-Encoding"),
-                                                "content_encoding": headers.get("content-encoding") or headers.get("Content-Encoding"),
-                                                "content_md5": headers.get("content-md5") or headers.get("Content-MD5"),
-                                                "expect": headers.get("expect") or headers.get("Expect")
-                                            }
-                                        })
-                                        # endregion
-                                    except Exception:
-                                        pass
-                                return _handler
-
-                            s3.meta.events.register(
-                                "request-created.s3.PutObject",
-                                _log_s3_headers("request-created")
-                            )
-                            s3.meta.events.register(
-                                "before-sign.s3.PutObject",
-                                _log_s3_headers("before-sign")
-                            )
-                            s3.meta.events.register(
-                                "before-send.s3.PutObject",
-                                _log_s3_headers("before-send")
-                            )
-
-                            def _log_s3_headers_compat(request, **kwargs):
-                                try:
-                                    headers = request.headers or {}
-                                    # region agent log
-                                    _debug_log({
-                                        "hypothesisId": "H5",
-                                        "location": "bot/services/storage.py:upload_file.s3_headers",
-                                        "message": "s3 request headers",
-                                        "data": {
-                                            "attempt": attempt["label"],
-                                            "event": "compat-before-send",
-                                            "x_amz_content_sha256": headers.get("x-amz-content-sha256") or headers.get("X-Amz-Content-SHA256"),
-                                            "x_amz_decoded_content_length": headers.get("x-amz-decoded-content-length") or headers.get("X-Amz-Decoded-Content-Length"),
-                                            "content_length": headers.get("content-length") or headers.get("Content-Length"),
-                                            "transfer_encoding": headers.get("transfer-encoding") or headers.get("Transfer-Encoding"),
-                                            "content_encoding": headers.get("content-encoding") or headers.get("Content-Encoding"),
-                                            "content_md5": headers.get("content-md5") or headers.get("Content-MD5"),
-                                            "expect": headers.get("expect") or headers.get("Expect")
-                                        }
-                                    })
-                                    # endregion
-                                except Exception:
-                                    pass
-                            s3.meta.events.register("before-send.s3.PutObject", _log_s3_headers_compat)
-                            await s3.put_object(
-                                Bucket=self.bucket,
-                                Key=file_path,
-                                Body=file_content,
-                                ContentType=content_type,
-                                ContentLength=len(file_content) if file_content else 0
-                            )
-                        # region agent log
-                        _debug_log({
-                            "hypothesisId": "H3",
-                            "location": "bot/services/storage.py:upload_file.s3_success",
-                            "message": "s3 put_object ok",
-                            "data": {
-                                "bucket": self.bucket,
-                                "key": file_path,
-                                "public_url": public_url,
-                                "attempt": attempt["label"]
-                            }
-                        })
-                        # endregion
-                        print(f"[s3_upload] ok attempt={attempt['label']} bucket={self.bucket} key={file_path}")
-                        uploaded = True
-                        break
-                    except ClientError as err:
-                        last_error = err
-                        error_code = None
-                        if err.response:
-                            error_code = err.response.get("Error", {}).get("Code")
-                        last_error_code = error_code
-                        # region agent log
-                        _debug_log({
-                            "hypothesisId": "H3",
-                            "location": "bot/services/storage.py:upload_file.s3_error",
-                            "message": "s3 put_object error",
-                            "data": {
-                                "attempt": attempt["label"],
-                                "payload_signing_enabled": attempt["payload_signing_enabled"],
-                                "error_code": error_code,
-                                "error_type": type(err).__name__
-                            }
-                        })
-                        # endregion
-                        print(
-                            "[s3_upload] "
-                            f"error attempt={attempt['label']} "
-                            f"code={error_code} type={type(err).__name__} "
-                            f"message={str(err)}"
-                        )
-                        if error_code != "XAmzContentSHA256Mismatch":
-                            raise
-                if not uploaded and last_error and last_error_code == "XAmzContentSHA256Mismatch":
-                    try:
-                        await _upload_via_sigv4_http()
-                        # region agent log
-                        _debug_log({
-                            "hypothesisId": "H6",
-                            "location": "bot/services/storage.py:upload_file.sigv4_http_success",
-                            "message": "sigv4 http upload ok",
-                            "data": {
-                                "bucket": self.bucket,
-                                "key": file_path,
-                                "public_url": public_url
-                            }
-                        })
-                        # endregion
-                        uploaded = True
-                    except Exception as http_error:
-                        # region agent log
-                        _debug_log({
-                            "hypothesisId": "H6",
-                            "location": "bot/services/storage.py:upload_file.sigv4_http_error",
-                            "message": "sigv4 http upload error",
-                            "data": {
-                                "error_type": type(http_error).__name__
-                            }
-                        })
-                        # endregion
-                if not uploaded and last_error:
-                    if last_error_code == "XAmzContentSHA256Mismatch" and not settings.S3_SUPABASE_FALLBACK_ENABLED:
-                        # region agent log
-                        _debug_log({
-                            "hypothesisId": "H5",
-                            "location": "bot/services/storage.py:upload_file.supabase_fallback_disabled",
-                            "message": "supabase fallback disabled",
-                            "data": {
-                                "bucket": self.bucket,
-                                "key": file_path
-                            }
-                        })
-                        # endregion
-                    if last_error_code == "XAmzContentSHA256Mismatch" and settings.S3_SUPABASE_FALLBACK_ENABLED:
-                        # region agent log
-                        _debug_log({
-                            "hypothesisId": "H3",
-                            "location": "bot/services/storage.py:upload_file.supabase_fallback",
-                            "message": "s3 checksum mismatch, fallback to supabase",
-                            "data": {
-                                "bucket": self.bucket,
-                                "key": file_path
-                            }
-                        })
-                        # endregion
-                        try:
-                            await _upload_via_supabase()
-                            # region agent log
-                            _debug_log({
-                                "hypothesisId": "H3",
-                                "location": "bot/services/storage.py:upload_file.supabase_fallback_ok",
-                                "message": "supabase fallback ok",
-                                "data": {
-                                    "bucket": self.bucket,
-                                    "key": file_path,
-                                    "public_url": public_url
-                                }
-                            })
-                            # endregion
-                            uploaded = True
-                        except Exception as upload_error:
-                            # region agent log
-                            _debug_log({
-                                "hypothesisId": "H3",
-                                "location": "bot/services/storage.py:upload_file.supabase_fallback_error",
-                                "message": "supabase fallback error",
-                                "data": {
-                                    "error_type": type(upload_error).__name__
-                                }
-                            })
-                            # endregion
-                            raise last_error
-                if not uploaded and last_error:
-                    raise last_error
-            else:
-                # Фоллбек на нативный клиент Supabase (если есть storage)
-                try:
-                    if not settings.S3_SUPABASE_FALLBACK_ENABLED:
-                        raise Exception("Supabase storage fallback disabled")
-                    await _upload_via_supabase()
-                except Exception as upload_error:
-                    # region agent log
-                    _debug_log({
-                        "hypothesisId": "H3",
-                        "location": "bot/services/storage.py:upload_file.supabase_error",
-                        "message": "supabase upload error",
-                        "data": {
-                            "error_type": type(upload_error).__name__
-                        }
-                    })
-                    # endregion
-                    error_str = str(upload_error)
-                    if "Bucket not found" in error_str or "The resource was not found" in error_str:
-                        logger.error(f"Bucket '{self.bucket}' not found. Please run the SQL creation script.")
-                    raise upload_error
-
-            logger.info(f"File uploaded successfully: {file_path}")
-            return_url = public_url
-            if uploaded:
-                try:
-                    public_probe = await _probe_public_url("public_url", public_url)
-                    if self.s3_endpoint:
-                        endpoint = self.s3_endpoint.rstrip("/")
-                        key_path = quote(file_path, safe="/")
-                        s3_url = f"{endpoint}/{self.bucket}/{key_path}"
-                        s3_probe = await _probe_public_url("s3_endpoint", s3_url)
-                        if public_probe.get("status_code") in {401, 403, 404} and s3_probe.get("status_code") == 200:
-                            return_url = s3_url
-                            # region agent log
-                            _debug_log({
-                                "hypothesisId": "H7",
-                                "location": "bot/services/storage.py:upload_file.public_url_fallback",
-                                "message": "fallback to s3 endpoint url",
-                                "data": {
-                                    "public_status": public_probe.get("status_code"),
-                                    "s3_status": s3_probe.get("status_code"),
-                                    "return_url": return_url
-                                }
-                            })
-                            # endregion
-                except Exception:
-                    pass
-            return return_url
-                
+            strategy = await self._upload(file_path, file_content, content_type)
+            logger.info(f"File uploaded successfully: {file_path} ({strategy})")
+            return await self._resolve_return_url(self._get_public_url(file_path), file_path)
         except Exception as e:
-            # region agent log
-            _debug_log({
-                "hypothesisId": "H3",
-                "location": "bot/services/storage.py:upload_file.error",
-                "message": "upload error",
-                "data": {
-                    "error_type": type(e).__name__
-                }
-            })
-            # endregion
-            print(f"[s3_upload] error type={type(e).__name__} message={str(e)}")
             logger.error(f"Error uploading file to Supabase Storage: {e}", exc_info=True)
             return None
     
@@ -622,16 +384,10 @@ class StorageService:
     async def delete_file(self, file_path: str) -> bool:
         """Удаляет файл из Supabase Storage"""
         try:
-            if self.s3_endpoint and self.s3_access_key and self.s3_secret_key:
-                session = aioboto3.Session()
-                async with session.client(
-                    "s3",
-                    endpoint_url=self.s3_endpoint,
-                    region_name=self.s3_region,
-                    aws_access_key_id=self.s3_access_key,
-                    aws_secret_access_key=self.s3_secret_key
-                ) as s3:
-                    await s3.delete_object(Bucket=self.bucket, Key=file_path)
+            if self.s3_configured:
+                strategy = self._upload_strategy if self._upload_strategy == "s3_unsigned" else "s3_signed"
+                s3 = await self._get_s3_client(strategy)
+                await s3.delete_object(Bucket=self.bucket, Key=file_path)
             else:
                 supabase.storage.from_(self.bucket).remove([file_path])
             return True
@@ -5,8 +5,12 @@
 """
 import httpx
 from bot.config import settings
+from bot.services import fast_json
+from bot.services.metrics import metrics, normalize_path
+from bot.services.tracing import record_span
 from typing import Dict, Any, Optional, List
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -41,50 +45,88 @@ class SupabaseClient:
         """Закрыть HTTP клиент"""
         await self.client.aclose()
     
+    @staticmethod
+    def _record_call(method: str, endpoint: str, started: float, response: Optional[httpx.Response]) -> None:
+        """Метрики и span вызова: задержка, статус, размер запроса и ответа"""
+        status = str(response.status_code) if response is not None else "error"
+        duration = time.perf_counter() - started
+        metrics.record_upstream(
+            "supabase",
+            method,
+            endpoint,
+            status,
+            duration,
+            request_bytes=len(response.request.content) if response is not None else 0,
+            response_bytes=len(response.content) if response is not None else 0,
+        )
+        record_span(
+            f"supabase {method} {endpoint}",
+            duration,
+            error=response is None or response.status_code >= 400,
+            status=status,
+        )
+
     async def _request(self, method: str, table: str, **kwargs) -> Any:
         """Базовый метод для HTTP запросов с обработкой ошибок"""
         url = self._build_url(table)
+        response = None
+        started = time.perf_counter()
         try:
             response = await self.client.request(method, url, headers=self.headers, **kwargs)
             response.raise_for_status()
-            return response.json() if response.content else None
+            return fast_json.loads(response.content) if response.content else None
         except httpx.HTTPStatusError as e:
             logger.error(f"Supabase HTTP error: {e.response.status_code} - {e.response.text}")
             raise
         except httpx.RequestError as e:
             logger.error(f"Supabase request error: {e}")
             raise
+        finally:
+            self._record_call(method, normalize_path(table), started, response)
     
     async def rpc(self, function_name: str, params: Optional[Dict] = None) -> Any:
         """Выполнить RPC запрос (хранимую процедуру)"""
         url = self._build_url("rpc", function_name)
+        response = None
+        started = time.perf_counter()
         try:
-            response = await self.client.post(url, headers=self.headers, json=params or {})
+            response = await self.client.post(url, headers=self.headers, content=fast_json.dumps(params or {}))
             response.raise_for_status()
-            return response.json() if response.content else None
+            return fast_json.loads(response.content) if response.content else None
         except httpx.HTTPStatusError as e:
             logger.error(f"Supabase RPC error: {e.response.status_code} - {e.response.text}")
             raise
         except httpx.RequestError as e:
             logger.error(f"Supabase RPC request error: {e}")
             raise
+        finally:
+            self._record_call("POST", f"rpc/{function_name}", started, response)
+
+    @staticmethod
+    def _build_filter_params(filters: Dict[str, Any]) -> Dict[str, str]:
+        """Преобразует фильтры в query-параметры PostgREST"""
+        params = {}
+        for key, value in filters.items():
+            if isinstance(value, tuple):
+                op, val = value
+                if op == "in" and isinstance(val, (list, tuple)):
+                    # Формат для IN: column=in.(value1,value2,value3)
+                    params[f"{key}"] = f"in.({','.join(str(v) for v in val)})"
+                else:
+                    # Поддержка операторов: ("eq", value), ("lt", value), ("lte", value), ("gt", value), ("gte", value)
+                    params[f"{key}"] = f"{op}.{val}"
+            else:
+                # Обратная совместимость: просто значение = равенство
+                params[f"{key}"] = f"eq.{value}"
+        return params
 
-    async def select(self, table: str, filters: Optional[Dict] = None, limit: Optional[int] = None, order_by: Optional[str] = None, desc: bool = False) -> List[Dict]:
+    async def select(self, table: str, filters: Optional[Dict] = None, limit: Optional[int] = None, order_by: Optional[str] = None, desc: bool = False, columns: Optional[str] = None) -> List[Dict]:
         """SELECT запрос"""
         params = {}
+        if columns and columns != "*":
+            params["select"] = columns
         if filters:
-            for key, value in filters.items():
-                if isinstance(value, tuple):
-                    op, val = value
-                    if op == "in" and isinstance(val, (list, tuple)):
-                        # Формат для IN: column=in.(value1,value2,value3)
-                        params[f"{key}"] = f"in.({','.join(str(v) for v in val)})"
-                    else:
-                        # Поддержка операторов: ("eq", value), ("lt", value), ("lte", value), ("gt", value), ("gte", value)
-                        params[f"{key}"] = f"{op}.{val}"
-                else:
-                    # Обратная совместимость: просто значение = равенство
-                    params[f"{key}"] = f"eq.{value}"
+            params.update(self._build_filter_params(filters))
         if limit:
             params["limit"] = str(limit)
         if order_by:
@@ -93,22 +135,13 @@ class SupabaseClient:
         result = await self._request("GET", table, params=params)
         return result if result else []
     
-    async def select_multi_order(self, table: str, filters: Optional[Dict] = None, limit: Optional[int] = None, order_by_list: List[tuple] = None) -> List[Dict]:
+    async def select_multi_order(self, table: str, filters: Optional[Dict] = None, limit: Optional[int] = None, order_by_list: List[tuple] = None, columns: Optional[str] = None) -> List[Dict]:
         """SELECT запрос с множественной сортировкой"""
         params = {}
+        if columns and columns != "*":
+            params["select"] = columns
         if filters:
-            for key, value in filters.items():
-                if isinstance(value, tuple):
-                    op, val = value
-                    if op == "in" and isinstance(val, (list, tuple)):
-                        # Формат для IN: column=in.(value1,value2,value3)
-                        params[f"{key}"] = f"in.({','.join(str(v) for v in val)})"
-                    else:
-                        # Поддержка операторов: ("eq", value), ("lt", value), ("lte", value), ("gt", value), ("gte", value)
-                        params[f"{key}"] = f"{op}.{val}"
-                else:
-                    # Обратная совместимость: просто значение = равенство
-                    params[f"{key}"] = f"eq.{value}"
+            params.update(self._build_filter_params(filters))
         if limit:
             params["limit"] = str(limit)
         if order_by_list:
@@ -121,35 +154,29 @@ class SupabaseClient:
     
     async def insert(self, table: str, data: Dict[str, Any]) -> List[Dict]:
         """INSERT запрос"""
-        result = await self._request("POST", table, json=data)
+        result = await self._request("POST", table, content=fast_json.dumps(data))
         return result if result else []
     
     async def update(self, table: str, filters: Dict[str, Any], data: Dict[str, Any]) -> List[Dict]:
         """UPDATE запрос"""
-        params = {}
-        for key, value in filters.items():
-            if isinstance(value, tuple):
-                # Поддержка операторов: ("eq", value), ("lt", value), ("gt", value)
-                op, val = value
-                params[f"{key}"] = f"{op}.{val}"
-            else:
-                # Обратная совместимость: просто значение = равенство
-                params[f"{key}"] = f"eq.{value}"
+        params = self._build_filter_params(filters)
         
-        result = await self._request("PATCH", table, params=params, json=data)
+        result = await self._request("PATCH", table, params=params, content=fast_json.dumps(data))
         return result if result else []
     
+    async def bulk_update(self, table: str, rows: List[Dict[str, Any]]) -> int:
+        """
+        Пакетный UPDATE одним запросом (RPC bulk_patch, миграция 023).
+        rows - [{"id": ..., "<колонка>": ...}] с одинаковым набором колонок; возвращает число обновленных строк
+        """
+        if not rows:
+            return 0
+        result = await self.rpc("bulk_patch", {"p_table": table, "p_rows": rows})
+        return int((result or {}).get("updated") or 0)
+    
     async def delete(self, table: str, filters: Dict[str, Any]) -> None:
         """DELETE запрос"""
-        params = {}
-        for key, value in filters.items():
-            if isinstance(value, tuple):
-                # Поддержка операторов: ("eq", value), ("lt", value), ("gt", value)
-                op, val = value
-                params[f"{key}"] = f"{op}.{val}"
-            else:
-                # Обратная совместимость: просто значение = равенство
-                params[f"{key}"] = f"eq.{value}"
+        params = self._build_filter_params(filters)
         
         await self._request("DELETE", table, params=params)
 
@@ -168,6 +195,7 @@ class TableProxy:
         self.client = client
         self.table = table
         self._filters = {}
+        self._columns = None  # None = все поля
         self._order_by = []  # Список кортежей (column, desc)
         self._limit = None
         self._single = False
@@ -178,7 +206,9 @@ class TableProxy:
         self._update_data = None
     
     def select(self, *args):
-        """Игнорируем аргументы select, возвращаем все поля"""
+        """Выбрать поля: select("id,name") или select("id", "name"); select("*") - все поля"""
+        columns = ",".join(str(arg).replace(" ", "") for arg in args if arg)
+        self._columns = columns if columns and columns != "*" else None
         return self
     
     def eq(self, column: str, value: Any):
@@ -267,7 +297,8 @@ class TableProxy:
                 self.table, 
                 filters=self._filters, 
                 limit=self._limit,
-                order_by_list=self._order_by
+                order_by_list=self._order_by,
+                columns=self._columns
             )
         else:
             order_by = self._order_by[0][0] if self._order_by else None
@@ -277,7 +308,8 @@ class TableProxy:
                 filters=self._filters, 
                 limit=self._limit,
                 order_by=order_by,
-                desc=desc
+                desc=desc,
+                columns=self._columns
             )
         
         if self._single:
@@ -334,6 +366,9 @@ class SupabaseWrapper:
     
     def rpc(self, name: str, params: Optional[Dict] = None):
         return RPCProxy(self.client, name, params)
+    
+    async def bulk_update(self, table: str, rows: List[Dict[str, Any]]) -> int:
+        return await self.client.bulk_update(table, rows)
 
 # Глобальный объект для обратной совместимости (async версия)
 supabase = SupabaseWrapper(get_supabase())
@@ -0,0 +1,261 @@
+"""
+Легковесная трассировка запросов: один trace на входящий HTTP-запрос или Telegram update,
+вложенные spans для обработчиков, dp.feed_update и вызовов YClients/Supabase/Telegram.
+
+Трассы дольше TRACE_SLOW_MS попадают в кольцевой буфер (GET /api/admin/traces).
+При заданном TRACING_OTLP_ENDPOINT завершенные трассы дополнительно уходят
+в OpenTelemetry collector (нужны пакеты opentelemetry-sdk и opentelemetry-exporter-otlp-proto-http).
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+import logging
+import secrets
+import threading
+import time
+
+from bot.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на число spans в одной трассе (защита от циклов по тысячам пользователей)
+MAX_SPANS_PER_TRACE = 500
+
+
+class Span:
+    """Один участок трассы"""
+
+    __slots__ = ("span_id", "parent_id", "name", "start_ns", "duration_ms", "attributes", "status", "_started")
+
+    def __init__(self, name: str, parent_id: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.duration_ms: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self._started = time.perf_counter()
+
+    def finish(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+
+    def to_dict(self, trace_start_ns: int) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "offset_ms": round((self.start_ns - trace_start_ns) / 1_000_000, 2),
+            "duration_ms": round(self.duration_ms or 0.0, 2),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Trace:
+    """Трасса: корневой span и все вложенные"""
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, attributes=attributes)
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self.finished = False
+
+    def add(self, span: Span) -> None:
+        if len(self.spans) >= MAX_SPANS_PER_TRACE:
+            self.dropped_spans += 1
+            return
+        self.spans.append(span)
+
+    def breakdown(self) -> Dict[str, Dict[str, Any]]:
+        """Суммарное время и количество по именам spans (без корня)"""
+        result: Dict[str, Dict[str, Any]] = {}
+        for span in self.spans:
+            entry = result.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["total_ms"] += span.duration_ms or 0.0
+        for entry in result.values():
+            entry["total_ms"] = round(entry["total_ms"], 2)
+        return dict(sorted(result.items(), key=lambda item: item[1]["total_ms"], reverse=True))
+
+    def to_dict(self, include_spans: bool = True) -> Dict[str, Any]:
+        data = {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "started_at": self.root.start_ns // 1_000_000,
+            "duration_ms": round(self.root.duration_ms or 0.0, 2),
+            "status": self.root.status,
+            "attributes": self.root.attributes,
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped_spans,
+            "breakdown": self.breakdown(),
+        }
+        if include_spans:
+            start_ns = self.root.start_ns
+            data["spans"] = [span.to_dict(start_ns) for span in sorted(self.spans, key=lambda s: s.start_ns)]
+        return data
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+_slow_traces: Deque[Trace] = deque(maxlen=max(settings.TRACE_BUFFER_SIZE, 1))
+_slow_traces_lock = threading.Lock()
+
+
+def current_trace_id() -> Optional[str]:
+    """ID активной трассы (для логов и заголовка X-Trace-Id)"""
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def trace_active() -> bool:
+    """Есть открытая трасса, в которую еще пишутся span'ы"""
+    trace = _current_trace.get()
+    return trace is not None and not trace.finished
+
+
+def start_trace(name: str, **attributes: Any):
+    """Открывает трассу в текущем контексте, возвращает токен для finish_trace"""
+    trace = Trace(name, attributes)
+    return _current_trace.set(trace), _current_span.set(trace.root)
+
+
+def finish_trace(token, name: Optional[str] = None, error: bool = False, **attributes: Any) -> Optional[Trace]:
+    """Закрывает трассу; медленные попадают в буфер, все - в OTLP exporter (если включен)"""
+    trace_token, span_token = token
+    trace = _current_trace.get()
+    _current_span.reset(span_token)
+    _current_trace.reset(trace_token)
+    if trace is None:
+        return None
+    trace.root.finish()
+    trace.finished = True
+    if name:
+        trace.root.name = name
+    if error:
+        trace.root.status = "error"
+    trace.root.attributes.update(attributes)
+    if (trace.root.duration_ms or 0.0) >= settings.TRACE_SLOW_MS:
+        with _slow_traces_lock:
+            _slow_traces.append(trace)
+    if settings.TRACING_OTLP_ENDPOINT:
+        _export_otlp(trace)
+    return trace
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Вложенный span; без активной трассы ничего не записывает"""
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else trace.root.span_id, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "error"
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.finish()
+        _current_span.reset(token)
+        trace.add(current)
+
+
+def record_span(name: str, duration: float, error: bool = False, **attributes: Any) -> None:
+    """Записывает уже завершившийся участок (duration в секундах) как дочерний span текущего"""
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else trace.root.span_id, attributes)
+    current.start_ns -= int(duration * 1_000_000_000)
+    current.duration_ms = duration * 1000
+    if error:
+        current.status = "error"
+    trace.add(current)
+
+
+def recent_slow_traces(limit: int = 50, name: Optional[str] = None, min_ms: float = 0.0) -> List[Trace]:
+    """Последние медленные трассы, новые первыми; name - подстрока имени корневого span"""
+    with _slow_traces_lock:
+        traces = list(_slow_traces)
+    result = []
+    for trace in reversed(traces):
+        if name and name not in trace.root.name:
+            continue
+        if (trace.root.duration_ms or 0.0) < min_ms:
+            continue
+        result.append(trace)
+        if len(result) >= limit:
+            break
+    return result
+
+
+def get_slow_trace(trace_id: str) -> Optional[Trace]:
+    with _slow_traces_lock:
+        for trace in _slow_traces:
+            if trace.trace_id == trace_id:
+                return trace
+    return None
+
+
+# --- OpenTelemetry (опционально) ---
+
+_otel_tracer = None
+_otel_disabled = False
+
+
+def _get_otel_tracer():
+    global _otel_tracer, _otel_disabled
+    if _otel_tracer is not None or _otel_disabled:
+        return _otel_tracer
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("TRACING_OTLP_ENDPOINT is set but opentelemetry-sdk is not installed, OTLP export disabled")
+        _otel_disabled = True
+        return None
+    endpoint = settings.TRACING_OTLP_ENDPOINT.rstrip("/")
+    if not endpoint.endswith("/v1/traces"):
+        endpoint = f"{endpoint}/v1/traces"
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    _otel_tracer = provider.get_tracer("cveti.tracing")
+    logger.info(f"OTLP trace export enabled: {endpoint}")
+    return _otel_tracer
+
+
+def _export_otlp(trace: Trace) -> None:
+    """Переносит завершенную трассу в OpenTelemetry с исходными временами spans"""
+    tracer = _get_otel_tracer()
+    if tracer is None:
+        return
+    try:
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.trace import Status, StatusCode
+
+        otel_spans: Dict[str, Any] = {}
+        ordered = [trace.root] + sorted(trace.spans, key=lambda s: s.start_ns)
+        for item in ordered:
+            parent = otel_spans.get(item.parent_id) if item.parent_id else None
+            context = otel_trace.set_span_in_context(parent) if parent is not None else None
+            attributes = {key: value for key, value in item.attributes.items() if isinstance(value, (str, bool, int, float))}
+            attributes["cveti.trace_id"] = trace.trace_id
+            otel_span = tracer.start_span(item.name, context=context, start_time=item.start_ns, attributes=attributes)
+            if item.status == "error":
+                otel_span.set_status(Status(StatusCode.ERROR))
+            otel_spans[item.span_id] = otel_span
+        for item in ordered:
+            otel_spans[item.span_id].end(end_time=item.start_ns + int((item.duration_ms or 0.0) * 1_000_000))
+    except Exception as e:
+        logger.error(f"OTLP trace export failed: {e}")
@@ -0,0 +1,275 @@
+"""
+Очередь обновлений Telegram для webhook.
+
+Вебхук только проверяет и ставит обновление в очередь и сразу отвечает Telegram,
+а обработку (dp.feed_update) выполняет ограниченный пул воркеров.
+Обновления распределяются по шардам по chat_id: у каждого шарда свой воркер,
+поэтому обновления одного чата обрабатываются строго по порядку, а медленный
+обработчик (например, профиль с синхронизацией YClients) задерживает только свой шард.
+
+Если очередь шарда заполнена, enqueue возвращает False - вебхук отвечает 503,
+и Telegram повторит доставку позже. Колбэк on_done вызывается после обработки
+обновления (bot.worker так отмечает задачу job_queue выполненной).
+
+Ответ в теле вебхука: если шард чата свободен, обновление обрабатывается сразу
+(process_inline), и когда обработчик возвращает метод API (return message.answer(...))
+быстрее TELEGRAM_WEBHOOK_REPLY_TIMEOUT_MS, метод отдается Telegram в ответе на вебхук
+вместо отдельного исходящего запроса. Обработчики, отправляющие несколько сообщений
+(await message.answer(...)), и медленные обработчики работают как обычно.
+"""
+from typing import Any, Awaitable, Callable, Coroutine, Dict, List, Optional, Set, Tuple
+import asyncio
+import contextvars
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+from bot.config import settings
+from bot.services.metrics import metrics
+from bot.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Колбэк после обработки обновления из очереди
+DoneCallback = Callable[[], Awaitable[None]]
+# Элемент очереди: (обновление, тип, время постановки по monotonic, колбэк)
+_QueueItem = Tuple[Update, Optional[str], float, Optional[DoneCallback]]
+
+
+class UpdateQueue:
+    """Шардированная по chat_id очередь обновлений с воркером на шард"""
+
+    def __init__(self, workers: int, shard_size: int):
+        self.workers = max(1, workers)
+        self.shard_size = max(1, shard_size)
+        self._queues: List[asyncio.Queue] = []
+        # Шард занят, пока воркер или process_inline обрабатывает его обновление
+        self._locks: List[asyncio.Lock] = []
+        self._tasks: List[asyncio.Task] = []
+        # Обработчики process_inline и отправки send_in_background, которых ждет stop()
+        self._background: Set[asyncio.Task] = set()
+        self._dispatcher: Optional[Dispatcher] = None
+        self._bot: Optional[Bot] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def depth(self) -> int:
+        """Сколько обновлений ждет обработки во всех шардах"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def oldest_lag(self) -> float:
+        """Сколько секунд ждет самое старое обновление в очереди"""
+        now = time.monotonic()
+        oldest = 0.0
+        for queue in self._queues:
+            # asyncio.Queue хранит элементы в deque _queue; чтение без извлечения
+            pending = getattr(queue, "_queue", None)
+            if pending:
+                oldest = max(oldest, now - pending[0][2])
+        return oldest
+
+    def start(self, dispatcher: Dispatcher, bot: Bot) -> None:
+        if self.running:
+            return
+        self._dispatcher = dispatcher
+        self._bot = bot
+        self._queues = [asyncio.Queue(maxsize=self.shard_size) for _ in range(self.workers)]
+        self._locks = [asyncio.Lock() for _ in range(self.workers)]
+        self._tasks = [
+            asyncio.create_task(self._worker(index), name=f"telegram-updates-{index}")
+            for index in range(self.workers)
+        ]
+        logger.info(f"Telegram update queue started: {self.workers} workers, {self.shard_size} updates per shard")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Дожидается обработки уже принятых обновлений и обработчиков process_inline
+        (не дольше timeout) и останавливает воркеров
+        """
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues), *self._background),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Telegram update queue stopped with {self.depth()} unprocessed updates "
+                f"and {len(self._background)} unfinished inline handlers"
+            )
+        for task in [*self._tasks, *self._background]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._background, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
+        self._locks = []
+
+    def _spawn(self, coro: Coroutine[Any, Any, None], **options: Any) -> asyncio.Task:
+        task = asyncio.create_task(coro, **options)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def send_in_background(self, method: TelegramMethod) -> None:
+        """Выполняет метод API отдельным запросом, не задерживая ответ вебхуку"""
+        self._spawn(self._dispatcher.silent_call_request(bot=self._bot, result=method))
+
+    def _shard(self, chat_id: Optional[int], update_id: Optional[int]) -> int:
+        key = chat_id if chat_id is not None else (update_id or 0)
+        return key % self.workers
+
+    def enqueue(
+        self,
+        update: Update,
+        chat_id: Optional[int],
+        update_type: Optional[str],
+        on_done: Optional[DoneCallback] = None,
+    ) -> bool:
+        """Ставит обновление в очередь шарда; False - очередь заполнена (on_done не вызывается)"""
+        queue = self._queues[self._shard(chat_id, update.update_id)]
+        try:
+            queue.put_nowait((update, update_type, time.monotonic(), on_done))
+        except asyncio.QueueFull:
+            metrics.record_telegram_update(update_type, "rejected")
+            return False
+        return True
+
+    async def process_inline(
+        self,
+        update: Update,
+        chat_id: Optional[int],
+        update_type: Optional[str],
+        timeout: float,
+    ) -> Tuple[bool, Optional[TelegramMethod]]:
+        """
+        Обрабатывает обновление прямо в запросе вебхука, если шард чата свободен.
+        Возвращает (обработано, метод для ответа в теле вебхука или None).
+        (False, None) - шард занят, обновление нужно поставить в очередь.
+        """
+        index = self._shard(chat_id, update.update_id)
+        lock = self._locks[index]
+        if lock.locked() or not self._queues[index].empty():
+            return False, None
+        await lock.acquire()
+        reply = asyncio.get_running_loop().create_future()
+        # Свой контекст: трасса HTTP-запроса закроется по таймауту раньше медленного
+        # обработчика, и его span'ы пропали бы; UpdateTracingMiddleware откроет новую
+        self._spawn(
+            self._handle_inline(update, update_type, lock, reply),
+            context=contextvars.Context(),
+        )
+        try:
+            return True, await asyncio.wait_for(asyncio.shield(reply), timeout=timeout)
+        except asyncio.TimeoutError:
+            # Обработчик медленный: он завершится в фоне, а его ответ уйдет обычным запросом
+            reply.cancel()
+            return True, None
+
+    async def _handle_inline(
+        self,
+        update: Update,
+        update_type: Optional[str],
+        lock: asyncio.Lock,
+        reply: asyncio.Future,
+    ) -> None:
+        try:
+            result = await self._feed(update, update_type, 0.0)
+            if isinstance(result, TelegramMethod):
+                if not reply.done():
+                    reply.set_result(result)
+                    return
+                await self._dispatcher.silent_call_request(bot=self._bot, result=result)
+        finally:
+            lock.release()
+            if not reply.done():
+                reply.set_result(None)
+
+    async def _feed(self, update: Update, update_type: Optional[str], lag: float) -> Any:
+        try:
+            with span("aiogram.feed_update", update_type=update_type, update_id=update.update_id):
+                result = await self._dispatcher.feed_update(self._bot, update)
+            metrics.record_telegram_update(update_type, "processed", lag)
+            return result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.record_telegram_update(update_type, "failed", lag)
+            logger.error(f"Error processing Telegram update {update.update_id}: {e}", exc_info=True)
+            return None
+
+    async def _worker(self, index: int) -> None:
+        queue = self._queues[index]
+        lock = self._locks[index]
+        while True:
+            update, update_type, enqueued_at, on_done = await queue.get()
+            try:
+                async with lock:
+                    result = await self._feed(update, update_type, time.monotonic() - enqueued_at)
+                    # Обработчик вернул метод API (return message.answer(...)) - выполняем его
+                    if isinstance(result, TelegramMethod):
+                        await self._dispatcher.silent_call_request(bot=self._bot, result=result)
+                if on_done is not None:
+                    try:
+                        await on_done()
+                    except Exception as e:
+                        logger.error(f"Done callback for Telegram update {update.update_id} failed: {e}")
+            finally:
+                queue.task_done()
+
+
+def webhook_reply_payload(bot: Bot, method: TelegramMethod) -> Optional[Dict[str, Any]]:
+    """
+    JSON-тело ответа вебхука {"method": ..., параметры}.
+    None - метод отправляет файлы, такой ответ в теле вебхука не передать.
+    """
+    files: Dict[str, Any] = {}
+    payload: Dict[str, Any] = {"method": method.__api_method__}
+    for key, value in method.model_dump(warnings=False).items():
+        prepared = bot.session.prepare_value(value, bot=bot, files=files, _dumps_json=False)
+        if prepared is not None:
+            payload[key] = prepared
+    if files:
+        return None
+    return payload
+
+
+def update_chat_id(update_data: Any) -> Tuple[Optional[str], Optional[int]]:
+    """Тип обновления и chat_id (для шардирования и логов) из JSON Telegram"""
+    if not isinstance(update_data, dict):
+        return None, None
+    if "message" in update_data:
+        return "message", update_data.get("message", {}).get("chat", {}).get("id")
+    if "callback_query" in update_data:
+        callback = update_data.get("callback_query", {})
+        chat_id = callback.get("message", {}).get("chat", {}).get("id")
+        # Callback от inline-сообщения без чата - упорядочиваем по пользователю
+        return "callback_query", chat_id if chat_id is not None else callback.get("from", {}).get("id")
+    if "my_chat_member" in update_data:
+        return "my_chat_member", update_data.get("my_chat_member", {}).get("chat", {}).get("id")
+    for update_type, value in update_data.items():
+        if update_type != "update_id" and isinstance(value, dict):
+            chat = value.get("chat") or value.get("from") or value.get("user") or {}
+            return update_type, chat.get("id")
+    return None, None
+
+
+# Глобальная очередь webhook
+update_queue = UpdateQueue(
+    workers=settings.TELEGRAM_UPDATE_WORKERS,
+    shard_size=settings.TELEGRAM_UPDATE_QUEUE_SIZE
+)
+
+metrics.register_gauge(
+    "cveti_telegram_update_queue_depth", "Telegram updates waiting in the webhook queue",
+    update_queue.depth
+)
+metrics.register_gauge(
+    "cveti_telegram_update_queue_lag_seconds", "Age of the oldest queued Telegram update",
+    update_queue.oldest_lag
+)
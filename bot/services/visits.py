@@ -2,30 +2,57 @@ from __future__ import annotations
 
 from datetime import datetime, timezone, timedelta
 from typing import Any, Dict, List, Optional
+import hashlib
+import json
 import logging
 
 import httpx
 
+from bot.config import settings
 from bot.services.supabase_client import supabase
 from bot.services.phone_normalize import normalize_phone
 from bot.services.yclients_api import yclients
 
 logger = logging.getLogger(__name__)
 
+# Columns served to the UI; raw_payload is never read back.
+_VISIT_READ_COLUMNS = "visit_id,visit_datetime,services,master,amount,status,created_at"
+
+# Aggregate columns served to the profile and admin views.
+_VISIT_STATS_COLUMNS = (
+    "visit_count,total_spent,first_visit_at,last_visit_at,top_master,top_services,refreshed_at"
+)
+
+# Fields that define a visit's content for change detection.
+_VISIT_HASH_FIELDS = (
+    "user_id",
+    "yclients_client_id",
+    "visit_datetime",
+    "amount",
+    "status",
+    "master",
+    "services",
+)
+
 
 def _parse_datetime(value: Any) -> Optional[datetime]:
+    parsed = None
     if isinstance(value, datetime):
-        return value
-    if isinstance(value, str) and value:
+        parsed = value
+    elif isinstance(value, str) and value:
         candidate = value.replace("Z", "+00:00")
         try:
-            return datetime.fromisoformat(candidate)
+            parsed = datetime.fromisoformat(candidate)
         except ValueError:
             return None
-    return None
+    # Naive timestamps (written via datetime.utcnow()) are UTC
+    if parsed is not None and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
 
 
-def _is_sync_due(last_sync: Any, min_interval_minutes: int) -> bool:
+def is_sync_due(last_sync: Any, min_interval_minutes: int) -> bool:
+    """True if ``last_sync`` is missing or older than ``min_interval_minutes``."""
     if not last_sync:
         return True
     parsed = _parse_datetime(last_sync)
@@ -38,7 +65,7 @@ def _is_sync_due(last_sync: Any, min_interval_minutes: int) -> bool:
 async def get_user_visits(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
     """Return cached visits from local DB."""
     res = await supabase.table("yclients_visits") \
-        .select("*") \
+        .select(_VISIT_READ_COLUMNS) \
         .eq("user_id", user_id) \
         .order("visit_datetime", desc=True) \
         .order("created_at", desc=True) \
@@ -65,6 +92,53 @@ async def get_user_visits(user_id: int, limit: int = 10) -> List[Dict[str, Any]]
     return items
 
 
+async def get_user_visit_stats(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Return the per-user visit aggregate (user_visit_stats, maintained by triggers
+    on yclients_visits): one primary-key read instead of scanning visits.
+    """
+    res = await supabase.table("user_visit_stats") \
+        .select(_VISIT_STATS_COLUMNS) \
+        .eq("user_id", user_id) \
+        .limit(1) \
+        .execute()
+    if not res.data:
+        return None
+    stats = dict(res.data[0])
+    total_spent = stats.get("total_spent")
+    if isinstance(total_spent, str):
+        try:
+            stats["total_spent"] = float(total_spent)
+        except ValueError:
+            stats["total_spent"] = None
+    return stats
+
+
+async def refresh_visit_stats_batch(after_id: int = 0, batch_size: int = 500) -> Dict[str, Any]:
+    """Recompute aggregates for the next batch of users by id (used by the backfill script)."""
+    res = await supabase.rpc("refresh_visit_stats_batch", {
+        "p_after_id": after_id,
+        "p_batch_size": batch_size
+    }).execute()
+    return res.data or {}
+
+
+def _visit_content_hash(row: Dict[str, Any]) -> str:
+    content = {field: row.get(field) for field in _VISIT_HASH_FIELDS}
+    encoded = json.dumps(content, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+async def _get_visit_hashes(visit_ids: List[int]) -> Dict[int, Optional[str]]:
+    if not visit_ids:
+        return {}
+    res = await supabase.table("yclients_visits") \
+        .select("visit_id,content_hash") \
+        .in_("visit_id", visit_ids) \
+        .execute()
+    return {int(row["visit_id"]): row.get("content_hash") for row in (res.data or [])}
+
+
 async def _upsert_visit(row: Dict[str, Any]) -> str:
     try:
         await supabase.table("yclients_visits").insert(row).execute()
@@ -84,15 +158,23 @@ async def sync_user_visits(
     user_id: int,
     limit: int = 20,
     force: bool = False,
-    min_interval_minutes: int = 30
+    min_interval_minutes: int = 30,
+    touch_sync_timestamp: bool = True,
+    user: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
-    """Sync visits from YClients into local DB."""
-    user_res = await supabase.table("users").select("*").eq("id", user_id).execute()
-    if not user_res.data:
-        return {"synced": False, "reason": "user_not_found", "visits": []}
+    """Sync visits from YClients into local DB.
 
-    user = user_res.data[0]
-    if not force and not _is_sync_due(user.get("visits_last_sync"), min_interval_minutes):
+    Callers that already hold the users row may pass it as ``user``. With
+    ``touch_sync_timestamp=False`` visits_last_sync is left for the caller
+    to stamp (the periodic sync does it in bulk).
+    """
+    if user is None:
+        user_res = await supabase.table("users").select("*").eq("id", user_id).execute()
+        if not user_res.data:
+            return {"synced": False, "reason": "user_not_found", "visits": []}
+        user = user_res.data[0]
+
+    if not force and not is_sync_due(user.get("visits_last_sync"), min_interval_minutes):
         return {"synced": False, "reason": "fresh", "visits": []}
 
     yclients_id = user.get("yclients_id")
@@ -106,55 +188,78 @@ async def sync_user_visits(
                 yclients_id = client["id"]
                 try:
                     await supabase.table("users").update({"yclients_id": yclients_id}).eq("id", user_id).execute()
+                    user["yclients_id"] = yclients_id
                 except Exception as update_err:
                     logger.warning("Failed to update yclients_id for user %s: %s", user_id, update_err)
 
     if not yclients_id:
         return {"synced": False, "reason": "yclients_not_found", "visits": []}
 
-    visits = await yclients.get_client_visits(int(yclients_id), limit=limit)
+    batch = await yclients.get_client_visits_batch(int(yclients_id), limit=limit)
+    visits = batch.to_visits()
     now = datetime.now(timezone.utc).isoformat()
 
+    rows = batch.to_rows(user_id, int(yclients_id), now)
+    if settings.VISITS_STORE_RAW_PAYLOAD:
+        payloads = [visit for visit in visits if visit.get("visit_id")]
+        for row, payload in zip(rows, payloads):
+            row["raw_payload"] = payload
+
+    try:
+        known_hashes = await _get_visit_hashes([row["visit_id"] for row in rows])
+    except Exception as exc:
+        logger.warning("Failed to load visit hashes for user %s: %s", user_id, exc)
+        known_hashes = {}
+
     stored = 0
-    for visit in visits or []:
-        if not isinstance(visit, dict):
-            continue
-        visit_id = visit.get("visit_id") or visit.get("id")
-        if not visit_id:
-            continue
-
-        row = {
-            "visit_id": int(visit_id),
-            "user_id": user_id,
-            "yclients_client_id": int(yclients_id),
-            "visit_datetime": visit.get("visit_datetime"),
-            "amount": visit.get("amount"),
-            "status": visit.get("status"),
-            "master": visit.get("master"),
-            "services": visit.get("services") or [],
-            "raw_payload": visit,
-            "synced_at": now,
-            "updated_at": now
-        }
+    unchanged = 0
+    new_rows: List[Dict[str, Any]] = []
+    for row in rows:
+        row["content_hash"] = _visit_content_hash(row)
+        visit_id = row["visit_id"]
+        if visit_id in known_hashes:
+            if known_hashes[visit_id] == row["content_hash"]:
+                unchanged += 1
+                continue
+            update_data = {k: v for k, v in row.items() if k not in ("visit_id", "user_id")}
+            try:
+                await supabase.table("yclients_visits") \
+                    .update(update_data) \
+                    .eq("visit_id", visit_id) \
+                    .execute()
+                stored += 1
+            except Exception as exc:
+                logger.warning("Failed to update visit %s for user %s: %s", visit_id, user_id, exc)
+        else:
+            new_rows.append(row)
 
+    if new_rows:
         try:
-            await _upsert_visit(row)
-            stored += 1
+            await supabase.table("yclients_visits").insert(new_rows).execute()
+            stored += len(new_rows)
         except Exception as exc:
-            logger.warning("Failed to upsert visit %s for user %s: %s", visit_id, user_id, exc)
+            # Bulk insert failed (e.g. concurrent sync inserted some visits): retry row by row
+            logger.debug("Bulk visit insert failed for user %s, retrying per row: %s", user_id, exc)
+            for row in new_rows:
+                try:
+                    await _upsert_visit(row)
+                    stored += 1
+                except Exception as row_exc:
+                    logger.warning("Failed to upsert visit %s for user %s: %s", row["visit_id"], user_id, row_exc)
 
-    try:
-        await supabase.table("users").update({
-            "visits_last_sync": now,
-            "updated_at": now
-        }).eq("id", user_id).execute()
-    except Exception as update_err:
-        logger.warning("Failed to update visits_last_sync for user %s: %s", user_id, update_err)
+    if touch_sync_timestamp:
+        try:
+            await supabase.table("users").update({
+                "visits_last_sync": now
+            }).eq("id", user_id).execute()
+        except Exception as update_err:
+            logger.warning("Failed to update visits_last_sync for user %s: %s", user_id, update_err)
 
     return {
         "synced": True,
         "reason": "ok",
         "visits": visits or [],
         "stored": stored,
+        "unchanged": unchanged,
         "yclients_id": yclients_id
     }
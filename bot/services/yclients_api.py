@@ -1,15 +1,212 @@
 import httpx
 import logging
+import time
 from typing import Dict, Any, Optional, List
 from bot.config import settings
+from bot.services import fast_json
+from bot.services.metrics import metrics, normalize_path
+from bot.services.tracing import record_span
 
 logger = logging.getLogger(__name__)
 
+# Коды статусов визита (индексы в VISIT_STATUS_LABELS)
+VISIT_STATUS_CANCELED = 0
+VISIT_STATUS_CONFIRMED = 1
+VISIT_STATUS_ATTENDED = 2
+VISIT_STATUS_PENDING = 3
+VISIT_STATUS_NO_SHOW = 4
+VISIT_STATUS_NOT_CONFIRMED = 5
+VISIT_STATUS_BOOKED = 6
+
+VISIT_STATUS_LABELS = (
+    "Отменено",
+    "Подтверждено",
+    "Визит состоялся",
+    "Ожидается",
+    "Не пришли",
+    "Не подтверждено",
+    "Запись",
+)
+
+_ATTENDANCE_STATUS_CODES = {
+    2: VISIT_STATUS_CONFIRMED,
+    1: VISIT_STATUS_ATTENDED,
+    0: VISIT_STATUS_PENDING,
+    -1: VISIT_STATUS_NO_SHOW,
+}
+
+# Поля записи, из которых берется сумма визита (в порядке приоритета)
+_VISIT_AMOUNT_KEYS = ("amount", "sum", "total_cost", "cost", "prepaid", "paid_full")
+
+
+class VisitBatch:
+    """
+    Колоночное представление страницы визитов YClients.
+    Каждое поле - список одинаковой длины, i-й элемент относится к i-му визиту.
+    """
+
+    __slots__ = ("visit_ids", "datetimes", "amounts", "status_codes", "masters", "services")
+
+    def __init__(self):
+        self.visit_ids: List[Any] = []
+        self.datetimes: List[Any] = []
+        self.amounts: List[Optional[float]] = []
+        self.status_codes: List[int] = []
+        self.masters: List[Optional[str]] = []
+        self.services: List[List[str]] = []
+
+    def __len__(self) -> int:
+        return len(self.visit_ids)
+
+    def to_visits(self) -> List[Dict[str, Any]]:
+        """Визиты в формате UI: item_type, visit_id, visit_datetime, services, master, amount, status"""
+        labels = VISIT_STATUS_LABELS
+        return [
+            {
+                "item_type": "visit",
+                "visit_id": visit_id,
+                "visit_datetime": visit_datetime,
+                "services": services,
+                "master": master,
+                "amount": amount,
+                "status": labels[status_code]
+            }
+            for visit_id, visit_datetime, services, master, amount, status_code in zip(
+                self.visit_ids, self.datetimes, self.services,
+                self.masters, self.amounts, self.status_codes
+            )
+        ]
+
+    def to_rows(self, user_id: int, yclients_client_id: int, synced_at: str) -> List[Dict[str, Any]]:
+        """Строки для таблицы yclients_visits (визиты без ID пропускаются)"""
+        labels = VISIT_STATUS_LABELS
+        rows = []
+        for visit_id, visit_datetime, services, master, amount, status_code in zip(
+            self.visit_ids, self.datetimes, self.services,
+            self.masters, self.amounts, self.status_codes
+        ):
+            if not visit_id:
+                continue
+            rows.append({
+                "visit_id": int(visit_id),
+                "user_id": user_id,
+                "yclients_client_id": yclients_client_id,
+                "visit_datetime": visit_datetime,
+                "amount": amount,
+                "status": labels[status_code],
+                "master": master,
+                "services": services,
+                "synced_at": synced_at,
+                "updated_at": synced_at
+            })
+        return rows
+
+
+def _visit_status_code(raw: Dict[str, Any]) -> int:
+    get = raw.get
+    if get("deleted") or get("canceled"):
+        return VISIT_STATUS_CANCELED
+    attendance = get("attendance")
+    if attendance is None:
+        attendance = get("visit_attendance")
+    if attendance is not None:
+        if isinstance(attendance, str) and attendance.lstrip("-").isdigit():
+            attendance = int(attendance)
+        try:
+            code = _ATTENDANCE_STATUS_CODES.get(attendance)
+        except TypeError:
+            code = None
+        if code is not None:
+            return code
+    if get("confirmed") is False:
+        return VISIT_STATUS_NOT_CONFIRMED
+    return VISIT_STATUS_BOOKED
+
+
+def normalize_visits_batch(raw_visits: List[Any]) -> VisitBatch:
+    """
+    Нормализует страницу записей YClients за один проход.
+    Результат эквивалентен поштучной нормализации (bench/visit_normalize.py),
+    но без промежуточного словаря на каждый визит.
+    """
+    batch = VisitBatch()
+    add_id = batch.visit_ids.append
+    add_datetime = batch.datetimes.append
+    add_amount = batch.amounts.append
+    add_status = batch.status_codes.append
+    add_master = batch.masters.append
+    add_services = batch.services.append
+    amount_keys = _VISIT_AMOUNT_KEYS
+
+    for raw in raw_visits:
+        if not isinstance(raw, dict):
+            continue
+        get = raw.get
+
+        titles: List[str] = []
+        services_total = None
+        services = get("services")
+        if services and isinstance(services, list):
+            for service in services:
+                if not isinstance(service, dict):
+                    continue
+                service_get = service.get
+                title = service_get("title") or service_get("name")
+                if title:
+                    titles.append(str(title))
+                cost = service_get("cost")
+                if cost is None:
+                    cost = service_get("first_cost")
+                if cost is None:
+                    cost = service_get("manual_cost")
+                if cost is None or isinstance(cost, bool):
+                    continue
+                quantity = service_get("amount", 1)
+                try:
+                    cost_value = float(cost)
+                    quantity_value = float(quantity) if quantity is not None else 1.0
+                except (ValueError, TypeError):
+                    continue
+                services_total = (services_total or 0) + cost_value * quantity_value
+
+        amount = None
+        for key in amount_keys:
+            candidate = get(key)
+            if candidate is None or isinstance(candidate, bool):
+                continue
+            try:
+                value = float(candidate)
+            except (ValueError, TypeError):
+                continue
+            if value <= 0:
+                continue
+            amount = value
+            break
+        if amount is None:
+            amount = services_total
+
+        staff = get("staff")
+        master = None
+        if staff and isinstance(staff, dict):
+            master = staff.get("name") or staff.get("title")
+        if not master:
+            master = get("staff_name")
+
+        add_id(get("id") or get("visit_id"))
+        add_datetime(get("datetime") or get("date") or get("create_date"))
+        add_services(titles)
+        add_master(master)
+        add_amount(amount)
+        add_status(_visit_status_code(raw))
+
+    return batch
+
+
 class YClientsAPI:
     """HTTP клиент для YClients API v1"""
     
     def __init__(self):
-        self.base_url = "https://api.yclients.com/api/v1"
+        self.base_url = settings.YCLIENTS_BASE_URL.rstrip('/')
         self.partner_token = settings.YCLIENTS_PARTNER_TOKEN
         self.user_token = settings.YCLIENTS_USER_TOKEN
         self.company_id = settings.YCLIENTS_COMPANY_ID
@@ -42,6 +239,8 @@ class YClientsAPI:
             **kwargs: Дополнительные параметры для httpx.request
         """
         url = f"{self.base_url}/{path.lstrip('/')}"
+        response = None
+        started = time.perf_counter()
         
         # Формируем заголовки: для некоторых методов нужен только Partner Token
         headers = self.headers.copy()
@@ -60,7 +259,7 @@ class YClientsAPI:
             
             # Проверяем, есть ли содержимое для парсинга JSON
             if response.content:
-                return response.json()
+                return fast_json.loads(response.content)
             return None
         except httpx.HTTPStatusError as e:
             error_text = e.response.text[:500] if e.response.text else "No error text"
@@ -72,6 +271,25 @@ class YClientsAPI:
         except Exception as e:
             logger.error(f"YClients unexpected error: {str(e)} for {url}", exc_info=True)
             return None
+        finally:
+            endpoint = normalize_path(path)
+            status = str(response.status_code) if response is not None else "error"
+            duration = time.perf_counter() - started
+            metrics.record_upstream(
+                "yclients",
+                method,
+                endpoint,
+                status,
+                duration,
+                request_bytes=len(response.request.content) if response is not None else 0,
+                response_bytes=len(response.content) if response is not None else 0,
+            )
+            record_span(
+                f"yclients {method} {endpoint}",
+                duration,
+                error=response is None or response.status_code >= 400,
+                status=status,
+            )
 
     async def get_client_by_phone(self, phone: str) -> Optional[Dict[str, Any]]:
         """Поиск клиента по номеру телефона в филиале"""
@@ -207,97 +425,10 @@ class YClientsAPI:
         path = f"company/{self.company_id}/loyalty/cards/{card_id}/manual_transaction"
         return await self._request("POST", path, json=payload, use_user_token=True)
 
-    def _format_visit_status(self, raw: Dict[str, Any]) -> str:
-        if raw.get("deleted") or raw.get("canceled"):
-            return "Отменено"
-        attendance = raw.get("attendance")
-        if attendance is None:
-            attendance = raw.get("visit_attendance")
-        if isinstance(attendance, str) and attendance.lstrip("-").isdigit():
-            attendance = int(attendance)
-        if attendance == 2:
-            return "Подтверждено"
-        if attendance == 1:
-            return "Визит состоялся"
-        if attendance == 0:
-            return "Ожидается"
-        if attendance == -1:
-            return "Не пришли"
-        if raw.get("confirmed") is False:
-            return "Не подтверждено"
-        return "Запись"
-
-    def _normalize_visit(self, raw: Dict[str, Any]) -> Dict[str, Any]:
-        services_titles: List[str] = []
-        services_total = None
-        services = raw.get("services") or []
-        if isinstance(services, list):
-            for service in services:
-                if not isinstance(service, dict):
-                    continue
-                title = service.get("title") or service.get("name")
-                if title:
-                    services_titles.append(str(title))
-                cost = service.get("cost")
-                if cost is None:
-                    cost = service.get("first_cost")
-                if cost is None:
-                    cost = service.get("manual_cost")
-                amount = service.get("amount", 1)
-                if cost is not None and not isinstance(cost, bool):
-                    try:
-                        cost_value = float(cost)
-                        amount_value = float(amount) if amount is not None else 1.0
-                        services_total = (services_total or 0) + cost_value * amount_value
-                    except (ValueError, TypeError):
-                        pass
-
-        amount = None
-        amount_candidates = [
-            raw.get("amount"),
-            raw.get("sum"),
-            raw.get("total_cost"),
-            raw.get("cost"),
-            raw.get("prepaid"),
-            raw.get("paid_full")
-        ]
-        for candidate in amount_candidates:
-            if candidate is None or isinstance(candidate, bool):
-                continue
-            try:
-                amount = float(candidate)
-                if amount <= 0:
-                    amount = None
-                    continue
-                break
-            except (ValueError, TypeError):
-                continue
-        if amount is None and services_total is not None:
-            amount = services_total
-
-        staff = raw.get("staff") or {}
-        master = None
-        if isinstance(staff, dict):
-            master = staff.get("name") or staff.get("title")
-        if not master:
-            master = raw.get("staff_name")
-
-        visit_datetime = raw.get("datetime") or raw.get("date") or raw.get("create_date")
-
-        return {
-            "item_type": "visit",
-            "visit_id": raw.get("id") or raw.get("visit_id"),
-            "visit_datetime": visit_datetime,
-            "services": services_titles,
-            "master": master,
-            "amount": amount,
-            "status": self._format_visit_status(raw)
-        }
-
-    async def get_client_visits(self, client_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Получает историю визитов клиента и нормализует данные для UI."""
+    async def get_client_visits_batch(self, client_id: int, limit: int = 10) -> VisitBatch:
+        """Получает историю визитов клиента в колоночном виде (VisitBatch)."""
         if not client_id:
-            return []
+            return VisitBatch()
 
         params = {
             "client_id": client_id,
@@ -306,7 +437,7 @@ class YClientsAPI:
         }
         result = await self._request("GET", f"records/{self.company_id}", params=params)
         if not result:
-            return []
+            return VisitBatch()
 
         raw_visits = []
         if isinstance(result, dict):
@@ -315,13 +446,14 @@ class YClientsAPI:
             raw_visits = result
 
         if not isinstance(raw_visits, list):
-            return []
+            return VisitBatch()
+
+        return normalize_visits_batch(raw_visits)
 
-        normalized = []
-        for visit in raw_visits:
-            if isinstance(visit, dict):
-                normalized.append(self._normalize_visit(visit))
-        return normalized
+    async def get_client_visits(self, client_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """Получает историю визитов клиента и нормализует данные для UI."""
+        batch = await self.get_client_visits_batch(client_id, limit=limit)
+        return batch.to_visits()
 
     async def get_companies_list(self) -> Optional[List[Dict[str, Any]]]:
         """
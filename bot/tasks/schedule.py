@@ -0,0 +1,29 @@
+"""
+Расписание периодических задач (bot/services/scheduler.py).
+Регистрируется в процессе, выполняющем фоновые задачи: API при BACKGROUND_MODE=inline
+или python -m bot.worker.
+"""
+from api.routes import admin as admin_routes
+from bot.config import settings
+from bot.services.jobs import purge_finished_jobs
+from bot.services.loyalty import expire_loyalty_points
+from bot.services.scheduler import Scheduler
+from bot.tasks.sync import sync_all_users
+
+# Перепроверка срока запланированных рассылок (рассылки, созданные другим процессом)
+SCHEDULED_BROADCASTS_RECHECK_SECONDS = 60
+
+
+def register_jobs(scheduler: Scheduler) -> None:
+    # Синхронизация с YClients: jitter разносит запросы разных инсталляций бота
+    scheduler.add_job("yclients_sync", sync_all_users, cron=settings.SYNC_CRON, jitter_seconds=300)
+    # Сгорание баллов: обнуляет остатки, пишет транзакции 'expire' и пересчитывает users.balance
+    scheduler.add_job("loyalty_expiry", expire_loyalty_points, cron=settings.EXPIRY_CRON, jitter_seconds=60)
+    # Запланированные рассылки: запуск в scheduled_at ближайшей рассылки, а не опрос раз в минуту
+    scheduler.add_job(
+        "scheduled_broadcasts",
+        admin_routes.check_scheduled_broadcasts,
+        next_due=admin_routes.next_scheduled_broadcast_at,
+        recheck_seconds=SCHEDULED_BROADCASTS_RECHECK_SECONDS,
+    )
+    scheduler.add_job("job_queue_purge", purge_finished_jobs, cron=settings.JOB_PURGE_CRON)
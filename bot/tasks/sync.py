@@ -1,48 +1,163 @@
 import asyncio
 import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set
+from bot.config import settings
+from bot.services.metrics import call_budget_used, finish_call_budget, start_call_budget
 from bot.services.supabase_client import supabase
 from bot.services.loyalty import sync_user_with_yclients
 from bot.services.visits import sync_user_visits
 
 logger = logging.getLogger(__name__)
 
-async def run_periodic_sync():
-    """
-    Фоновая задача для периодической синхронизации всех пользователей с YClients.
-    Запускается раз в 24 часа.
-    """
-    logger.info("Starting periodic YClients sync task")
-    
-    while True:
+# Пауза между пользователями, чтобы не упираться в лимиты YClients
+SYNC_USER_DELAY_SECONDS = 0.5
+
+# Сколько id помещаем в один PATCH users?id=in.(...)
+SYNC_STAMP_CHUNK_SIZE = 150
+
+# Сколько кандидатов select_sync_candidates берем за раз
+SYNC_CANDIDATE_BATCH_SIZE = 100
+
+# Интервал до следующей синхронизации по уровню приоритета (sync_tier)
+SYNC_TIER_INTERVAL_HOURS = {
+    0: settings.SYNC_HOT_INTERVAL_HOURS,
+    1: settings.SYNC_WARM_INTERVAL_HOURS,
+    2: settings.SYNC_DORMANT_INTERVAL_HOURS,
+}
+
+# Через сколько после записи синхронизировать клиента (визит закрыт, баллы начислены)
+SYNC_AFTER_APPOINTMENT = timedelta(hours=3)
+
+
+async def _stamp_users(user_ids: List[int], field: str, value: str) -> None:
+    """Проставляет время синхронизации пачкой вместо отдельного PATCH на каждого пользователя"""
+    for start in range(0, len(user_ids), SYNC_STAMP_CHUNK_SIZE):
+        chunk = user_ids[start:start + SYNC_STAMP_CHUNK_SIZE]
         try:
-            # 1. Получаем всех пользователей, у которых есть yclients_id или телефон
-            # Ограничиваем выборку активными пользователями
-            users_res = await supabase.table("users")\
-                .select("id")\
-                .eq("active", True)\
+            await supabase.table("users")\
+                .update({field: value})\
+                .in_("id", chunk)\
                 .execute()
-            
-            if users_res.data:
-                logger.info(f"Syncing {len(users_res.data)} users with YClients")
-                
-                for user in users_res.data:
-                    user_id = user["id"]
-                    try:
-                        # Синхронизируем каждого пользователя
-                        # Добавляем небольшую задержку между запросами, чтобы не спамить API
-                        await sync_user_with_yclients(user_id)
-                        await sync_user_visits(user_id, limit=50, force=True)
-                        await asyncio.sleep(0.5) 
-                    except Exception as e:
-                        logger.error(f"Failed to sync user {user_id} during periodic task: {e}")
-                
-                logger.info("Periodic sync completed")
-            else:
-                logger.info("No active users found for sync")
+        except Exception as e:
+            logger.error(f"Failed to stamp {field} for {len(chunk)} users: {e}")
+
+
+def _next_due_at(user: Dict[str, Any], now: datetime) -> datetime:
+    """Срок следующей синхронизации: по уровню приоритета, но не позже чем вскоре после ближайшей записи"""
+    hours = SYNC_TIER_INTERVAL_HOURS.get(user.get("sync_tier"), settings.SYNC_DORMANT_INTERVAL_HOURS)
+    due = now + timedelta(hours=hours)
+    appointment = user.get("next_appointment_at")
+    if appointment:
+        try:
+            appointment_at = datetime.fromisoformat(appointment.replace("Z", "+00:00"))
+        except ValueError:
+            return due
+        if appointment_at.tzinfo is None:
+            appointment_at = appointment_at.replace(tzinfo=timezone.utc)
+        # После визита начисляются баллы: синхронизируем, когда запись закроют
+        due = min(due, max(appointment_at + SYNC_AFTER_APPOINTMENT, now))
+    return due
 
+
+async def _schedule_users(users: List[Dict[str, Any]], now: datetime) -> None:
+    """Проставляет sync_next_due_at пачкой (RPC bulk_patch)"""
+    rows = [{"id": user["id"], "sync_next_due_at": _next_due_at(user, now).isoformat()} for user in users]
+    for start in range(0, len(rows), SYNC_STAMP_CHUNK_SIZE):
+        chunk = rows[start:start + SYNC_STAMP_CHUNK_SIZE]
+        try:
+            await supabase.bulk_update("users", chunk)
         except Exception as e:
-            logger.error(f"Error in periodic sync task: {e}", exc_info=True)
-        
-        # Ждем 24 часа перед следующим запуском
-        # 24 * 60 * 60 = 86400 секунд
-        await asyncio.sleep(86400)
+            logger.error(f"Failed to schedule next sync for {len(chunk)} users: {e}")
+
+
+async def _select_candidates(limit: int) -> List[Dict[str, Any]]:
+    res = await supabase.rpc("select_sync_candidates", {
+        "p_limit": limit,
+        "p_hot_days": settings.SYNC_HOT_DAYS,
+        "p_warm_days": settings.SYNC_WARM_DAYS
+    }).execute()
+    return res.data or []
+
+
+async def sync_all_users(request_budget: Optional[int] = None) -> Dict[str, int]:
+    """
+    Один проход синхронизации пользователей с YClients.
+
+    Берет активных пользователей, у которых наступил sync_next_due_at, в порядке приоритета
+    (select_sync_candidates, миграция 029): сначала клиенты с ближайшей записью и недавно
+    заходившие в бот, затем недавние, затем спящие. Проход останавливается, когда
+    израсходовано request_budget (по умолчанию YCLIENTS_SYNC_REQUEST_BUDGET) запросов
+    к YClients; остальные дождутся следующего прохода.
+
+    Returns:
+        dict: users, loyalty, visits - сколько пользователей обработано/синхронизировано,
+        requests - сколько запросов к YClients сделано, deferred - остановлен ли проход по бюджету
+    """
+    budget = settings.YCLIENTS_SYNC_REQUEST_BUDGET if request_budget is None else request_budget
+    budget_token = start_call_budget()
+    processed: List[Dict[str, Any]] = []
+    seen: Set[int] = set()
+    loyalty_synced: List[int] = []
+    visits_synced: List[int] = []
+    tiers: Counter = Counter()
+    deferred = False
+    try:
+        while not deferred:
+            candidates = [user for user in await _select_candidates(SYNC_CANDIDATE_BATCH_SIZE) if user["id"] not in seen]
+            if not candidates:
+                break
+            batch: List[Dict[str, Any]] = []
+            for user in candidates:
+                if call_budget_used("yclients") >= budget:
+                    deferred = True
+                    break
+                user_id = user["id"]
+                seen.add(user_id)
+                batch.append(user)
+                tiers[user.get("sync_tier")] += 1
+                try:
+                    # Синхронизируем каждого пользователя; запись в users происходит только
+                    # при реальных изменениях, время синхронизации проставляем пачкой ниже
+                    # Добавляем небольшую задержку между запросами, чтобы не спамить API
+                    if await sync_user_with_yclients(user_id, user=user, touch_sync_timestamp=False):
+                        loyalty_synced.append(user_id)
+                    visits_result = await sync_user_visits(
+                        user_id,
+                        limit=50,
+                        force=True,
+                        touch_sync_timestamp=False,
+                        user=user
+                    )
+                    if visits_result.get("synced"):
+                        visits_synced.append(user_id)
+                    await asyncio.sleep(SYNC_USER_DELAY_SECONDS)
+                except Exception as e:
+                    logger.error(f"Failed to sync user {user_id} during periodic task: {e}")
+            # Срок следующей синхронизации получают и пользователи с ошибкой, иначе
+            # они снова окажутся в начале очереди в этом же проходе
+            await _schedule_users(batch, datetime.now(timezone.utc))
+            processed.extend(batch)
+    finally:
+        requests = finish_call_budget(budget_token)["yclients"]
+
+    now = datetime.now(timezone.utc).isoformat()
+    await _stamp_users(loyalty_synced, "loyalty_last_sync", now)
+    await _stamp_users(visits_synced, "visits_last_sync", now)
+
+    if not processed:
+        logger.info("No users due for sync")
+    logger.info(
+        f"Periodic sync completed: users={len(processed)} "
+        f"(tiers: {', '.join(f'{tier}={count}' for tier, count in sorted(tiers.items()))}), "
+        f"loyalty={len(loyalty_synced)}, visits={len(visits_synced)}, "
+        f"yclients_requests={requests}/{budget}{', deferred by budget' if deferred else ''}"
+    )
+    return {
+        "users": len(processed),
+        "loyalty": len(loyalty_synced),
+        "visits": len(visits_synced),
+        "requests": requests,
+        "deferred": int(deferred),
+    }
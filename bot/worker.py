@@ -0,0 +1,192 @@
+"""
+Процесс фоновых задач: python -m bot.worker
+
+При BACKGROUND_MODE=worker API только принимает запросы и ставит задачи в job_queue,
+а этот процесс:
+- выполняет задачи очереди (рассылки, платежи из вебхука YClients и, при
+  TELEGRAM_UPDATES_IN_WORKER, обновления Telegram);
+- запускает периодические задачи по расписанию (синхронизация YClients, запланированные
+  рассылки, сгорание баллов) - при нескольких воркерах их выполняет владелец аренды;
+- сбрасывает локальные кэши по cache_versions.
+Ночная синхронизация и большая рассылка больше не делят event loop с запросами API.
+"""
+# КРИТИЧНО: Применяем патчи для Python 3.14 ДО импорта aiogram
+import bot.patches  # noqa: F401
+
+from typing import Any, Dict, List, Set
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from api.models.yclients import YClientsWebhookData
+from api.routes import admin as admin_routes, webhooks
+from bot.config import settings
+from bot.dispatcher import create_bot, dp
+from bot.services.cache_versions import run_cache_version_watcher
+from bot.services.jobs import (
+    JOB_BROADCAST,
+    JOB_TELEGRAM_UPDATE,
+    JOB_YCLIENTS_PAYMENT,
+    claim_jobs,
+    complete_job,
+    heartbeat_jobs,
+)
+from bot.services.leader import INSTANCE_ID
+from bot.services.scheduler import scheduler
+from bot.services.supabase_client import get_supabase
+from bot.services.update_queue import update_chat_id, update_queue
+from bot.tasks.schedule import register_jobs
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL_SECONDS = 60
+
+
+class JobWorker:
+    """Забирает задачи из job_queue и выполняет до WORKER_CONCURRENCY одновременно"""
+
+    def __init__(self, bot: Bot, worker_id: str, concurrency: int):
+        self.bot = bot
+        self.worker_id = worker_id
+        self.concurrency = max(concurrency, 1)
+        self._running: Dict[int, asyncio.Task] = {}
+        # Обновления Telegram, переданные update_queue и еще не обработанные
+        self._updates: Set[int] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    async def run(self) -> None:
+        poll_seconds = settings.WORKER_POLL_INTERVAL_MS / 1000
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        try:
+            while not self._stopping.is_set():
+                free = self.concurrency - len(self._running)
+                claimed: List[Dict[str, Any]] = []
+                if free > 0:
+                    try:
+                        claimed = await claim_jobs(self.worker_id, free)
+                    except Exception as e:
+                        logger.error(f"Could not claim jobs: {e}")
+                for job in claimed:
+                    if job.get("kind") == JOB_TELEGRAM_UPDATE:
+                        # Обновления передаются очереди чатов сразу, в порядке постановки
+                        await self._dispatch_telegram_update(job)
+                    else:
+                        task = asyncio.create_task(self._run_job(job))
+                        self._running[job["id"]] = task
+                        task.add_done_callback(lambda _, job_id=job["id"]: self._running.pop(job_id, None))
+                if len(claimed) < free or free <= 0:
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), timeout=poll_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            if self._running:
+                logger.info(f"Waiting for {len(self._running)} running jobs")
+                await asyncio.wait(list(self._running.values()), timeout=settings.WORKER_SHUTDOWN_TIMEOUT_SECONDS)
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            try:
+                await heartbeat_jobs(self.worker_id, [*self._running, *self._updates])
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {e}")
+
+    async def _dispatch_telegram_update(self, job: Dict[str, Any]) -> None:
+        """
+        Передает обновление очереди чатов; задача отмечается выполненной после обработки,
+        поэтому при падении воркера обновление вернется в очередь (claim_jobs).
+        """
+        try:
+            update_data = job.get("payload") or {}
+            update_type, chat_id = update_chat_id(update_data)
+            update = Update.model_validate(update_data, context={"bot": self.bot})
+        except Exception as e:
+            await self._complete(job, f"Invalid Telegram update: {e}")
+            return
+        self._updates.add(job["id"])
+        if not update_queue.enqueue(update, chat_id, update_type, on_done=lambda: self._update_done(job)):
+            self._updates.discard(job["id"])
+            await self._complete(job, "Telegram update queue is full")
+
+    async def _update_done(self, job: Dict[str, Any]) -> None:
+        # Ошибка обработчика уже записана в лог и метрики; повтор мог бы продублировать
+        # сообщения, уже отправленные пользователю, поэтому задача все равно выполнена
+        self._updates.discard(job["id"])
+        await self._complete(job, None)
+
+    async def _run_job(self, job: Dict[str, Any]) -> None:
+        kind = job.get("kind")
+        payload = job.get("payload") or {}
+        error = None
+        try:
+            if kind == JOB_BROADCAST:
+                await admin_routes.process_broadcast(str(payload["broadcast_id"]))
+            elif kind == JOB_YCLIENTS_PAYMENT:
+                await webhooks.handle_payment_webhook(YClientsWebhookData.model_validate(payload))
+            else:
+                error = f"Unknown job kind: {kind}"
+        except Exception as e:
+            logger.error(f"Job {job.get('id')} ({kind}) failed: {e}", exc_info=True)
+            error = str(e) or e.__class__.__name__
+        await self._complete(job, error)
+
+    async def _complete(self, job: Dict[str, Any], error) -> None:
+        try:
+            status = await complete_job(job["id"], self.worker_id, error)
+            if error:
+                logger.warning(f"Job {job['id']} ({job.get('kind')}) -> {status}: {error}")
+        except Exception as e:
+            logger.error(f"Could not complete job {job['id']}: {e}")
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    if settings.BACKGROUND_MODE != "worker":
+        logger.warning("BACKGROUND_MODE is not 'worker': the API process also runs background jobs")
+
+    bot = create_bot()
+    # process_broadcast и уведомления о платежах используют Bot модулей API
+    admin_routes.set_broadcast_bot(bot)
+    webhooks.set_notification_bot(bot)
+    update_queue.start(dp, bot)
+
+    worker = JobWorker(bot, INSTANCE_ID, settings.WORKER_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:
+            pass
+
+    register_jobs(scheduler)
+    periodic = [
+        asyncio.create_task(scheduler.run()),
+        asyncio.create_task(run_cache_version_watcher()),
+    ]
+    logger.info(f"Worker {INSTANCE_ID} started: concurrency={worker.concurrency}")
+    try:
+        await worker.run()
+    finally:
+        for task in periodic:
+            task.cancel()
+        await asyncio.gather(*periodic, return_exceptions=True)
+        await update_queue.stop()
+        await bot.session.close()
+        await get_supabase().close()
+        logger.info("Worker stopped")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,16 @@
+-- Migration 017: content hash for yclients_visits, raw_payload becomes optional
+
+-- Хэш нормализованного содержимого визита: синхронизация пропускает
+-- запись, если визит в YClients не изменился
+ALTER TABLE yclients_visits
+ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- raw_payload дублировал нормализованные колонки. Теперь он пишется только
+-- при VISITS_STORE_RAW_PAYLOAD=true, существующие копии очищаем
+-- (место вернется после VACUUM)
+UPDATE yclients_visits
+SET raw_payload = NULL
+WHERE raw_payload IS NOT NULL;
+
+COMMENT ON COLUMN yclients_visits.content_hash IS 'SHA1 нормализованных полей визита для пропуска неизмененных записей';
+COMMENT ON COLUMN yclients_visits.raw_payload IS 'Опциональная копия нормализованного визита (VISITS_STORE_RAW_PAYLOAD)';
@@ -0,0 +1,331 @@
+-- Миграция 018: Материализованный доступный баланс пользователя
+-- Раньше get_user_available_balance каждый раз суммировал remaining_amount по
+-- всем активным 'earn'-транзакциям, а spend_loyalty_points вызывал его трижды.
+-- Теперь баланс хранится в loyalty_balances и поддерживается RPC-функциями
+-- (spend_loyalty_points, adjust_loyalty_balance). Чтение баланса - одна строка по PK.
+
+CREATE TABLE IF NOT EXISTS loyalty_balances (
+    user_id BIGINT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    available INT NOT NULL DEFAULT 0,            -- сумма remaining_amount по не истекшим 'earn'
+    next_expires_at TIMESTAMP WITH TIME ZONE,    -- ближайшее истечение среди остатков (NULL - нет баллов)
+    refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_loyalty_balances_next_expires ON loyalty_balances(next_expires_at)
+WHERE next_expires_at IS NOT NULL;
+
+-- Полный пересчет сводки пользователя по транзакциям (одно сканирование по индексу FIFO)
+CREATE OR REPLACE FUNCTION refresh_user_balance(p_user_id BIGINT)
+RETURNS INT AS $$
+DECLARE
+    v_available INT;
+    v_next_expires_at TIMESTAMP WITH TIME ZONE;
+BEGIN
+    SELECT COALESCE(SUM(remaining_amount), 0), MIN(expires_at)
+    INTO v_available, v_next_expires_at
+    FROM loyalty_transactions
+    WHERE user_id = p_user_id
+      AND transaction_type = 'earn'
+      AND expires_at > NOW()
+      AND remaining_amount > 0;
+
+    INSERT INTO loyalty_balances (user_id, available, next_expires_at, refreshed_at)
+    VALUES (p_user_id, v_available, v_next_expires_at, NOW())
+    ON CONFLICT (user_id) DO UPDATE
+    SET available = EXCLUDED.available,
+        next_expires_at = EXCLUDED.next_expires_at,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    RETURN v_available;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Ближайшее истечение среди оставшихся баллов (один проход по индексу idx_transactions_earn_fifo)
+CREATE OR REPLACE FUNCTION _next_loyalty_expiry(p_user_id BIGINT)
+RETURNS TIMESTAMP WITH TIME ZONE AS $$
+    SELECT expires_at
+    FROM loyalty_transactions
+    WHERE user_id = p_user_id
+      AND transaction_type = 'earn'
+      AND expires_at > NOW()
+      AND remaining_amount > 0
+    ORDER BY expires_at ASC
+    LIMIT 1;
+$$ LANGUAGE sql STABLE;
+
+-- Доступный баланс: чтение сводки. Если у пользователя еще нет строки или
+-- часть баллов уже истекла (next_expires_at в прошлом), сводка пересчитывается.
+CREATE OR REPLACE FUNCTION get_user_available_balance(p_user_id BIGINT)
+RETURNS INT AS $$
+DECLARE
+    v_available INT;
+    v_next_expires_at TIMESTAMP WITH TIME ZONE;
+BEGIN
+    SELECT available, next_expires_at
+    INTO v_available, v_next_expires_at
+    FROM loyalty_balances
+    WHERE user_id = p_user_id;
+
+    IF FOUND AND (v_next_expires_at IS NULL OR v_next_expires_at > NOW()) THEN
+        RETURN v_available;
+    END IF;
+
+    RETURN refresh_user_balance(p_user_id);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Актуализирует и блокирует строку сводки пользователя до конца транзакции.
+-- Сериализует списания/корректировки одного пользователя и возвращает доступный баланс.
+CREATE OR REPLACE FUNCTION _lock_user_balance(p_user_id BIGINT)
+RETURNS INT AS $$
+DECLARE
+    v_available INT;
+    v_next_expires_at TIMESTAMP WITH TIME ZONE;
+BEGIN
+    PERFORM get_user_available_balance(p_user_id);
+
+    SELECT available, next_expires_at
+    INTO v_available, v_next_expires_at
+    FROM loyalty_balances
+    WHERE user_id = p_user_id
+    FOR UPDATE;
+
+    -- Пока ждали блокировку, баллы могли истечь
+    IF v_next_expires_at IS NOT NULL AND v_next_expires_at <= NOW() THEN
+        v_available := refresh_user_balance(p_user_id);
+    END IF;
+
+    RETURN v_available;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Списание по FIFO: одна проверка баланса по сводке и один проход по остаткам
+CREATE OR REPLACE FUNCTION spend_loyalty_points(
+    p_user_id BIGINT,
+    p_amount_to_spend INT,
+    p_total_bill_amount INT,
+    p_max_spend_percentage FLOAT DEFAULT 0.3,
+    p_description TEXT DEFAULT NULL
+)
+RETURNS JSON AS $$
+DECLARE
+    v_max_allowed_spend INT;
+    v_available_balance INT;
+    v_new_balance INT;
+    v_remaining_to_spend INT;
+    v_transaction RECORD;
+    v_spent_from_transaction INT;
+BEGIN
+    -- Проверка: нельзя списать больше 30% от суммы чека
+    v_max_allowed_spend := FLOOR(p_total_bill_amount * p_max_spend_percentage);
+
+    IF p_amount_to_spend > v_max_allowed_spend THEN
+        RETURN json_build_object(
+            'success', false,
+            'error', format('Можно оплатить баллами максимум %s%% от суммы чека (максимум %s баллов)',
+                           (p_max_spend_percentage * 100)::INT, v_max_allowed_spend)
+        );
+    END IF;
+
+    -- Получаем доступный баланс из сводки (с блокировкой строки)
+    v_available_balance := _lock_user_balance(p_user_id);
+
+    IF p_amount_to_spend > v_available_balance THEN
+        RETURN json_build_object(
+            'success', false,
+            'error', format('Недостаточно баллов. Доступно: %s, требуется: %s',
+                           v_available_balance, p_amount_to_spend)
+        );
+    END IF;
+
+    -- Начинаем списание по FIFO (сначала самые старые баллы)
+    v_remaining_to_spend := p_amount_to_spend;
+
+    FOR v_transaction IN
+        SELECT id, remaining_amount
+        FROM loyalty_transactions
+        WHERE user_id = p_user_id
+          AND transaction_type = 'earn'
+          AND expires_at > NOW()
+          AND remaining_amount > 0
+        ORDER BY expires_at ASC, id ASC
+        FOR UPDATE
+    LOOP
+        v_spent_from_transaction := LEAST(v_transaction.remaining_amount, v_remaining_to_spend);
+
+        UPDATE loyalty_transactions
+        SET remaining_amount = remaining_amount - v_spent_from_transaction
+        WHERE id = v_transaction.id;
+
+        v_remaining_to_spend := v_remaining_to_spend - v_spent_from_transaction;
+        EXIT WHEN v_remaining_to_spend <= 0;
+    END LOOP;
+
+    -- Создаем транзакцию типа 'spend' для истории
+    INSERT INTO loyalty_transactions (
+        user_id,
+        amount,
+        transaction_type,
+        description,
+        remaining_amount
+    ) VALUES (
+        p_user_id,
+        -p_amount_to_spend,
+        'spend',
+        COALESCE(p_description, format('Списание %s баллов', p_amount_to_spend)),
+        0
+    );
+
+    -- Новый баланс считаем арифметически, без повторного суммирования
+    v_new_balance := v_available_balance - p_amount_to_spend;
+
+    UPDATE loyalty_balances
+    SET available = v_new_balance,
+        next_expires_at = _next_loyalty_expiry(p_user_id),
+        refreshed_at = NOW()
+    WHERE user_id = p_user_id;
+
+    UPDATE users
+    SET balance = v_new_balance,
+        updated_at = NOW()
+    WHERE id = p_user_id;
+
+    RETURN json_build_object(
+        'success', true,
+        'spent_amount', p_amount_to_spend,
+        'remaining_balance', v_new_balance
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Корректировка баланса с поддержкой сводки
+CREATE OR REPLACE FUNCTION adjust_loyalty_balance(
+    p_user_id BIGINT,
+    p_amount INT,
+    p_description TEXT,
+    p_expiration_days INT DEFAULT 90
+)
+RETURNS JSON AS $$
+DECLARE
+    v_available_balance INT;
+    v_new_balance INT;
+    v_next_expires_at TIMESTAMP WITH TIME ZONE;
+    v_remaining_to_burn INT;
+    v_transaction RECORD;
+    v_burned_from_transaction INT;
+    v_expires_at TIMESTAMP WITH TIME ZONE;
+BEGIN
+    v_available_balance := _lock_user_balance(p_user_id);
+    v_new_balance := v_available_balance;
+
+    IF p_amount > 0 THEN
+        -- Положительная корректировка: добавляем новую транзакцию типа 'earn'
+        v_expires_at := NOW() + (p_expiration_days || ' days')::INTERVAL;
+
+        INSERT INTO loyalty_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            description,
+            expires_at,
+            remaining_amount
+        ) VALUES (
+            p_user_id,
+            p_amount,
+            'earn',
+            p_description,
+            v_expires_at,
+            p_amount
+        );
+
+        v_new_balance := v_available_balance + p_amount;
+        SELECT LEAST(COALESCE(next_expires_at, v_expires_at), v_expires_at)
+        INTO v_next_expires_at
+        FROM loyalty_balances
+        WHERE user_id = p_user_id;
+    ELSIF p_amount < 0 THEN
+        -- Отрицательная корректировка: сжигаем баллы по FIFO (как spend, но без ограничений %)
+        v_remaining_to_burn := ABS(p_amount);
+
+        FOR v_transaction IN
+            SELECT id, remaining_amount
+            FROM loyalty_transactions
+            WHERE user_id = p_user_id
+              AND transaction_type = 'earn'
+              AND expires_at > NOW()
+              AND remaining_amount > 0
+            ORDER BY expires_at ASC, id ASC
+            FOR UPDATE
+        LOOP
+            v_burned_from_transaction := LEAST(v_transaction.remaining_amount, v_remaining_to_burn);
+
+            UPDATE loyalty_transactions
+            SET remaining_amount = remaining_amount - v_burned_from_transaction
+            WHERE id = v_transaction.id;
+
+            v_remaining_to_burn := v_remaining_to_burn - v_burned_from_transaction;
+            EXIT WHEN v_remaining_to_burn <= 0;
+        END LOOP;
+
+        -- Создаем транзакцию для истории
+        INSERT INTO loyalty_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            description,
+            remaining_amount
+        ) VALUES (
+            p_user_id,
+            p_amount,
+            'sync_correction',
+            p_description,
+            0
+        );
+
+        -- Сожгли не больше, чем было доступно
+        v_new_balance := v_available_balance - (ABS(p_amount) - v_remaining_to_burn);
+        v_next_expires_at := _next_loyalty_expiry(p_user_id);
+    ELSE
+        SELECT next_expires_at INTO v_next_expires_at
+        FROM loyalty_balances
+        WHERE user_id = p_user_id;
+    END IF;
+
+    UPDATE loyalty_balances
+    SET available = v_new_balance,
+        next_expires_at = v_next_expires_at,
+        refreshed_at = NOW()
+    WHERE user_id = p_user_id;
+
+    UPDATE users
+    SET balance = v_new_balance,
+        updated_at = NOW()
+    WHERE id = p_user_id;
+
+    RETURN json_build_object(
+        'success', true,
+        'new_balance', v_new_balance
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заполняем сводку для пользователей с активными баллами
+INSERT INTO loyalty_balances (user_id, available, next_expires_at, refreshed_at)
+SELECT user_id, SUM(remaining_amount), MIN(expires_at), NOW()
+FROM loyalty_transactions
+WHERE transaction_type = 'earn'
+  AND expires_at > NOW()
+  AND remaining_amount > 0
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET available = EXCLUDED.available,
+    next_expires_at = EXCLUDED.next_expires_at,
+    refreshed_at = EXCLUDED.refreshed_at;
+
+COMMENT ON TABLE loyalty_balances IS 'Сводка доступного баланса (поддерживается spend_loyalty_points/adjust_loyalty_balance)';
+COMMENT ON FUNCTION refresh_user_balance(BIGINT) IS 'Пересчитывает сводку loyalty_balances пользователя по транзакциям';
+COMMENT ON FUNCTION get_user_available_balance(BIGINT) IS
+'Возвращает актуальный баланс пользователя из сводки (пересчет при истечении баллов)';
+COMMENT ON FUNCTION spend_loyalty_points(BIGINT, INT, INT, FLOAT, TEXT) IS
+'Списывает баллы по принципу FIFO с проверкой лимита 30% от суммы чека';
+COMMENT ON FUNCTION adjust_loyalty_balance IS 'Корректирует баланс пользователя (начисление или списание) с сохранением целостности FIFO';
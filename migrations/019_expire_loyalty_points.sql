@@ -0,0 +1,108 @@
+-- Миграция 019: Пакетное сгорание баллов
+-- Истекшие баллы раньше отсекались только при чтении (expires_at > NOW()),
+-- а users.balance оставался устаревшим до следующей синхронизации.
+-- expire_loyalty_points обнуляет remaining_amount у истекших 'earn' пачками,
+-- пишет по одной транзакции 'expire' на пользователя и пересчитывает
+-- loyalty_balances / users.balance затронутых пользователей одним запросом.
+
+-- Индекс для поиска истекших остатков (строки с remaining_amount = 0 в него не попадают)
+CREATE INDEX IF NOT EXISTS idx_transactions_earn_expiring ON loyalty_transactions(expires_at)
+WHERE transaction_type = 'earn' AND remaining_amount > 0;
+
+CREATE OR REPLACE FUNCTION expire_loyalty_points(p_batch_size INT DEFAULT 1000)
+RETURNS JSON AS $$
+DECLARE
+    v_user_ids BIGINT[];
+    v_expired_rows INT;
+    v_expired_points INT;
+BEGIN
+    -- 1. Берем пачку истекших остатков (SKIP LOCKED - не ждем параллельный запуск),
+    --    обнуляем их и пишем историю по пользователям
+    WITH batch AS (
+        SELECT id, user_id, remaining_amount
+        FROM loyalty_transactions
+        WHERE transaction_type = 'earn'
+          AND remaining_amount > 0
+          AND expires_at <= NOW()
+        ORDER BY expires_at ASC, id ASC
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    ),
+    zeroed AS (
+        UPDATE loyalty_transactions t
+        SET remaining_amount = 0
+        FROM batch b
+        WHERE t.id = b.id
+        RETURNING b.user_id, b.remaining_amount AS expired_amount
+    ),
+    per_user AS (
+        SELECT user_id, SUM(expired_amount)::INT AS expired_amount, COUNT(*)::INT AS rows_count
+        FROM zeroed
+        GROUP BY user_id
+    ),
+    history AS (
+        INSERT INTO loyalty_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            description,
+            remaining_amount
+        )
+        SELECT
+            user_id,
+            -expired_amount,
+            'expire',
+            format('Сгорание %s баллов (истек срок действия)', expired_amount),
+            0
+        FROM per_user
+        RETURNING user_id
+    )
+    SELECT
+        array_agg(user_id),
+        COALESCE(SUM(rows_count), 0),
+        COALESCE(SUM(expired_amount), 0)
+    INTO v_user_ids, v_expired_rows, v_expired_points
+    FROM per_user;
+
+    IF v_user_ids IS NULL THEN
+        RETURN json_build_object('expired_rows', 0, 'expired_points', 0, 'users', 0);
+    END IF;
+
+    -- 2. Пересчитываем сводку затронутых пользователей одним запросом
+    INSERT INTO loyalty_balances (user_id, available, next_expires_at, refreshed_at)
+    SELECT
+        u.user_id,
+        COALESCE(SUM(t.remaining_amount), 0),
+        MIN(t.expires_at),
+        NOW()
+    FROM unnest(v_user_ids) AS u(user_id)
+    LEFT JOIN loyalty_transactions t
+        ON t.user_id = u.user_id
+       AND t.transaction_type = 'earn'
+       AND t.expires_at > NOW()
+       AND t.remaining_amount > 0
+    GROUP BY u.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET available = EXCLUDED.available,
+        next_expires_at = EXCLUDED.next_expires_at,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    -- 3. Переносим баланс в users (для рассылок by_balance и админки)
+    UPDATE users
+    SET balance = lb.available,
+        updated_at = NOW()
+    FROM loyalty_balances lb
+    WHERE lb.user_id = users.id
+      AND users.id = ANY(v_user_ids)
+      AND users.balance IS DISTINCT FROM lb.available;
+
+    RETURN json_build_object(
+        'expired_rows', v_expired_rows,
+        'expired_points', v_expired_points,
+        'users', array_length(v_user_ids, 1)
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION expire_loyalty_points(INT) IS
+'Сжигает истекшие баллы пачкой: обнуляет остатки, пишет транзакции expire и пересчитывает балансы';
@@ -0,0 +1,222 @@
+-- Миграция 020: Списание по FIFO одним UPDATE вместо цикла
+-- spend_loyalty_points и adjust_loyalty_balance проходили по 'earn'-транзакциям
+-- в PL/pgSQL-цикле и делали по одному UPDATE на строку. Теперь остатки
+-- списываются одним запросом: накопительная сумма remaining_amount в порядке
+-- FIFO (expires_at, id) показывает, какие строки обнуляются целиком, а какая
+-- списывается частично.
+--
+-- Замер: bench/fifo_burn/run.sh
+
+-- Списывает до p_amount баллов по FIFO. Возвращает фактически списанную сумму
+-- (меньше p_amount, если баллов не хватило). Вызывать после _lock_user_balance.
+CREATE OR REPLACE FUNCTION _burn_loyalty_fifo(p_user_id BIGINT, p_amount INT)
+RETURNS INT AS $$
+DECLARE
+    v_burned INT;
+BEGIN
+    IF p_amount IS NULL OR p_amount <= 0 THEN
+        RETURN 0;
+    END IF;
+
+    -- FOR UPDATE нельзя совмещать с оконной функцией, поэтому блокировка в отдельном CTE
+    WITH locked AS (
+        SELECT id, remaining_amount, expires_at
+        FROM loyalty_transactions
+        WHERE user_id = p_user_id
+          AND transaction_type = 'earn'
+          AND expires_at > NOW()
+          AND remaining_amount > 0
+        FOR UPDATE
+    ),
+    ordered AS (
+        SELECT
+            id,
+            remaining_amount,
+            SUM(remaining_amount) OVER (ORDER BY expires_at ASC, id ASC) AS running_total
+        FROM locked
+    ),
+    burned AS (
+        UPDATE loyalty_transactions t
+        SET remaining_amount = CASE
+                WHEN o.running_total <= p_amount THEN 0
+                ELSE (o.running_total - p_amount)::INT
+            END
+        FROM ordered o
+        WHERE t.id = o.id
+          -- строки, до которых списание доходит (предыдущие остатки меньше суммы)
+          AND o.running_total - o.remaining_amount < p_amount
+        RETURNING o.remaining_amount - t.remaining_amount AS burned_amount
+    )
+    SELECT COALESCE(SUM(burned_amount), 0)::INT
+    INTO v_burned
+    FROM burned;
+
+    RETURN v_burned;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Списание по FIFO с проверкой лимита от суммы чека
+CREATE OR REPLACE FUNCTION spend_loyalty_points(
+    p_user_id BIGINT,
+    p_amount_to_spend INT,
+    p_total_bill_amount INT,
+    p_max_spend_percentage FLOAT DEFAULT 0.3,
+    p_description TEXT DEFAULT NULL
+)
+RETURNS JSON AS $$
+DECLARE
+    v_max_allowed_spend INT;
+    v_available_balance INT;
+    v_new_balance INT;
+BEGIN
+    -- Проверка: нельзя списать больше 30% от суммы чека
+    v_max_allowed_spend := FLOOR(p_total_bill_amount * p_max_spend_percentage);
+
+    IF p_amount_to_spend > v_max_allowed_spend THEN
+        RETURN json_build_object(
+            'success', false,
+            'error', format('Можно оплатить баллами максимум %s%% от суммы чека (максимум %s баллов)',
+                           (p_max_spend_percentage * 100)::INT, v_max_allowed_spend)
+        );
+    END IF;
+
+    -- Получаем доступный баланс из сводки (с блокировкой строки)
+    v_available_balance := _lock_user_balance(p_user_id);
+
+    IF p_amount_to_spend > v_available_balance THEN
+        RETURN json_build_object(
+            'success', false,
+            'error', format('Недостаточно баллов. Доступно: %s, требуется: %s',
+                           v_available_balance, p_amount_to_spend)
+        );
+    END IF;
+
+    PERFORM _burn_loyalty_fifo(p_user_id, p_amount_to_spend);
+
+    -- Создаем транзакцию типа 'spend' для истории
+    INSERT INTO loyalty_transactions (
+        user_id,
+        amount,
+        transaction_type,
+        description,
+        remaining_amount
+    ) VALUES (
+        p_user_id,
+        -p_amount_to_spend,
+        'spend',
+        COALESCE(p_description, format('Списание %s баллов', p_amount_to_spend)),
+        0
+    );
+
+    v_new_balance := v_available_balance - p_amount_to_spend;
+
+    UPDATE loyalty_balances
+    SET available = v_new_balance,
+        next_expires_at = _next_loyalty_expiry(p_user_id),
+        refreshed_at = NOW()
+    WHERE user_id = p_user_id;
+
+    UPDATE users
+    SET balance = v_new_balance,
+        updated_at = NOW()
+    WHERE id = p_user_id;
+
+    RETURN json_build_object(
+        'success', true,
+        'spent_amount', p_amount_to_spend,
+        'remaining_balance', v_new_balance
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Корректировка баланса (начисление или списание по FIFO без ограничения %)
+CREATE OR REPLACE FUNCTION adjust_loyalty_balance(
+    p_user_id BIGINT,
+    p_amount INT,
+    p_description TEXT,
+    p_expiration_days INT DEFAULT 90
+)
+RETURNS JSON AS $$
+DECLARE
+    v_available_balance INT;
+    v_new_balance INT;
+    v_next_expires_at TIMESTAMP WITH TIME ZONE;
+    v_expires_at TIMESTAMP WITH TIME ZONE;
+BEGIN
+    v_available_balance := _lock_user_balance(p_user_id);
+    v_new_balance := v_available_balance;
+
+    IF p_amount > 0 THEN
+        -- Положительная корректировка: добавляем новую транзакцию типа 'earn'
+        v_expires_at := NOW() + (p_expiration_days || ' days')::INTERVAL;
+
+        INSERT INTO loyalty_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            description,
+            expires_at,
+            remaining_amount
+        ) VALUES (
+            p_user_id,
+            p_amount,
+            'earn',
+            p_description,
+            v_expires_at,
+            p_amount
+        );
+
+        v_new_balance := v_available_balance + p_amount;
+        SELECT LEAST(COALESCE(next_expires_at, v_expires_at), v_expires_at)
+        INTO v_next_expires_at
+        FROM loyalty_balances
+        WHERE user_id = p_user_id;
+    ELSIF p_amount < 0 THEN
+        -- Отрицательная корректировка: сжигаем баллы по FIFO одним UPDATE
+        v_new_balance := v_available_balance - _burn_loyalty_fifo(p_user_id, ABS(p_amount));
+
+        -- Создаем транзакцию для истории
+        INSERT INTO loyalty_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            description,
+            remaining_amount
+        ) VALUES (
+            p_user_id,
+            p_amount,
+            'sync_correction',
+            p_description,
+            0
+        );
+
+        v_next_expires_at := _next_loyalty_expiry(p_user_id);
+    ELSE
+        SELECT next_expires_at INTO v_next_expires_at
+        FROM loyalty_balances
+        WHERE user_id = p_user_id;
+    END IF;
+
+    UPDATE loyalty_balances
+    SET available = v_new_balance,
+        next_expires_at = v_next_expires_at,
+        refreshed_at = NOW()
+    WHERE user_id = p_user_id;
+
+    UPDATE users
+    SET balance = v_new_balance,
+        updated_at = NOW()
+    WHERE id = p_user_id;
+
+    RETURN json_build_object(
+        'success', true,
+        'new_balance', v_new_balance
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION _burn_loyalty_fifo(BIGINT, INT) IS
+'Списывает баллы по FIFO одним UPDATE (накопительная сумма по expires_at, id)';
+COMMENT ON FUNCTION spend_loyalty_points(BIGINT, INT, INT, FLOAT, TEXT) IS
+'Списывает баллы по принципу FIFO с проверкой лимита 30% от суммы чека';
+COMMENT ON FUNCTION adjust_loyalty_balance IS 'Корректирует баланс пользователя (начисление или списание) с сохранением целостности FIFO';
@@ -0,0 +1,20 @@
+-- Миграция 021: Адаптивные варианты изображений (thumb/card/full в WebP и JPEG)
+
+-- Варианты загруженного оригинала. Ключ - путь оригинала в бакете,
+-- а не URL: публичный URL может переписываться (rewrite_storage_public_url)
+CREATE TABLE IF NOT EXISTS media_variants (
+    source_path TEXT PRIMARY KEY,
+    variants JSONB NOT NULL,                     -- {"webp": {"card": {"url", "width", "height"}, ...}, "jpeg": {...}}
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Варианты картинок строки по полям: {"image_url": {...}, "photo_url": {...}}
+-- Заполняется админкой при сохранении, /api/app/content строит из них srcset
+ALTER TABLE services ADD COLUMN IF NOT EXISTS image_variants JSONB;
+ALTER TABLE masters ADD COLUMN IF NOT EXISTS image_variants JSONB;
+ALTER TABLE promotions ADD COLUMN IF NOT EXISTS image_variants JSONB;
+
+COMMENT ON TABLE media_variants IS 'Уменьшенные WebP/JPEG копии изображений, загруженных через /api/admin/upload';
+COMMENT ON COLUMN services.image_variants IS 'Варианты image_url/photo_url из media_variants';
+COMMENT ON COLUMN masters.image_variants IS 'Варианты image_url/photo_url из media_variants';
+COMMENT ON COLUMN promotions.image_variants IS 'Варианты image_url/photo_url из media_variants';
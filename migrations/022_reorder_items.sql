@@ -0,0 +1,117 @@
+-- Миграция 022: Изменение порядка мастеров, услуг и акций одним запросом
+-- Раньше перемещение делалось из API несколькими запросами (чтение строки и всей таблицы,
+-- нормализация order по одной строке, два UPDATE для обмена, проверочный SELECT),
+-- а параллельные перемещения могли перезаписать друг друга.
+-- reorder_items сдвигает элемент на одну позицию, set_items_order задает порядок списком id
+-- (после drag-and-drop). Обе функции работают в одной транзакции, берут advisory lock
+-- на таблицу и перенумеровывают order плотно (0..n-1), меняя только изменившиеся строки.
+
+-- Применяет порядок p_ids (позиция в массиве = order) и возвращает число измененных строк
+CREATE OR REPLACE FUNCTION _apply_items_order(p_table TEXT, p_ids BIGINT[])
+RETURNS INT AS $$
+DECLARE
+    v_updated INT;
+BEGIN
+    EXECUTE format(
+        'UPDATE %I t
+         SET "order" = o.pos - 1
+         FROM unnest($1) WITH ORDINALITY AS o(id, pos)
+         WHERE t.id = o.id AND t."order" IS DISTINCT FROM (o.pos - 1)::INT',
+        p_table
+    ) USING p_ids;
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Текущий порядок таблицы (как в списках админки: order, затем id; без order - в конце)
+CREATE OR REPLACE FUNCTION _current_items_order(p_table TEXT)
+RETURNS BIGINT[] AS $$
+DECLARE
+    v_ids BIGINT[];
+BEGIN
+    IF p_table NOT IN ('masters', 'services', 'promotions') THEN
+        RAISE EXCEPTION 'Table % does not support ordering', p_table;
+    END IF;
+    -- Параллельные перемещения в одной таблице выполняются по очереди
+    PERFORM pg_advisory_xact_lock(hashtext('reorder_items:' || p_table));
+    EXECUTE format('SELECT array_agg(id ORDER BY "order" ASC NULLS LAST, id ASC) FROM %I', p_table)
+    INTO v_ids;
+    RETURN COALESCE(v_ids, ARRAY[]::BIGINT[]);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Сдвиг элемента на одну позицию вверх ('up') или вниз ('down')
+CREATE OR REPLACE FUNCTION reorder_items(p_table TEXT, p_id BIGINT, p_direction TEXT)
+RETURNS JSON AS $$
+DECLARE
+    v_ids BIGINT[];
+    v_pos INT;
+    v_target INT;
+BEGIN
+    IF p_direction NOT IN ('up', 'down') THEN
+        RAISE EXCEPTION 'Invalid direction: %', p_direction;
+    END IF;
+
+    v_ids := _current_items_order(p_table);
+    v_pos := array_position(v_ids, p_id);
+    IF v_pos IS NULL THEN
+        RETURN json_build_object('status', 'not_found');
+    END IF;
+
+    v_target := CASE WHEN p_direction = 'up' THEN v_pos - 1 ELSE v_pos + 1 END;
+    IF v_target < 1 OR v_target > array_length(v_ids, 1) THEN
+        RETURN json_build_object('status', 'edge');
+    END IF;
+
+    v_ids[v_pos] := v_ids[v_target];
+    v_ids[v_target] := p_id;
+
+    RETURN json_build_object(
+        'status', 'ok',
+        'updated', _apply_items_order(p_table, v_ids),
+        'position', v_target - 1
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Порядок списком id: перечисленные идут первыми в заданном порядке,
+-- остальные (например, добавленные параллельно) - после них в прежнем порядке
+CREATE OR REPLACE FUNCTION set_items_order(p_table TEXT, p_ids BIGINT[])
+RETURNS JSON AS $$
+DECLARE
+    v_current BIGINT[];
+    v_ids BIGINT[];
+BEGIN
+    IF p_ids IS NULL OR cardinality(p_ids) = 0 THEN
+        RAISE EXCEPTION 'Ids list is required';
+    END IF;
+    IF cardinality(p_ids) <> (SELECT COUNT(DISTINCT id) FROM unnest(p_ids) AS u(id)) THEN
+        RAISE EXCEPTION 'Ids list contains duplicates';
+    END IF;
+
+    v_current := _current_items_order(p_table);
+
+    SELECT array_agg(id ORDER BY grp, pos)
+    INTO v_ids
+    FROM (
+        SELECT u.id, 0 AS grp, u.pos
+        FROM unnest(p_ids) WITH ORDINALITY AS u(id, pos)
+        WHERE u.id = ANY(v_current)
+        UNION ALL
+        SELECT c.id, 1 AS grp, c.pos
+        FROM unnest(v_current) WITH ORDINALITY AS c(id, pos)
+        WHERE NOT (c.id = ANY(p_ids))
+    ) ordered;
+
+    RETURN json_build_object(
+        'status', 'ok',
+        'updated', _apply_items_order(p_table, COALESCE(v_ids, ARRAY[]::BIGINT[])),
+        'unknown_ids', (
+            SELECT COALESCE(json_agg(u.id), '[]'::json)
+            FROM unnest(p_ids) AS u(id)
+            WHERE NOT (u.id = ANY(v_current))
+        )
+    );
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,88 @@
+-- Миграция 023: Пакетное обновление строк одним запросом
+-- bulk_patch(table, rows) принимает JSON-массив объектов {"id": ..., "<колонка>": ...}
+-- и применяет его одним UPDATE ... FROM jsonb_to_recordset вместо отдельного PATCH на строку
+-- (например, сохранение порядка кнопок меню: 20 кнопок - один запрос вместо двадцати).
+-- Таблицы и колонки ограничены белым списком; все объекты должны содержать одинаковый набор колонок.
+
+-- Белый список колонок bulk_patch; NULL - таблица не поддерживается.
+-- Следующие миграции расширяют список, заменяя только эту функцию
+CREATE OR REPLACE FUNCTION _bulk_patch_allowed_columns(p_table TEXT)
+RETURNS TEXT[] AS $$
+    SELECT CASE p_table
+        WHEN 'bot_buttons' THEN ARRAY['row_number', 'order_in_row', 'is_active']
+        WHEN 'masters' THEN ARRAY['order']
+        WHEN 'services' THEN ARRAY['order', 'is_active']
+        WHEN 'promotions' THEN ARRAY['order', 'is_active']
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION bulk_patch(p_table TEXT, p_rows JSONB)
+RETURNS JSON AS $$
+DECLARE
+    v_allowed TEXT[];
+    v_columns TEXT[];
+    v_bad_columns TEXT[];
+    v_definitions TEXT;
+    v_assignments TEXT;
+    v_updated INT;
+BEGIN
+    v_allowed := _bulk_patch_allowed_columns(p_table);
+    IF v_allowed IS NULL THEN
+        RAISE EXCEPTION 'Table % does not support bulk_patch', p_table;
+    END IF;
+    IF p_rows IS NULL OR jsonb_typeof(p_rows) <> 'array' OR jsonb_array_length(p_rows) = 0 THEN
+        RETURN json_build_object('updated', 0);
+    END IF;
+
+    SELECT array_agg(DISTINCT key ORDER BY key)
+    INTO v_columns
+    FROM jsonb_array_elements(p_rows) AS r(item), jsonb_object_keys(r.item) AS key
+    WHERE key <> 'id';
+
+    IF v_columns IS NULL THEN
+        RAISE EXCEPTION 'Rows contain no columns to update';
+    END IF;
+    SELECT array_agg(c) INTO v_bad_columns FROM unnest(v_columns) AS c WHERE NOT (c = ANY(v_allowed));
+    IF v_bad_columns IS NOT NULL THEN
+        RAISE EXCEPTION 'Columns % are not allowed for %', v_bad_columns, p_table;
+    END IF;
+    IF EXISTS (
+        SELECT 1 FROM jsonb_array_elements(p_rows) AS r(item)
+        WHERE NOT (r.item ? 'id') OR NOT (r.item ?& v_columns)
+    ) THEN
+        RAISE EXCEPTION 'Every row must contain id and the same columns: %', v_columns;
+    END IF;
+    -- Колонка из белого списка, которой нет в таблице, - ошибка, а не молчаливый пропуск
+    SELECT array_agg(c) INTO v_bad_columns
+    FROM unnest(v_columns) AS c
+    WHERE NOT EXISTS (
+        SELECT 1 FROM pg_attribute a
+        WHERE a.attrelid = p_table::regclass
+          AND a.attnum > 0
+          AND NOT a.attisdropped
+          AND a.attname = c
+    );
+    IF v_bad_columns IS NOT NULL THEN
+        RAISE EXCEPTION 'Columns % do not exist in %', v_bad_columns, p_table;
+    END IF;
+
+    -- Типы колонок берем из самой таблицы
+    SELECT
+        string_agg(format('%I %s', a.attname, format_type(a.atttypid, a.atttypmod)), ', '),
+        string_agg(format('%I = r.%I', a.attname, a.attname), ', ') FILTER (WHERE a.attname <> 'id')
+    INTO v_definitions, v_assignments
+    FROM pg_attribute a
+    WHERE a.attrelid = p_table::regclass
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+      AND a.attname = ANY(v_columns || ARRAY['id']);
+
+    EXECUTE format(
+        'UPDATE %I t SET %s FROM jsonb_to_recordset($1) AS r(%s) WHERE t.id = r.id',
+        p_table, v_assignments, v_definitions
+    ) USING p_rows;
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+
+    RETURN json_build_object('updated', v_updated);
+END;
+$$ LANGUAGE plpgsql;
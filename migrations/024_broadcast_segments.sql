@@ -0,0 +1,195 @@
+-- Миграция 024: Сегменты получателей рассылок
+-- Раньше получатели выбирались четырьмя захардкоженными запросами, а фильтр по балансу
+-- смотрел на users.balance, который мог устареть до следующей синхронизации.
+-- Теперь сегмент - JSON с условиями (см. bot/services/segments.py), который
+-- select_segment_users проверяет одним запросом по users, loyalty_balances
+-- и сводке визитов user_visit_stats.
+-- user_visit_stats пересчитывается триггером только для пользователей,
+-- чьи визиты изменились в yclients_visits.
+
+CREATE TABLE IF NOT EXISTS user_visit_stats (
+    user_id BIGINT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    visit_count INT NOT NULL DEFAULT 0,              -- состоявшиеся визиты
+    total_spent NUMERIC NOT NULL DEFAULT 0,          -- сумма состоявшихся визитов
+    first_visit_at TIMESTAMP WITH TIME ZONE,
+    last_visit_at TIMESTAMP WITH TIME ZONE,
+    masters TEXT[] NOT NULL DEFAULT '{}',            -- мастера, у которых был клиент
+    services TEXT[] NOT NULL DEFAULT '{}',           -- названия оказанных услуг
+    refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_visit_stats_last_visit ON user_visit_stats(last_visit_at);
+CREATE INDEX IF NOT EXISTS idx_user_visit_stats_masters ON user_visit_stats USING GIN (masters);
+CREATE INDEX IF NOT EXISTS idx_user_visit_stats_services ON user_visit_stats USING GIN (services);
+
+-- Пересчет сводки для списка пользователей (учитываются только состоявшиеся визиты)
+CREATE OR REPLACE FUNCTION refresh_user_visit_stats(p_user_ids BIGINT[])
+RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    IF p_user_ids IS NULL OR cardinality(p_user_ids) = 0 THEN
+        RETURN 0;
+    END IF;
+
+    WITH targets AS (
+        SELECT DISTINCT u.id
+        FROM unnest(p_user_ids) AS t(id)
+        JOIN users u ON u.id = t.id
+    ),
+    visits AS (
+        SELECT v.user_id, v.visit_datetime, v.amount, v.master, v.services
+        FROM yclients_visits v
+        JOIN targets t ON t.id = v.user_id
+        WHERE v.status = 'Визит состоялся'
+    ),
+    totals AS (
+        SELECT
+            t.id AS user_id,
+            COUNT(v.user_id)::INT AS visit_count,
+            COALESCE(SUM(v.amount), 0) AS total_spent,
+            MIN(v.visit_datetime) AS first_visit_at,
+            MAX(v.visit_datetime) AS last_visit_at,
+            COALESCE(
+                array_agg(DISTINCT v.master) FILTER (WHERE v.master IS NOT NULL AND v.master <> ''),
+                '{}'
+            ) AS masters
+        FROM targets t
+        LEFT JOIN visits v ON v.user_id = t.id
+        GROUP BY t.id
+    ),
+    service_names AS (
+        SELECT v.user_id, array_agg(DISTINCT s.name) AS services
+        FROM visits v
+        CROSS JOIN LATERAL jsonb_array_elements_text(
+            CASE WHEN jsonb_typeof(v.services) = 'array' THEN v.services ELSE '[]'::jsonb END
+        ) AS s(name)
+        WHERE s.name <> ''
+        GROUP BY v.user_id
+    )
+    INSERT INTO user_visit_stats (
+        user_id, visit_count, total_spent, first_visit_at, last_visit_at, masters, services, refreshed_at
+    )
+    SELECT
+        t.user_id, t.visit_count, t.total_spent, t.first_visit_at, t.last_visit_at,
+        t.masters, COALESCE(sn.services, '{}'), NOW()
+    FROM totals t
+    LEFT JOIN service_names sn ON sn.user_id = t.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET visit_count = EXCLUDED.visit_count,
+        total_spent = EXCLUDED.total_spent,
+        first_visit_at = EXCLUDED.first_visit_at,
+        last_visit_at = EXCLUDED.last_visit_at,
+        masters = EXCLUDED.masters,
+        services = EXCLUDED.services,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггер уровня statement: один пересчет на пачку upsert-ов синхронизации визитов
+CREATE OR REPLACE FUNCTION _yclients_visits_refresh_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_user_visit_stats(ARRAY(SELECT DISTINCT user_id FROM new_rows));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM refresh_user_visit_stats(ARRAY(
+            SELECT user_id FROM new_rows UNION SELECT user_id FROM old_rows
+        ));
+    ELSE
+        PERFORM refresh_user_visit_stats(ARRAY(SELECT DISTINCT user_id FROM old_rows));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_yclients_visits_stats_insert ON yclients_visits;
+CREATE TRIGGER trg_yclients_visits_stats_insert
+    AFTER INSERT ON yclients_visits
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION _yclients_visits_refresh_stats();
+
+DROP TRIGGER IF EXISTS trg_yclients_visits_stats_update ON yclients_visits;
+CREATE TRIGGER trg_yclients_visits_stats_update
+    AFTER UPDATE ON yclients_visits
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION _yclients_visits_refresh_stats();
+
+DROP TRIGGER IF EXISTS trg_yclients_visits_stats_delete ON yclients_visits;
+CREATE TRIGGER trg_yclients_visits_stats_delete
+    AFTER DELETE ON yclients_visits
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION _yclients_visits_refresh_stats();
+
+-- Начальное заполнение по уже сохраненным визитам
+SELECT refresh_user_visit_stats(ARRAY(SELECT DISTINCT user_id FROM yclients_visits));
+
+-- Сегмент рассылки (используется вместо recipient_type/filter_* для новых рассылок)
+ALTER TABLE broadcasts ADD COLUMN IF NOT EXISTS segment JSONB;
+
+-- Пользователи сегмента. Пустой сегмент - все пользователи.
+-- Ключи (все необязательные, условия объединяются через AND):
+--   balance_min/balance_max          - доступные баллы (loyalty_balances), включительно
+--   registered_from/registered_to    - users.created_at, [from, to)
+--   last_visit_from/last_visit_to    - последний состоявшийся визит, [from, to)
+--   visits_min/visits_max            - число состоявшихся визитов, включительно
+--   spent_min/spent_max              - сумма состоявшихся визитов, включительно
+--   masters/services                 - был хотя бы у одного из мастеров / хотя бы одна из услуг
+-- Возвращает {"count": N} или {"count": N, "tg_ids": [...]}
+CREATE OR REPLACE FUNCTION select_segment_users(p_segment JSONB DEFAULT '{}'::jsonb, p_count_only BOOLEAN DEFAULT FALSE)
+RETURNS JSON AS $$
+DECLARE
+    v_segment JSONB := COALESCE(p_segment, '{}'::jsonb);
+    v_masters TEXT[];
+    v_services TEXT[];
+    v_result JSON;
+BEGIN
+    IF jsonb_typeof(v_segment->'masters') = 'array' AND jsonb_array_length(v_segment->'masters') > 0 THEN
+        v_masters := ARRAY(SELECT jsonb_array_elements_text(v_segment->'masters'));
+    END IF;
+    IF jsonb_typeof(v_segment->'services') = 'array' AND jsonb_array_length(v_segment->'services') > 0 THEN
+        v_services := ARRAY(SELECT jsonb_array_elements_text(v_segment->'services'));
+    END IF;
+
+    WITH matched AS (
+        SELECT u.tg_id
+        FROM users u
+        LEFT JOIN loyalty_balances lb ON lb.user_id = u.id
+        LEFT JOIN user_visit_stats s ON s.user_id = u.id
+        WHERE u.tg_id IS NOT NULL
+          AND (v_segment->>'balance_min' IS NULL
+               OR COALESCE(lb.available, u.balance, 0) >= (v_segment->>'balance_min')::INT)
+          AND (v_segment->>'balance_max' IS NULL
+               OR COALESCE(lb.available, u.balance, 0) <= (v_segment->>'balance_max')::INT)
+          AND (v_segment->>'registered_from' IS NULL
+               OR u.created_at >= (v_segment->>'registered_from')::TIMESTAMPTZ)
+          AND (v_segment->>'registered_to' IS NULL
+               OR u.created_at < (v_segment->>'registered_to')::TIMESTAMPTZ)
+          AND (v_segment->>'last_visit_from' IS NULL
+               OR s.last_visit_at >= (v_segment->>'last_visit_from')::TIMESTAMPTZ)
+          AND (v_segment->>'last_visit_to' IS NULL
+               OR s.last_visit_at < (v_segment->>'last_visit_to')::TIMESTAMPTZ)
+          AND (v_segment->>'visits_min' IS NULL
+               OR COALESCE(s.visit_count, 0) >= (v_segment->>'visits_min')::INT)
+          AND (v_segment->>'visits_max' IS NULL
+               OR COALESCE(s.visit_count, 0) <= (v_segment->>'visits_max')::INT)
+          AND (v_segment->>'spent_min' IS NULL
+               OR COALESCE(s.total_spent, 0) >= (v_segment->>'spent_min')::NUMERIC)
+          AND (v_segment->>'spent_max' IS NULL
+               OR COALESCE(s.total_spent, 0) <= (v_segment->>'spent_max')::NUMERIC)
+          AND (v_masters IS NULL OR s.masters && v_masters)
+          AND (v_services IS NULL OR s.services && v_services)
+    )
+    SELECT CASE
+        WHEN p_count_only THEN json_build_object('count', COUNT(*))
+        ELSE json_build_object('count', COUNT(*), 'tg_ids', COALESCE(json_agg(tg_id ORDER BY tg_id), '[]'::json))
+    END
+    INTO v_result
+    FROM matched;
+
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql STABLE;
@@ -0,0 +1,131 @@
+-- Миграция 025: Любимый мастер и услуги в сводке визитов
+-- user_visit_stats (миграция 024) дополняется top_master и top_services, чтобы профиль,
+-- сегменты и список пользователей в админке читали "историю клиента" одной строкой
+-- вместо сканирования yclients_visits или запросов в YClients.
+-- Сводка по-прежнему пересчитывается триггерами на yclients_visits; для полного
+-- пересчета (в том числе пользователей без визитов) - refresh_visit_stats_batch
+-- и скрипт scripts/backfill_visit_stats.py.
+
+ALTER TABLE user_visit_stats ADD COLUMN IF NOT EXISTS top_master TEXT;
+ALTER TABLE user_visit_stats ADD COLUMN IF NOT EXISTS top_services TEXT[] NOT NULL DEFAULT '{}';
+
+-- Пересчет сводки для списка пользователей (учитываются только состоявшиеся визиты).
+-- top_master - мастер с наибольшим числом визитов (при равенстве - с более поздним визитом),
+-- top_services - до трех самых частых услуг
+CREATE OR REPLACE FUNCTION refresh_user_visit_stats(p_user_ids BIGINT[])
+RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    IF p_user_ids IS NULL OR cardinality(p_user_ids) = 0 THEN
+        RETURN 0;
+    END IF;
+
+    WITH targets AS (
+        SELECT DISTINCT u.id
+        FROM unnest(p_user_ids) AS t(id)
+        JOIN users u ON u.id = t.id
+    ),
+    visits AS (
+        SELECT v.user_id, v.visit_datetime, v.amount, v.master, v.services
+        FROM yclients_visits v
+        JOIN targets t ON t.id = v.user_id
+        WHERE v.status = 'Визит состоялся'
+    ),
+    totals AS (
+        SELECT
+            t.id AS user_id,
+            COUNT(v.user_id)::INT AS visit_count,
+            COALESCE(SUM(v.amount), 0) AS total_spent,
+            MIN(v.visit_datetime) AS first_visit_at,
+            MAX(v.visit_datetime) AS last_visit_at,
+            COALESCE(
+                array_agg(DISTINCT v.master) FILTER (WHERE v.master IS NOT NULL AND v.master <> ''),
+                '{}'
+            ) AS masters
+        FROM targets t
+        LEFT JOIN visits v ON v.user_id = t.id
+        GROUP BY t.id
+    ),
+    master_counts AS (
+        SELECT DISTINCT ON (user_id) user_id, master
+        FROM (
+            SELECT user_id, master, COUNT(*) AS visits, MAX(visit_datetime) AS last_at
+            FROM visits
+            WHERE master IS NOT NULL AND master <> ''
+            GROUP BY user_id, master
+        ) m
+        ORDER BY user_id, visits DESC, last_at DESC NULLS LAST, master
+    ),
+    service_counts AS (
+        SELECT v.user_id, s.name, COUNT(*) AS uses
+        FROM visits v
+        CROSS JOIN LATERAL jsonb_array_elements_text(
+            CASE WHEN jsonb_typeof(v.services) = 'array' THEN v.services ELSE '[]'::jsonb END
+        ) AS s(name)
+        WHERE s.name <> ''
+        GROUP BY v.user_id, s.name
+    ),
+    service_names AS (
+        SELECT
+            user_id,
+            array_agg(name ORDER BY name) AS services,
+            (array_agg(name ORDER BY uses DESC, name))[1:3] AS top_services
+        FROM service_counts
+        GROUP BY user_id
+    )
+    INSERT INTO user_visit_stats (
+        user_id, visit_count, total_spent, first_visit_at, last_visit_at,
+        masters, services, top_master, top_services, refreshed_at
+    )
+    SELECT
+        t.user_id, t.visit_count, t.total_spent, t.first_visit_at, t.last_visit_at,
+        t.masters, COALESCE(sn.services, '{}'), mc.master, COALESCE(sn.top_services, '{}'), NOW()
+    FROM totals t
+    LEFT JOIN service_names sn ON sn.user_id = t.user_id
+    LEFT JOIN master_counts mc ON mc.user_id = t.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET visit_count = EXCLUDED.visit_count,
+        total_spent = EXCLUDED.total_spent,
+        first_visit_at = EXCLUDED.first_visit_at,
+        last_visit_at = EXCLUDED.last_visit_at,
+        masters = EXCLUDED.masters,
+        services = EXCLUDED.services,
+        top_master = EXCLUDED.top_master,
+        top_services = EXCLUDED.top_services,
+        refreshed_at = EXCLUDED.refreshed_at;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пересчет пачки пользователей по id (keyset-пагинация для бэкфилла).
+-- Возвращает {"refreshed": N, "last_id": id последнего пользователя пачки или NULL}
+CREATE OR REPLACE FUNCTION refresh_visit_stats_batch(p_after_id BIGINT DEFAULT 0, p_batch_size INT DEFAULT 500)
+RETURNS JSON AS $$
+DECLARE
+    v_ids BIGINT[];
+BEGIN
+    SELECT array_agg(id ORDER BY id)
+    INTO v_ids
+    FROM (
+        SELECT id FROM users
+        WHERE id > COALESCE(p_after_id, 0)
+        ORDER BY id
+        LIMIT GREATEST(p_batch_size, 1)
+    ) batch;
+
+    IF v_ids IS NULL THEN
+        RETURN json_build_object('refreshed', 0, 'last_id', NULL);
+    END IF;
+
+    RETURN json_build_object(
+        'refreshed', refresh_user_visit_stats(v_ids),
+        'last_id', v_ids[cardinality(v_ids)]
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заполняем новые колонки по уже сохраненным визитам
+SELECT refresh_user_visit_stats(ARRAY(SELECT DISTINCT user_id FROM yclients_visits));
@@ -0,0 +1,106 @@
+-- Миграция 026: Аренда фоновых задач и версии кэшей для нескольких воркеров
+-- Фоновые циклы (синхронизация YClients, запланированные рассылки, сгорание баллов)
+-- запускаются в каждом процессе API; при нескольких воркерах uvicorn или репликах
+-- это дает повторные синхронизации и двойную отправку рассылок.
+-- try_acquire_job_lease выдает аренду задачи одному экземпляру на p_ttl_seconds;
+-- владелец продлевает ее, остальные получают FALSE, пока аренда не истечет.
+-- Сессионные advisory lock через PostgREST не удержать (каждый RPC - отдельная
+-- транзакция на общем соединении), поэтому владелец хранится в job_leases,
+-- а pg_try_advisory_xact_lock сериализует конкурирующие попытки захвата.
+--
+-- cache_versions - счетчики версий кэшей (settings, menu, catalog). Триггеры
+-- увеличивают версию при любом изменении исходных таблиц, а каждый воркер
+-- периодически читает версии и сбрасывает свои локальные кэши.
+
+CREATE TABLE IF NOT EXISTS job_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    acquired_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Захват или продление аренды задачи. TRUE - p_holder владеет арендой до NOW() + p_ttl_seconds
+CREATE OR REPLACE FUNCTION try_acquire_job_lease(p_name TEXT, p_holder TEXT, p_ttl_seconds INT DEFAULT 60)
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_holder TEXT;
+BEGIN
+    IF p_name IS NULL OR p_holder IS NULL THEN
+        RAISE EXCEPTION 'Lease name and holder are required';
+    END IF;
+    -- Параллельный захват той же аренды другим экземпляром - сразу FALSE, без ожидания
+    IF NOT pg_try_advisory_xact_lock(hashtext('job_lease:' || p_name)) THEN
+        RETURN FALSE;
+    END IF;
+
+    INSERT INTO job_leases (name, holder, acquired_at, expires_at)
+    VALUES (p_name, p_holder, NOW(), NOW() + make_interval(secs => GREATEST(p_ttl_seconds, 1)))
+    ON CONFLICT (name) DO UPDATE
+    SET holder = EXCLUDED.holder,
+        acquired_at = CASE
+            WHEN job_leases.holder = EXCLUDED.holder THEN job_leases.acquired_at
+            ELSE EXCLUDED.acquired_at
+        END,
+        expires_at = EXCLUDED.expires_at
+    WHERE job_leases.holder = EXCLUDED.holder OR job_leases.expires_at < NOW()
+    RETURNING holder INTO v_holder;
+
+    RETURN v_holder IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Освобождение аренды (при остановке экземпляра), чтобы другой подхватил задачу сразу
+CREATE OR REPLACE FUNCTION release_job_lease(p_name TEXT, p_holder TEXT)
+RETURNS BOOLEAN AS $$
+BEGIN
+    DELETE FROM job_leases WHERE name = p_name AND holder = p_holder;
+    RETURN FOUND;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+INSERT INTO cache_versions (name) VALUES ('settings'), ('menu'), ('catalog')
+ON CONFLICT (name) DO NOTHING;
+
+-- Триггер уровня statement: одна запись версии на пачку изменений, имя кэша - в аргументе
+CREATE OR REPLACE FUNCTION _bump_cache_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO cache_versions (name, version, updated_at)
+    VALUES (TG_ARGV[0], 1, NOW())
+    ON CONFLICT (name) DO UPDATE
+    SET version = cache_versions.version + 1,
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_app_settings_cache_version ON app_settings;
+CREATE TRIGGER trg_app_settings_cache_version
+    AFTER INSERT OR UPDATE OR DELETE ON app_settings
+    FOR EACH STATEMENT EXECUTE FUNCTION _bump_cache_version('settings');
+
+DROP TRIGGER IF EXISTS trg_bot_buttons_cache_version ON bot_buttons;
+CREATE TRIGGER trg_bot_buttons_cache_version
+    AFTER INSERT OR UPDATE OR DELETE ON bot_buttons
+    FOR EACH STATEMENT EXECUTE FUNCTION _bump_cache_version('menu');
+
+DROP TRIGGER IF EXISTS trg_masters_cache_version ON masters;
+CREATE TRIGGER trg_masters_cache_version
+    AFTER INSERT OR UPDATE OR DELETE ON masters
+    FOR EACH STATEMENT EXECUTE FUNCTION _bump_cache_version('catalog');
+
+DROP TRIGGER IF EXISTS trg_services_cache_version ON services;
+CREATE TRIGGER trg_services_cache_version
+    AFTER INSERT OR UPDATE OR DELETE ON services
+    FOR EACH STATEMENT EXECUTE FUNCTION _bump_cache_version('catalog');
+
+DROP TRIGGER IF EXISTS trg_promotions_cache_version ON promotions;
+CREATE TRIGGER trg_promotions_cache_version
+    AFTER INSERT OR UPDATE OR DELETE ON promotions
+    FOR EACH STATEMENT EXECUTE FUNCTION _bump_cache_version('catalog');
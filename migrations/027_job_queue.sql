@@ -0,0 +1,133 @@
+-- Миграция 027: Очередь фоновых задач для отдельного процесса воркера
+-- При BACKGROUND_MODE=worker API только ставит задачи в job_queue (рассылки, платежи
+-- из вебхука YClients, обновления Telegram), а python -m bot.worker забирает их
+-- через claim_jobs (FOR UPDATE SKIP LOCKED - несколько воркеров не берут одну задачу)
+-- и отмечает результат через complete_job.
+-- Воркер периодически продлевает locked_at своих задач (heartbeat_jobs); задачи упавшего
+-- воркера возвращаются в очередь, когда locked_at старше p_stale_seconds.
+
+CREATE TABLE IF NOT EXISTS job_queue (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    locked_by TEXT,
+    locked_at TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_queue_pending ON job_queue(run_after, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_job_queue_running ON job_queue(locked_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS idx_job_queue_finished ON job_queue(finished_at) WHERE status IN ('done', 'failed');
+
+-- Забирает до p_limit готовых задач (в порядке постановки) и помечает их running
+CREATE OR REPLACE FUNCTION claim_jobs(
+    p_worker TEXT,
+    p_limit INT DEFAULT 10,
+    p_kinds TEXT[] DEFAULT NULL,
+    p_stale_seconds INT DEFAULT 300
+)
+RETURNS SETOF job_queue AS $$
+BEGIN
+    -- Задачи воркера, который перестал продлевать блокировку, снова становятся доступны;
+    -- исчерпавшие попытки (например, рассылка с max_attempts = 1) не повторяются
+    UPDATE job_queue
+    SET status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END,
+        last_error = CASE
+            WHEN attempts < max_attempts THEN last_error
+            ELSE 'Worker stopped without completing the job'
+        END,
+        finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE NOW() END,
+        locked_by = NULL,
+        locked_at = NULL
+    WHERE status = 'running'
+      AND locked_at < NOW() - make_interval(secs => GREATEST(p_stale_seconds, 1));
+
+    RETURN QUERY
+    WITH picked AS (
+        SELECT id
+        FROM job_queue
+        WHERE status = 'pending'
+          AND run_after <= NOW()
+          AND (p_kinds IS NULL OR kind = ANY(p_kinds))
+        ORDER BY id
+        LIMIT GREATEST(p_limit, 1)
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE job_queue j
+    SET status = 'running',
+        attempts = j.attempts + 1,
+        locked_by = p_worker,
+        locked_at = NOW()
+    FROM picked
+    WHERE j.id = picked.id
+    RETURNING j.*;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Результат задачи: без ошибки - done; с ошибкой - повтор через p_retry_seconds * attempts
+-- или failed после max_attempts
+CREATE OR REPLACE FUNCTION complete_job(
+    p_id BIGINT,
+    p_worker TEXT,
+    p_error TEXT DEFAULT NULL,
+    p_retry_seconds INT DEFAULT 30
+)
+RETURNS TEXT AS $$
+DECLARE
+    v_status TEXT;
+BEGIN
+    UPDATE job_queue
+    SET status = CASE
+            WHEN p_error IS NULL THEN 'done'
+            WHEN attempts < max_attempts THEN 'pending'
+            ELSE 'failed'
+        END,
+        run_after = CASE
+            WHEN p_error IS NOT NULL AND attempts < max_attempts
+                THEN NOW() + make_interval(secs => GREATEST(p_retry_seconds, 0) * attempts)
+            ELSE run_after
+        END,
+        last_error = COALESCE(p_error, last_error),
+        locked_by = NULL,
+        locked_at = NULL,
+        finished_at = CASE WHEN p_error IS NULL OR attempts >= max_attempts THEN NOW() END
+    WHERE id = p_id AND locked_by = p_worker AND status = 'running'
+    RETURNING status INTO v_status;
+
+    RETURN v_status;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Продление блокировки выполняемых задач
+CREATE OR REPLACE FUNCTION heartbeat_jobs(p_worker TEXT, p_ids BIGINT[])
+RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    UPDATE job_queue
+    SET locked_at = NOW()
+    WHERE id = ANY(p_ids) AND locked_by = p_worker AND status = 'running';
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаление завершенных задач старше p_keep_days
+CREATE OR REPLACE FUNCTION purge_finished_jobs(p_keep_days INT DEFAULT 7)
+RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    DELETE FROM job_queue
+    WHERE status IN ('done', 'failed')
+      AND finished_at < NOW() - make_interval(days => GREATEST(p_keep_days, 0));
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,63 @@
+-- Миграция 028: Состояние периодических задач планировщика
+-- Раньше синхронизация YClients спала 86400 секунд от старта процесса, а запланированные
+-- рассылки проверялись раз в минуту: перезапуск сдвигал расписание, рассылки уходили
+-- с опозданием до минуты. Теперь задачи запускаются по cron-выражениям
+-- (bot/services/scheduler.py), а время последнего запуска хранится здесь:
+-- после перезапуска пропущенный запуск выполняется сразу, остальные - по расписанию.
+-- Таблица же показывает тайминги задач в GET /api/admin/jobs.
+
+CREATE TABLE IF NOT EXISTS scheduled_jobs (
+    name TEXT PRIMARY KEY,
+    schedule TEXT,                                   -- cron-выражение или описание динамического срока
+    next_run_at TIMESTAMP WITH TIME ZONE,
+    last_started_at TIMESTAMP WITH TIME ZONE,
+    last_finished_at TIMESTAMP WITH TIME ZONE,
+    last_status TEXT CHECK (last_status IN ('running', 'ok', 'error')),
+    last_error TEXT,
+    last_duration_ms INT,
+    run_count INT NOT NULL DEFAULT 0,
+    error_count INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- События задачи:
+--   'scheduled' - обновлены расписание и время следующего запуска;
+--   'started'   - запуск начат;
+--   'finished'  - запуск завершен со статусом p_status ('ok' / 'error')
+CREATE OR REPLACE FUNCTION record_scheduled_job(
+    p_name TEXT,
+    p_event TEXT,
+    p_schedule TEXT DEFAULT NULL,
+    p_next_run_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_status TEXT DEFAULT NULL,
+    p_error TEXT DEFAULT NULL,
+    p_duration_ms INT DEFAULT NULL
+)
+RETURNS VOID AS $$
+BEGIN
+    IF p_event NOT IN ('scheduled', 'started', 'finished') THEN
+        RAISE EXCEPTION 'Invalid event: %', p_event;
+    END IF;
+
+    INSERT INTO scheduled_jobs (name, schedule, next_run_at)
+    VALUES (p_name, p_schedule, p_next_run_at)
+    ON CONFLICT (name) DO NOTHING;
+
+    UPDATE scheduled_jobs
+    SET schedule = COALESCE(p_schedule, schedule),
+        next_run_at = COALESCE(p_next_run_at, next_run_at),
+        last_started_at = CASE WHEN p_event = 'started' THEN NOW() ELSE last_started_at END,
+        last_finished_at = CASE WHEN p_event = 'finished' THEN NOW() ELSE last_finished_at END,
+        last_status = CASE
+            WHEN p_event = 'started' THEN 'running'
+            WHEN p_event = 'finished' THEN COALESCE(p_status, 'ok')
+            ELSE last_status
+        END,
+        last_error = CASE WHEN p_event = 'finished' THEN p_error ELSE last_error END,
+        last_duration_ms = CASE WHEN p_event = 'finished' THEN p_duration_ms ELSE last_duration_ms END,
+        run_count = run_count + CASE WHEN p_event = 'finished' THEN 1 ELSE 0 END,
+        error_count = error_count + CASE WHEN p_event = 'finished' AND p_status = 'error' THEN 1 ELSE 0 END,
+        updated_at = NOW()
+    WHERE name = p_name;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,110 @@
+-- Миграция 029: Приоритетная синхронизация с YClients
+-- Раньше sync_all_users раз в сутки синхронизировал всех активных пользователей одинаково:
+-- тысячи давно не появлявшихся клиентов расходовали квоту YClients, а у активных
+-- баланс обновлялся не чаще раза в день. Теперь у каждого пользователя есть срок
+-- следующей синхронизации (sync_next_due_at), а sync_all_users (bot/tasks/sync.py)
+-- выбирает должников в порядке приоритета и останавливается, исчерпав
+-- YCLIENTS_SYNC_REQUEST_BUDGET запросов.
+-- Приоритет (sync_tier):
+--   0 - запись в ближайшие p_hot_days дней или действие в боте/Mini App за p_hot_days дней;
+--   1 - действие или состоявшийся визит за p_warm_days дней, либо любая будущая запись;
+--   2 - остальные ("спящие") клиенты.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_interaction_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS sync_next_due_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS idx_users_sync_next_due_at
+    ON users(sync_next_due_at)
+    WHERE active;
+
+-- Будущие записи клиента (ожидаемые, подтвержденные, неподтвержденные)
+CREATE INDEX IF NOT EXISTS idx_yclients_visits_user_datetime
+    ON yclients_visits(user_id, visit_datetime);
+
+-- Пользователи, которым пора синхронизироваться, в порядке приоритета:
+-- уровень, ближайшая запись, насколько просрочена синхронизация, давность активности.
+-- Возвращает JSON-массив с полями, нужными sync_all_users, sync_tier, next_appointment_at и priority
+CREATE OR REPLACE FUNCTION select_sync_candidates(
+    p_limit INT,
+    p_hot_days INT DEFAULT 7,
+    p_warm_days INT DEFAULT 90
+)
+RETURNS JSON AS $$
+DECLARE
+    v_result JSON;
+BEGIN
+    WITH due AS (
+        SELECT u.*
+        FROM users u
+        WHERE u.active
+          AND (u.sync_next_due_at IS NULL OR u.sync_next_due_at <= NOW())
+    ),
+    ranked AS (
+        SELECT
+            d.id, d.phone, d.yclients_id, d.balance, d.loyalty_card_number, d.loyalty_status,
+            d.loyalty_last_sync, d.visits_last_sync, d.sync_next_due_at, d.last_interaction_at,
+            s.last_visit_at,
+            a.next_appointment_at,
+            CASE
+                WHEN a.next_appointment_at <= NOW() + make_interval(days => p_hot_days)
+                  OR d.last_interaction_at >= NOW() - make_interval(days => p_hot_days) THEN 0
+                WHEN a.next_appointment_at IS NOT NULL
+                  OR d.last_interaction_at >= NOW() - make_interval(days => p_warm_days)
+                  OR s.last_visit_at >= NOW() - make_interval(days => p_warm_days) THEN 1
+                ELSE 2
+            END AS sync_tier
+        FROM due d
+        LEFT JOIN user_visit_stats s ON s.user_id = d.id
+        LEFT JOIN LATERAL (
+            SELECT MIN(v.visit_datetime) AS next_appointment_at
+            FROM yclients_visits v
+            WHERE v.user_id = d.id
+              AND v.visit_datetime > NOW()
+              AND v.status NOT IN ('Отменено', 'Визит состоялся', 'Не пришли')
+        ) a ON TRUE
+    )
+    SELECT COALESCE(json_agg(r ORDER BY r.priority), '[]'::json)
+    INTO v_result
+    FROM (
+        SELECT ranked.*, ROW_NUMBER() OVER (ORDER BY
+            sync_tier,
+            next_appointment_at ASC NULLS LAST,
+            sync_next_due_at ASC NULLS FIRST,
+            GREATEST(last_interaction_at, last_visit_at) DESC NULLS LAST,
+            id
+        ) AS priority
+        FROM ranked
+        ORDER BY priority
+        LIMIT p_limit
+    ) r;
+
+    RETURN v_result;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- Действие пользователя в боте или Mini App: отмечаем активность и, если следующая
+-- синхронизация назначена позже, переносим ее на p_sync_due_seconds вперед
+CREATE OR REPLACE FUNCTION touch_user_interaction(p_tg_id BIGINT, p_sync_due_seconds INT)
+RETURNS VOID AS $$
+BEGIN
+    UPDATE users
+    SET last_interaction_at = NOW(),
+        sync_next_due_at = LEAST(
+            COALESCE(sync_next_due_at, NOW()),
+            NOW() + make_interval(secs => p_sync_due_seconds)
+        )
+    WHERE tg_id = p_tg_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Белый список bulk_patch (миграция 023): users.sync_next_due_at для проставления сроков пачкой
+CREATE OR REPLACE FUNCTION _bulk_patch_allowed_columns(p_table TEXT)
+RETURNS TEXT[] AS $$
+    SELECT CASE p_table
+        WHEN 'bot_buttons' THEN ARRAY['row_number', 'order_in_row', 'is_active']
+        WHEN 'masters' THEN ARRAY['order']
+        WHEN 'services' THEN ARRAY['order', 'is_active']
+        WHEN 'promotions' THEN ARRAY['order', 'is_active']
+        WHEN 'users' THEN ARRAY['sync_next_due_at']
+    END;
+$$ LANGUAGE sql IMMUTABLE;
@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from bot.services.visits import refresh_visit_stats_batch
+
+logger = logging.getLogger(__name__)
+
+
+async def run(batch_size: int, after_id: int, sleep_s: float) -> None:
+    started = time.monotonic()
+    total = 0
+    last_id = after_id
+    while True:
+        result = await refresh_visit_stats_batch(after_id=last_id, batch_size=batch_size)
+        refreshed = int(result.get("refreshed") or 0)
+        next_id = result.get("last_id")
+        if next_id is None:
+            break
+        total += refreshed
+        last_id = int(next_id)
+        logger.info("Refreshed %s users (up to id %s), %s total", refreshed, last_id, total)
+        if sleep_s > 0:
+            await asyncio.sleep(sleep_s)
+
+    logger.info("Visit stats backfill done: %s users in %.1fs", total, time.monotonic() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Recompute user_visit_stats from yclients_visits")
+    parser.add_argument("--batch-size", type=int, default=500, help="Users per RPC call")
+    parser.add_argument("--after-id", type=int, default=0, help="Resume after this user id")
+    parser.add_argument("--sleep", type=float, default=0.0, help="Delay between batches (seconds)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    asyncio.run(run(args.batch_size, args.after_id, args.sleep))
+
+
+if __name__ == "__main__":
+    main()
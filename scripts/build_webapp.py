@@ -0,0 +1,46 @@
+"""
+Сборка статики Mini App в webapp/dist: минификация script.js (если установлен rjsmin),
+хэши в именах файлов, предсжатые .gz/.br (brotli - если установлен) и manifest.json.
+
+Запускается при сборке Docker-образа; без сборки api/static_assets.py
+делает то же самое в памяти при старте.
+"""
+import argparse
+import os
+import shutil
+
+from api.static_assets import brotli, build_assets, rjsmin, write_dist
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build hashed, pre-compressed webapp assets")
+    parser.add_argument(
+        "--out",
+        default=os.path.join(PROJECT_ROOT, "webapp", "dist"),
+        help="Output directory (default: webapp/dist)",
+    )
+    args = parser.parse_args()
+
+    if os.path.isdir(args.out):
+        shutil.rmtree(args.out)
+    manifest = write_dist(build_assets(PROJECT_ROOT), args.out)
+
+    if rjsmin is None:
+        print("rjsmin not installed: script.js is not minified")
+    if brotli is None:
+        print("brotli not installed: only gzip variants are built")
+    for key, entry in manifest.items():
+        if key.startswith("/webapp/") and not key.startswith("/webapp/assets/"):
+            continue
+        sizes = ", ".join(
+            f"{encoding} {os.path.getsize(os.path.join(args.out, entry['file'] + ('.br' if encoding == 'br' else '.gz')))} B"
+            for encoding in entry["encodings"]
+        )
+        print(f"{key:<40} {entry['size']:>8} B  {sizes}")
+    print(f"Written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
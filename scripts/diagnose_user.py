@@ -68,6 +68,15 @@ async def _get_available_balance(user_id: int) -> Optional[int]:
     return None
 
 
+async def _get_balance_summary(user_id: int) -> Optional[Dict[str, Any]]:
+    try:
+        res = await supabase.table("loyalty_balances").select("*").eq("user_id", user_id).execute()
+        return res.data[0] if res.data else None
+    except Exception as exc:
+        logger.warning("Failed to load loyalty_balances: %s", exc)
+    return None
+
+
 async def _get_yclients_snapshot(user: Dict[str, Any]) -> Dict[str, Any]:
     snapshot: Dict[str, Any] = {}
     yclients_id = user.get("yclients_id")
@@ -110,6 +119,10 @@ async def run(user_id: Optional[int], tg_id: Optional[int], phone: Optional[str]
     print("\nAvailable balance (RPC):")
     print(_pretty(available_balance))
 
+    balance_summary = await _get_balance_summary(user["id"])
+    print("\nBalance summary (loyalty_balances):")
+    print(_pretty(balance_summary))
+
     if not skip_yclients:
         print("\nYClients snapshot:")
         snapshot = await _get_yclients_snapshot(user)
@@ -2,17 +2,33 @@
 Скрипт миграции изображений из внешних URL в Supabase Storage
 
 Использование:
-    python -m scripts.migrate_images [--dry-run] [--table TABLE]
+    python -m scripts.migrate_images [--dry-run] [--table TABLE] [--concurrency N]
 
 Опции:
-    --dry-run    Показать что будет сделано без реальных изменений
-    --table      Мигрировать только указанную таблицу (services|masters|promotions)
+    --dry-run       Показать что будет сделано без реальных изменений
+    --table         Мигрировать только указанную таблицу (services|masters|promotions)
+    --concurrency   Сколько изображений обрабатывать параллельно (по умолчанию 8)
+    --state-file    Файл состояния для повторных запусков (по умолчанию .migrate_images_state.json)
+    --transcode     Перекодировать изображения в webp или jpeg (нужен Pillow)
+    --max-width     При перекодировании уменьшать изображения шире указанного (px)
+    --batch-size    Сколько строк обновлять одним запросом (по умолчанию 100)
+
+Конвейер: скачивание -> проверка -> (перекодирование) -> загрузка -> пакетное обновление строк.
+Каждый внешний URL скачивается один раз, даже если он встречается в нескольких строках.
+Одинаковые по содержимому изображения (sha256) загружаются один раз на все таблицы.
+Результаты сохраняются в файл состояния: повторный запуск пропускает готовые URL.
 """
 import asyncio
 import sys
 import os
 import argparse
+import hashlib
+import json
 import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from io import BytesIO
 from typing import List, Dict, Optional, Tuple
 from urllib.parse import urlparse
 
@@ -24,14 +40,28 @@ from bot.services.storage import get_storage_service
 from bot.services.supabase_client import supabase
 from bot.config import settings
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow нужен только для проверки и --transcode
+    Image = None
+    ImageOps = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-# HTTP клиент для скачивания изображений
-http_client = httpx.AsyncClient(timeout=30.0, follow_redirects=True)
+# Таблица -> (поле с картинкой, папка в Storage)
+TABLES: Dict[str, Tuple[str, str]] = {
+    'services': ('image_url', 'services'),
+    'masters': ('photo_url', 'masters'),
+    'promotions': ('image_url', 'promotions'),
+}
+
+DEFAULT_STATE_FILE = '.migrate_images_state.json'
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+TRANSCODE_FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}
 
 
 def is_supabase_storage_url(url: str) -> bool:
@@ -42,36 +72,6 @@ def is_supabase_storage_url(url: str) -> bool:
     return url.startswith(supabase_prefix)
 
 
-async def download_image(url: str) -> Optional[bytes]:
-    """
-    Скачивает изображение по URL
-    
-    Returns:
-        Содержимое файла в байтах или None в случае ошибки
-    """
-    try:
-        logger.info(f"Downloading image from {url}")
-        response = await http_client.get(url)
-        response.raise_for_status()
-        
-        # Проверяем, что это изображение
-        content_type = response.headers.get('content-type', '')
-        if not content_type.startswith('image/'):
-            logger.warning(f"URL {url} is not an image (content-type: {content_type})")
-            return None
-        
-        return response.content
-    except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP error downloading {url}: {e.response.status_code}")
-        return None
-    except httpx.RequestError as e:
-        logger.error(f"Request error downloading {url}: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error downloading {url}: {e}", exc_info=True)
-        return None
-
-
 def get_filename_from_url(url: str) -> str:
     """Извлекает имя файла из URL"""
     parsed = urlparse(url)
@@ -82,260 +82,382 @@ def get_filename_from_url(url: str) -> str:
     return filename
 
 
-async def migrate_service(service: Dict, dry_run: bool = False) -> Tuple[bool, str]:
+class MigrationState:
     """
-    Мигрирует изображение услуги
-    
-    Returns:
-        (success, message)
+    Локальное состояние миграции:
+    urls - старый URL -> новый URL, hashes - sha256 содержимого -> новый URL,
+    failed - старый URL -> причина последней ошибки
     """
-    service_id = service['id']
-    old_url = service.get('image_url')
-    
-    if not old_url or is_supabase_storage_url(old_url):
-        return (True, f"Service {service_id}: already migrated or no image")
-    
-    if dry_run:
-        logger.info(f"[DRY-RUN] Would migrate service {service_id}: {old_url}")
-        return (True, f"Service {service_id}: would migrate")
-    
-    # Скачиваем изображение
-    image_data = await download_image(old_url)
-    if not image_data:
-        return (False, f"Service {service_id}: failed to download image")
-    
-    # Загружаем в Supabase Storage
-    filename = get_filename_from_url(old_url)
-    storage_service = get_storage_service()
-    new_url = await storage_service.upload_file(
-        file_content=image_data,
-        filename=filename,
-        folder="services"
-    )
-    
-    if not new_url:
-        return (False, f"Service {service_id}: failed to upload to Storage")
-    
-    # Обновляем URL в БД
-    try:
-        await supabase.table("services").update({"image_url": new_url}).eq("id", service_id).execute()
-        logger.info(f"Service {service_id}: migrated {old_url} -> {new_url}")
-        return (True, f"Service {service_id}: migrated successfully")
-    except Exception as e:
-        logger.error(f"Service {service_id}: failed to update DB: {e}")
-        return (False, f"Service {service_id}: failed to update DB")
 
+    def __init__(self, path: str):
+        self.path = path
+        self.urls: Dict[str, str] = {}
+        self.hashes: Dict[str, str] = {}
+        self.failed: Dict[str, str] = {}
 
-async def migrate_master(master: Dict, dry_run: bool = False) -> Tuple[bool, str]:
-    """
-    Мигрирует фото мастера
-    
-    Returns:
-        (success, message)
-    """
-    master_id = master['id']
-    old_url = master.get('photo_url')
-    
-    if not old_url or is_supabase_storage_url(old_url):
-        return (True, f"Master {master_id}: already migrated or no photo")
-    
-    if dry_run:
-        logger.info(f"[DRY-RUN] Would migrate master {master_id}: {old_url}")
-        return (True, f"Master {master_id}: would migrate")
-    
-    # Скачиваем изображение
-    image_data = await download_image(old_url)
-    if not image_data:
-        return (False, f"Master {master_id}: failed to download image")
-    
-    # Загружаем в Supabase Storage
-    filename = get_filename_from_url(old_url)
-    storage_service = get_storage_service()
-    new_url = await storage_service.upload_file(
-        file_content=image_data,
-        filename=filename,
-        folder="masters"
-    )
-    
-    if not new_url:
-        return (False, f"Master {master_id}: failed to upload to Storage")
-    
-    # Обновляем URL в БД
-    try:
-        await supabase.table("masters").update({"photo_url": new_url}).eq("id", master_id).execute()
-        logger.info(f"Master {master_id}: migrated {old_url} -> {new_url}")
-        return (True, f"Master {master_id}: migrated successfully")
-    except Exception as e:
-        logger.error(f"Master {master_id}: failed to update DB: {e}")
-        return (False, f"Master {master_id}: failed to update DB")
+    def load(self) -> 'MigrationState':
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as state_file:
+                data = json.load(state_file)
+            self.urls = data.get('urls', {})
+            self.hashes = data.get('hashes', {})
+            self.failed = data.get('failed', {})
+            logger.info(f"State loaded from {self.path}: {len(self.urls)} URLs already migrated")
+        return self
+
+    def save(self) -> None:
+        """Атомарная запись (через временный файл), чтобы прерванный запуск не испортил состояние"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as state_file:
+            json.dump(
+                {'urls': self.urls, 'hashes': self.hashes, 'failed': self.failed},
+                state_file, ensure_ascii=False, indent=2
+            )
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class MigrationStats:
+    started: float = field(default_factory=time.monotonic)
+    rows: Counter = field(default_factory=Counter)  # (table, status) -> количество строк
+    downloaded: int = 0
+    uploaded: int = 0
+    resumed: int = 0
+    deduplicated: int = 0
+    bytes_downloaded: int = 0
+    bytes_uploaded: int = 0
+    failures: Counter = field(default_factory=Counter)  # причина -> количество URL
+    failure_examples: Dict[str, str] = field(default_factory=dict)  # причина -> пример URL
 
+    def fail(self, url: str, reason: str) -> None:
+        self.failures[reason] += 1
+        self.failure_examples.setdefault(reason, url)
 
-async def migrate_promotion(promotion: Dict, dry_run: bool = False) -> Tuple[bool, str]:
+
+class ImageValidationError(Exception):
+    pass
+
+
+def validate_and_transcode(
+    content: bytes,
+    transcode: Optional[str],
+    max_width: Optional[int],
+) -> Tuple[bytes, Optional[str]]:
     """
-    Мигрирует изображение акции
-    
-    Returns:
-        (success, message)
+    Проверяет, что это читаемое изображение, и при необходимости перекодирует.
+    Выполняется в пуле потоков. Возвращает (байты, новое расширение или None).
     """
-    promotion_id = promotion['id']
-    old_url = promotion.get('image_url')
-    
-    if not old_url or is_supabase_storage_url(old_url):
-        return (True, f"Promotion {promotion_id}: already migrated or no image")
-    
-    if dry_run:
-        logger.info(f"[DRY-RUN] Would migrate promotion {promotion_id}: {old_url}")
-        return (True, f"Promotion {promotion_id}: would migrate")
-    
-    # Скачиваем изображение
-    image_data = await download_image(old_url)
-    if not image_data:
-        return (False, f"Promotion {promotion_id}: failed to download image")
-    
-    # Загружаем в Supabase Storage
-    filename = get_filename_from_url(old_url)
-    storage_service = get_storage_service()
-    new_url = await storage_service.upload_file(
-        file_content=image_data,
-        filename=filename,
-        folder="promotions"
-    )
-    
-    if not new_url:
-        return (False, f"Promotion {promotion_id}: failed to upload to Storage")
-    
-    # Обновляем URL в БД
+    if Image is None:
+        return content, None
     try:
-        await supabase.table("promotions").update({"image_url": new_url}).eq("id", promotion_id).execute()
-        logger.info(f"Promotion {promotion_id}: migrated {old_url} -> {new_url}")
-        return (True, f"Promotion {promotion_id}: migrated successfully")
+        with Image.open(BytesIO(content)) as probe:
+            probe.verify()
     except Exception as e:
-        logger.error(f"Promotion {promotion_id}: failed to update DB: {e}")
-        return (False, f"Promotion {promotion_id}: failed to update DB")
+        raise ImageValidationError(f"not a readable image ({type(e).__name__})")
+    if not transcode:
+        return content, None
+
+    image_format, ext = TRANSCODE_FORMATS[transcode]
+    with Image.open(BytesIO(content)) as source:
+        image = ImageOps.exif_transpose(source)
+        if max_width and image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height), Image.LANCZOS)
+        if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB' if image_format == 'JPEG' else 'RGBA')
+        output = BytesIO()
+        image.save(output, image_format, quality=85)
+    return output.getvalue(), ext
+
+
+class ImageMigrator:
+    """Конвейер миграции с ограничением параллелизма"""
+
+    def __init__(
+        self,
+        state: MigrationState,
+        stats: MigrationStats,
+        concurrency: int = 8,
+        transcode: Optional[str] = None,
+        max_width: Optional[int] = None,
+    ):
+        self.state = state
+        self.stats = stats
+        self.transcode = transcode
+        self.max_width = max_width
+        self.storage = get_storage_service()
+        self.http_client = httpx.AsyncClient(
+            timeout=30.0,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=max(concurrency, 1)),
+        )
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        # Загрузки по хэшу в процессе: одинаковые файлы ждут первую загрузку
+        self._uploads: Dict[str, asyncio.Future] = {}
+
+    async def close(self) -> None:
+        await self.http_client.aclose()
+
+    async def download_image(self, url: str) -> bytes:
+        """Скачивает изображение; ошибки - ImageValidationError с короткой причиной"""
+        try:
+            async with self.http_client.stream('GET', url) as response:
+                response.raise_for_status()
+                # Проверяем, что это изображение
+                content_type = response.headers.get('content-type', '')
+                if not content_type.startswith('image/'):
+                    raise ImageValidationError(f"not an image (content-type: {content_type or 'none'})")
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > MAX_IMAGE_BYTES:
+                        raise ImageValidationError(f"larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+                    chunks.append(chunk)
+        except httpx.HTTPStatusError as e:
+            raise ImageValidationError(f"HTTP {e.response.status_code}")
+        except httpx.RequestError as e:
+            raise ImageValidationError(f"request error ({type(e).__name__})")
+        content = b''.join(chunks)
+        if not content:
+            raise ImageValidationError("empty response")
+        self.stats.downloaded += 1
+        self.stats.bytes_downloaded += len(content)
+        return content
+
+    async def _upload_once(self, digest: str, content: bytes, filename: str, folder: str) -> Optional[str]:
+        """Загружает содержимое с данным хэшем ровно один раз за запуск"""
+        if digest in self.state.hashes:
+            self.stats.deduplicated += 1
+            return self.state.hashes[digest]
+        pending = self._uploads.get(digest)
+        if pending is not None:
+            self.stats.deduplicated += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._uploads[digest] = future
+        try:
+            ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'jpg'
+            # Путь по хэшу: повторная загрузка того же файла перезапишет тот же объект
+            new_url = await self.storage.upload_file(
+                file_content=content,
+                filename=filename,
+                folder=folder,
+                file_path=f"{folder}/{digest[:32]}.{ext}",
+            )
+            if new_url:
+                self.state.hashes[digest] = new_url
+                self.stats.uploaded += 1
+                self.stats.bytes_uploaded += len(content)
+            future.set_result(new_url)
+            return new_url
+        except BaseException:
+            # Ожидающие этот хэш получат None и запишут ошибку загрузки
+            future.set_result(None)
+            raise
+        finally:
+            self._uploads.pop(digest, None)
+
+    async def migrate_url(self, old_url: str, folder: str) -> Optional[str]:
+        """Один внешний URL: скачивание -> проверка -> перекодирование -> загрузка"""
+        async with self._semaphore:
+            try:
+                content = await self.download_image(old_url)
+                digest = hashlib.sha256(content).hexdigest()
+                filename = get_filename_from_url(old_url)
+                if digest not in self.state.hashes and digest not in self._uploads:
+                    content, ext = await asyncio.to_thread(
+                        validate_and_transcode, content, self.transcode, self.max_width
+                    )
+                    if ext:
+                        filename = f"{filename.rsplit('.', 1)[0]}.{ext}"
+                new_url = await self._upload_once(digest, content, filename, folder)
+            except ImageValidationError as e:
+                reason = str(e)
+            except Exception as e:
+                logger.error(f"Unexpected error migrating {old_url}: {e}", exc_info=True)
+                reason = f"unexpected error ({type(e).__name__})"
+            else:
+                if new_url:
+                    self.state.urls[old_url] = new_url
+                    self.state.failed.pop(old_url, None)
+                    self.state.save()
+                    logger.info(f"Migrated {old_url} -> {new_url}")
+                    return new_url
+                reason = "upload to Storage failed"
+
+        self.stats.fail(old_url, reason)
+        self.state.failed[old_url] = reason
+        self.state.save()
+        logger.warning(f"Failed {old_url}: {reason}")
+        return None
+
+
+async def load_rows(tables: List[str]) -> Dict[str, List[Dict]]:
+    """Строки с картинками по таблицам (только id и поле картинки)"""
+    rows: Dict[str, List[Dict]] = {}
+    for table in tables:
+        image_field, _ = TABLES[table]
+        res = await supabase.table(table).select(f"id,{image_field}").execute()
+        rows[table] = res.data or []
+    return rows
+
+
+async def apply_updates(
+    updates: Dict[Tuple[str, str, str], List],
+    batch_size: int,
+    stats: MigrationStats,
+) -> None:
+    """Обновляет строки пачками: один PATCH ... id=in.(...) на (таблица, новый URL)"""
+    for (table, image_field, new_url), ids in updates.items():
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            try:
+                await supabase.table(table).update({image_field: new_url}).in_("id", chunk).execute()
+                stats.rows[(table, 'migrated')] += len(chunk)
+            except Exception as e:
+                logger.error(f"{table}: failed to update rows {chunk}: {e}")
+                stats.rows[(table, 'failed')] += len(chunk)
+                stats.fail(new_url, "database update failed")
+
+
+def log_summary(stats: MigrationStats, tables: List[str], dry_run: bool) -> None:
+    elapsed = max(time.monotonic() - stats.started, 1e-6)
+    logger.info("")
+    logger.info("=" * 60)
+    logger.info("Migration Summary")
+    logger.info("=" * 60)
+    for table in tables:
+        total = sum(count for (name, _), count in stats.rows.items() if name == table)
+        if not total:
+            continue
+        logger.info(f"{table.capitalize()}:")
+        logger.info(f"  Total: {total}")
+        logger.info(f"  {'Would migrate' if dry_run else 'Success'}: {stats.rows[(table, 'migrated')]}")
+        logger.info(f"  Failed: {stats.rows[(table, 'failed')]}")
+        logger.info(f"  Skipped: {stats.rows[(table, 'skipped')]}")
+        logger.info("")
 
+    if not dry_run:
+        logger.info(
+            f"Images: {stats.downloaded} downloaded, {stats.uploaded} uploaded, "
+            f"{stats.deduplicated} deduplicated by content, {stats.resumed} resumed from state"
+        )
+        logger.info(
+            f"Throughput: {stats.downloaded / elapsed:.2f} images/s, "
+            f"{stats.bytes_downloaded / elapsed / (1024 * 1024):.2f} MB/s downloaded, "
+            f"{stats.bytes_uploaded / (1024 * 1024):.1f} MB uploaded in {elapsed:.1f}s"
+        )
+        if stats.failures:
+            logger.info("Failures:")
+            for reason, count in stats.failures.most_common():
+                logger.info(f"  {count} x {reason} (e.g. {stats.failure_examples[reason]})")
+
+    total_success = sum(count for (_, status), count in stats.rows.items() if status == 'migrated')
+    total_failed = sum(count for (_, status), count in stats.rows.items() if status == 'failed')
+    total_skipped = sum(count for (_, status), count in stats.rows.items() if status == 'skipped')
+    logger.info(f"Overall: {total_success} migrated, {total_failed} failed, {total_skipped} skipped")
+    logger.info("=" * 60)
 
-async def migrate_all(dry_run: bool = False, table: Optional[str] = None):
+
+async def migrate_all(
+    dry_run: bool = False,
+    table: Optional[str] = None,
+    concurrency: int = 8,
+    state_file: str = DEFAULT_STATE_FILE,
+    transcode: Optional[str] = None,
+    max_width: Optional[int] = None,
+    batch_size: int = 100,
+):
     """Выполняет миграцию всех изображений"""
-    
+
     logger.info("=" * 60)
     logger.info("Image Migration Script")
     logger.info("=" * 60)
-    
+
     # Проверка конфигурации
     if not settings.SUPABASE_URL:
         logger.error("SUPABASE_URL not configured!")
         sys.exit(1)
-    
+
     if not settings.SUPABASE_STORAGE_S3_ENDPOINT:
         logger.error("SUPABASE_STORAGE_S3_ENDPOINT not configured!")
         sys.exit(1)
-    
+
     if not settings.SUPABASE_STORAGE_ACCESS_KEY or not settings.SUPABASE_STORAGE_SECRET_KEY:
         logger.error("Supabase Storage credentials not configured!")
         sys.exit(1)
-    
+
+    if transcode and Image is None:
+        logger.error("--transcode requires Pillow (pip install Pillow)")
+        sys.exit(1)
+
     if dry_run:
         logger.info("DRY-RUN MODE: No changes will be made")
     else:
         logger.warning("LIVE MODE: Changes will be made to the database!")
         logger.warning("Make sure you have a database backup!")
-    
-    logger.info("")
-    
-    # Статистика
-    stats = {
-        'services': {'total': 0, 'success': 0, 'failed': 0, 'skipped': 0},
-        'masters': {'total': 0, 'success': 0, 'failed': 0, 'skipped': 0},
-        'promotions': {'total': 0, 'success': 0, 'failed': 0, 'skipped': 0}
-    }
-    
-    # Миграция услуг
-    if not table or table == 'services':
-        logger.info("Migrating services...")
-        try:
-            services_res = await supabase.table("services").select("*").execute()
-            services = services_res.data if services_res.data else []
-            
-            for service in services:
-                stats['services']['total'] += 1
-                success, message = await migrate_service(service, dry_run)
-                
-                if 'already migrated' in message or 'no image' in message:
-                    stats['services']['skipped'] += 1
-                elif success:
-                    stats['services']['success'] += 1
-                else:
-                    stats['services']['failed'] += 1
-                
-                logger.info(f"  {message}")
-        except Exception as e:
-            logger.error(f"Error migrating services: {e}", exc_info=True)
-    
-    # Миграция мастеров
-    if not table or table == 'masters':
-        logger.info("Migrating masters...")
-        try:
-            masters_res = await supabase.table("masters").select("*").execute()
-            masters = masters_res.data if masters_res.data else []
-            
-            for master in masters:
-                stats['masters']['total'] += 1
-                success, message = await migrate_master(master, dry_run)
-                
-                if 'already migrated' in message or 'no photo' in message:
-                    stats['masters']['skipped'] += 1
-                elif success:
-                    stats['masters']['success'] += 1
-                else:
-                    stats['masters']['failed'] += 1
-                
-                logger.info(f"  {message}")
-        except Exception as e:
-            logger.error(f"Error migrating masters: {e}", exc_info=True)
-    
-    # Миграция акций
-    if not table or table == 'promotions':
-        logger.info("Migrating promotions...")
-        try:
-            promotions_res = await supabase.table("promotions").select("*").execute()
-            promotions = promotions_res.data if promotions_res.data else []
-            
-            for promotion in promotions:
-                stats['promotions']['total'] += 1
-                success, message = await migrate_promotion(promotion, dry_run)
-                
-                if 'already migrated' in message or 'no image' in message:
-                    stats['promotions']['skipped'] += 1
-                elif success:
-                    stats['promotions']['success'] += 1
-                else:
-                    stats['promotions']['failed'] += 1
-                
-                logger.info(f"  {message}")
-        except Exception as e:
-            logger.error(f"Error migrating promotions: {e}", exc_info=True)
-    
-    # Выводим статистику
+
     logger.info("")
-    logger.info("=" * 60)
-    logger.info("Migration Summary")
-    logger.info("=" * 60)
-    
-    for table_name, table_stats in stats.items():
-        if table_stats['total'] > 0:
-            logger.info(f"{table_name.capitalize()}:")
-            logger.info(f"  Total: {table_stats['total']}")
-            logger.info(f"  Success: {table_stats['success']}")
-            logger.info(f"  Failed: {table_stats['failed']}")
-            logger.info(f"  Skipped: {table_stats['skipped']}")
-            logger.info("")
-    
-    total_success = sum(s['success'] for s in stats.values())
-    total_failed = sum(s['failed'] for s in stats.values())
-    total_skipped = sum(s['skipped'] for s in stats.values())
-    
-    logger.info(f"Overall: {total_success} migrated, {total_failed} failed, {total_skipped} skipped")
-    logger.info("=" * 60)
+
+    tables = [table] if table else list(TABLES)
+    state = MigrationState(state_file).load()
+    stats = MigrationStats()
+    rows = await load_rows(tables)
+
+    # Внешний URL -> строки, которые на него ссылаются (и папка первой из них)
+    pending: Dict[str, List[Tuple[str, str, object]]] = {}
+    folders: Dict[str, str] = {}
+    updates: Dict[Tuple[str, str, str], List] = {}
+    for table_name in tables:
+        image_field, folder = TABLES[table_name]
+        for row in rows[table_name]:
+            old_url = row.get(image_field)
+            if not old_url or is_supabase_storage_url(old_url):
+                stats.rows[(table_name, 'skipped')] += 1
+                continue
+            if old_url in state.urls:
+                # Уже загружено прошлым запуском, осталось обновить строку
+                stats.resumed += 1
+                updates.setdefault((table_name, image_field, state.urls[old_url]), []).append(row['id'])
+                continue
+            pending.setdefault(old_url, []).append((table_name, image_field, row['id']))
+            folders.setdefault(old_url, folder)
+
+    logger.info(
+        f"{sum(len(refs) for refs in pending.values())} rows reference {len(pending)} external URLs, "
+        f"{stats.resumed} rows resumed from {state_file}"
+    )
+
+    if dry_run:
+        for old_url, refs in pending.items():
+            logger.info(f"[DRY-RUN] Would migrate {old_url} ({len(refs)} rows)")
+            for table_name, _, _ in refs:
+                stats.rows[(table_name, 'migrated')] += 1
+        for (table_name, _, _), ids in updates.items():
+            stats.rows[(table_name, 'migrated')] += len(ids)
+        log_summary(stats, tables, dry_run)
+        return
+
+    migrator = ImageMigrator(state, stats, concurrency, transcode, max_width)
+    await migrator.storage.start()
+    try:
+        urls = list(pending)
+        results = await asyncio.gather(*(migrator.migrate_url(url, folders[url]) for url in urls))
+    finally:
+        await migrator.close()
+        await migrator.storage.close()
+
+    for old_url, new_url in zip(urls, results):
+        for table_name, image_field, row_id in pending[old_url]:
+            if new_url:
+                updates.setdefault((table_name, image_field, new_url), []).append(row_id)
+            else:
+                stats.rows[(table_name, 'failed')] += 1
+
+    await apply_updates(updates, max(batch_size, 1), stats)
+    log_summary(stats, tables, dry_run)
 
 
 async def main():
@@ -350,21 +472,54 @@ async def main():
     )
     parser.add_argument(
         '--table',
-        choices=['services', 'masters', 'promotions'],
+        choices=list(TABLES),
         help='Migrate only specified table'
     )
-    
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        help='Images processed in parallel'
+    )
+    parser.add_argument(
+        '--state-file',
+        default=DEFAULT_STATE_FILE,
+        help='State file for resuming (old URL -> new URL, content hashes)'
+    )
+    parser.add_argument(
+        '--transcode',
+        choices=list(TRANSCODE_FORMATS),
+        help='Re-encode images to this format before upload (requires Pillow)'
+    )
+    parser.add_argument(
+        '--max-width',
+        type=int,
+        help='With --transcode: downscale images wider than this (px)'
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=100,
+        help='Rows updated per database request'
+    )
+
     args = parser.parse_args()
-    
+
     try:
-        await migrate_all(dry_run=args.dry_run, table=args.table)
+        await migrate_all(
+            dry_run=args.dry_run,
+            table=args.table,
+            concurrency=args.concurrency,
+            state_file=args.state_file,
+            transcode=args.transcode,
+            max_width=args.max_width,
+            batch_size=args.batch_size,
+        )
     except KeyboardInterrupt:
         logger.info("\nMigration interrupted by user")
     except Exception as e:
         logger.error(f"Fatal error: {e}", exc_info=True)
         sys.exit(1)
-    finally:
-        await http_client.aclose()
 
 
 if __name__ == '__main__':
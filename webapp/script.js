@@ -66,6 +66,29 @@ function safeUrl(value, allowRelative = true) {
     return '';
 }
 
+function safeSrcset(value) {
+    // "url 160w, url 480w" -> каждый URL через safeUrl
+    return String(value ?? '').split(',').map(part => {
+        const [url, descriptor] = part.trim().split(/\s+/);
+        const safe = safeUrl(url);
+        return safe && descriptor ? `${safe} ${descriptor}` : '';
+    }).filter(Boolean).join(', ');
+}
+
+function responsiveImage(item, field, sizes, attrs) {
+    // Адаптивная картинка: WebP-варианты + JPEG fallback из image_srcset (/api/app/content)
+    const srcset = item?.image_srcset?.[field] || {};
+    const original = safeUrl(item?.[field]);
+    const src = safeUrl(srcset.src) || original;
+    if (!src) return '';
+    const webp = safeSrcset(srcset.webp);
+    const jpeg = safeSrcset(srcset.jpeg);
+    const sizesAttr = escapeAttr(sizes);
+    const img = `<img src="${escapeAttr(src)}"${jpeg ? ` srcset="${escapeAttr(jpeg)}" sizes="${sizesAttr}"` : ''} ${attrs}>`;
+    if (!webp) return img;
+    return `<picture class="contents"><source type="image/webp" srcset="${escapeAttr(webp)}" sizes="${sizesAttr}">${img}</picture>`;
+}
+
 function encodeId(value) {
     try {
         return encodeURIComponent(String(value ?? ''));
@@ -439,7 +462,7 @@ function renderPromotions(promos) {
         return `
         <div class="min-w-[300px] h-[200px] relative rounded-[28px] overflow-hidden shadow-card active:scale-[0.98] transition-transform snap-center group border border-white/40">
             ${imageUrl ? `
-                <img src="${escapeAttr(imageUrl)}" class="w-full h-full object-cover transition-transform duration-700 group-hover:scale-105" loading="lazy" alt="${title}">
+                ${responsiveImage(p, 'image_url', '300px', `class="w-full h-full object-cover transition-transform duration-700 group-hover:scale-105" loading="lazy" alt="${title}"`)}
                 <div class="absolute inset-0 bg-gradient-to-t from-black/80 via-black/20 to-transparent"></div>
             ` : `
                 <div class="absolute inset-0 bg-gradient-to-br from-[#E8A8B4] via-[#F5CED6] to-[#FCE4EC]"></div>
@@ -479,7 +502,7 @@ function renderServices(services) {
             <!-- Изображение услуги -->
             ${imageUrl ? `
                 <div class="h-[140px] w-full bg-stone-100 relative overflow-hidden flex-shrink-0">
-                    <img src="${escapeAttr(imageUrl)}" class="w-full h-full object-cover transition-transform duration-700 group-hover:scale-110" loading="lazy" alt="${title}">
+                    ${responsiveImage(s, 'image_url', '50vw', `class="w-full h-full object-cover transition-transform duration-700 group-hover:scale-110" loading="lazy" alt="${title}"`)}
                     <div class="absolute inset-0 bg-gradient-to-t from-white/10 to-transparent"></div>
                 </div>
             ` : `
@@ -528,7 +551,7 @@ function renderMasters(masters) {
             <!-- Фото мастера с ореолом -->
             <div class="absolute inset-0 bg-stone-200 rounded-[32px] overflow-hidden" style="box-shadow: 0 0 0 1px rgba(255, 255, 255, 0.8), 0 15px 35px -10px rgba(232, 168, 180, 0.5), 0 10px 20px -5px rgba(0, 0, 0, 0.1);">
                 ${photoUrl ? `
-                    <img src="${escapeAttr(photoUrl)}" class="w-full h-full object-cover transition-transform duration-1000 group-hover:scale-110" loading="lazy" alt="${name}">
+                    ${responsiveImage(m, 'photo_url', '260px', `class="w-full h-full object-cover transition-transform duration-1000 group-hover:scale-110" loading="lazy" alt="${name}"`)}
                     <div class="absolute inset-0 bg-gradient-to-t from-black/80 via-black/40 to-transparent opacity-90 group-hover:opacity-80 transition-opacity duration-500"></div>
                 ` : `
                     <div class="w-full h-full flex items-center justify-center text-5xl bg-gradient-to-br from-brand-light/30 via-brand-bg to-brand-primary/20">
@@ -1390,6 +1413,13 @@ function renderAdminList() {
             const levelClass = level === 'vip' ? 'bg-yellow-100 text-yellow-800' : level === 'regular' ? 'bg-blue-100 text-blue-800' : 'bg-stone-100 text-stone-600';
             const levelLabel = level === 'vip' ? 'VIP' : level === 'regular' ? 'Regular' : 'New';
             const inactiveBadge = item.active ? '' : '<span class="text-xs px-2.5 py-1 rounded-full bg-rose-100 text-rose-600 font-medium">Неактивен</span>';
+            const stats = item.user_visit_stats || {};
+            const visitCount = safeNumber(stats.visit_count, 0);
+            const lastVisit = stats.last_visit_at ? new Date(stats.last_visit_at) : null;
+            const lastVisitText = lastVisit && !isNaN(lastVisit) ? ` · ${lastVisit.toLocaleDateString('ru-RU')}` : '';
+            const visitsBadge = visitCount > 0
+                ? `<span class="text-xs px-2.5 py-1 rounded-full bg-stone-100 text-stone-600 font-medium truncate">Визитов: ${visitCount}${lastVisitText}</span>`
+                : '';
             return `
             <div class="bg-white p-5 rounded-[28px] border border-white/50 shadow-card active:scale-[0.98] transition-transform" onclick="openUserModal('${safeId}')">
                 <div class="flex items-center gap-4 mb-3">
@@ -1407,6 +1437,7 @@ function renderAdminList() {
                 </div>
                 <div class="flex items-center gap-2 pt-3 border-t border-stone-100">
                     <span class="text-xs px-2.5 py-1 rounded-full font-medium ${levelClass}">${levelLabel}</span>
+                    ${visitsBadge}
                     ${inactiveBadge}
                 </div>
             </div>
@@ -1990,7 +2021,54 @@ function renderFormFields(item = {}) {
                     <option value="all" ${safe.recipientType === 'all' ? 'selected' : ''}>Все пользователи</option>
                     <option value="selected" ${safe.recipientType === 'selected' ? 'selected' : ''}>Выбранные пользователи</option>
                     <option value="by_balance" ${safe.recipientType === 'by_balance' ? 'selected' : ''}>По балансу баллов</option>
+                    <option value="segment" ${safe.recipientType === 'segment' ? 'selected' : ''}>По сегменту</option>
                 </select>
+                <p id="broadcast-audience" class="text-xs text-stone-500 mt-1 px-1"></p>
+            </div>
+            <div id="segment-filter" class="hidden space-y-3">
+                <div>
+                    <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Баллы</label>
+                    <div class="grid grid-cols-2 gap-2">
+                        <input type="number" name="segment_balance_min" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="От">
+                        <input type="number" name="segment_balance_max" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="До">
+                    </div>
+                </div>
+                <div>
+                    <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Дата регистрации</label>
+                    <div class="grid grid-cols-2 gap-2">
+                        <input type="date" name="segment_registered_from" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="От">
+                        <input type="date" name="segment_registered_to" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="До">
+                    </div>
+                </div>
+                <div>
+                    <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Последний визит</label>
+                    <div class="grid grid-cols-2 gap-2">
+                        <input type="date" name="segment_last_visit_from" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="От">
+                        <input type="date" name="segment_last_visit_to" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="До">
+                    </div>
+                </div>
+                <div>
+                    <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Число визитов</label>
+                    <div class="grid grid-cols-2 gap-2">
+                        <input type="number" name="segment_visits_min" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="От">
+                        <input type="number" name="segment_visits_max" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="До">
+                    </div>
+                </div>
+                <div>
+                    <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Сумма визитов, ₽</label>
+                    <div class="grid grid-cols-2 gap-2">
+                        <input type="number" name="segment_spent_min" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="От">
+                        <input type="number" name="segment_spent_max" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="До">
+                    </div>
+                </div>
+                <div>
+                    <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Мастера (через запятую)</label>
+                    <input type="text" name="segment_masters" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="Не указано">
+                </div>
+                <div>
+                    <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Услуги (через запятую)</label>
+                    <input type="text" name="segment_services" class="w-full bg-stone-50 border border-stone-100 rounded-xl px-4 py-3 text-sm" placeholder="Не указано">
+                </div>
             </div>
             <div id="selected-users-container" class="hidden">
                 <label class="block text-xs font-bold text-stone-400 uppercase mb-1 px-1">Выберите пользователей</label>
@@ -2070,7 +2148,10 @@ function renderFormFields(item = {}) {
         const balanceFilterMax = document.getElementById('balance-filter-max');
         const selectedUsersContainer = document.getElementById('selected-users-container');
         
+        const segmentFilter = document.getElementById('segment-filter');
+        
         const toggleFilters = async () => {
+            segmentFilter.classList.toggle('hidden', recipientType.value !== 'segment');
             if (recipientType.value === 'by_balance') {
                 balanceFilter.classList.remove('hidden');
                 balanceFilterMax.classList.remove('hidden');
@@ -2085,9 +2166,12 @@ function renderFormFields(item = {}) {
                 balanceFilterMax.classList.add('hidden');
                 selectedUsersContainer.classList.add('hidden');
             }
+            scheduleBroadcastAudiencePreview();
         };
         
         recipientType.addEventListener('change', toggleFilters);
+        fieldsEl.addEventListener('input', scheduleBroadcastAudiencePreview);
+        fieldsEl.addEventListener('change', scheduleBroadcastAudiencePreview);
         toggleFilters();
         
         // Обработчик загрузки изображения для рассылок
@@ -2159,6 +2243,88 @@ async function loadUsersForSelection(selectedIds = []) {
     }
 }
 
+// Поля формы рассылки -> тело запроса (recipient_type, recipient_ids, filter_*, segment)
+function collectBroadcastRecipients(formData) {
+    const data = { recipient_type: formData.get('recipient_type') };
+    if (data.recipient_type === 'selected') {
+        const recipientIdsInput = document.getElementById('broadcast-recipient-ids');
+        try {
+            data.recipient_ids = recipientIdsInput && recipientIdsInput.value ? JSON.parse(recipientIdsInput.value) : [];
+        } catch (e) {
+            data.recipient_ids = [];
+        }
+    } else {
+        data.recipient_ids = [];
+    }
+
+    if (data.recipient_type === 'by_balance') {
+        const min = formData.get('filter_balance_min');
+        const max = formData.get('filter_balance_max');
+        if (min) data.filter_balance_min = parseInt(min);
+        if (max) data.filter_balance_max = parseInt(max);
+    }
+
+    if (data.recipient_type === 'segment') {
+        const segment = {};
+        const numberFields = ['balance_min', 'balance_max', 'visits_min', 'visits_max', 'spent_min', 'spent_max'];
+        const dateFields = ['registered_from', 'registered_to', 'last_visit_from', 'last_visit_to'];
+        numberFields.forEach((key) => {
+            const value = formData.get(`segment_${key}`);
+            if (value !== null && value !== '') segment[key] = Number(value);
+        });
+        dateFields.forEach((key) => {
+            const value = formData.get(`segment_${key}`);
+            if (value) segment[key] = value;
+        });
+        ['masters', 'services'].forEach((key) => {
+            const names = String(formData.get(`segment_${key}`) || '')
+                .split(',')
+                .map((name) => name.trim())
+                .filter(Boolean);
+            if (names.length) segment[key] = names;
+        });
+        data.segment = segment;
+    }
+    return data;
+}
+
+let broadcastAudienceTimer = null;
+let broadcastAudienceRequest = 0;
+
+function scheduleBroadcastAudiencePreview() {
+    clearTimeout(broadcastAudienceTimer);
+    broadcastAudienceTimer = setTimeout(updateBroadcastAudiencePreview, 400);
+}
+
+// Размер аудитории до отправки (POST /api/admin/broadcasts/preview)
+async function updateBroadcastAudiencePreview() {
+    const audienceEl = document.getElementById('broadcast-audience');
+    const form = document.getElementById('admin-form');
+    if (!audienceEl || !form) return;
+    const requestId = ++broadcastAudienceRequest;
+    audienceEl.textContent = 'Считаем получателей...';
+    try {
+        const response = await fetch(`${window.location.origin}/api/admin/broadcasts/preview`, {
+            method: 'POST',
+            headers: {
+                'X-Tg-Init-Data': tg.initData || '',
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(collectBroadcastRecipients(new FormData(form)))
+        });
+        if (requestId !== broadcastAudienceRequest) return;
+        if (!response.ok) {
+            const error = await response.json().catch(() => ({}));
+            audienceEl.textContent = response.status === 400 && error.detail ? `Ошибка в фильтрах: ${error.detail}` : '';
+            return;
+        }
+        const result = await response.json();
+        audienceEl.textContent = `Получателей: ${safeNumber(result.count, 0)}`;
+    } catch (error) {
+        if (requestId === broadcastAudienceRequest) audienceEl.textContent = '';
+    }
+}
+
 function updateBroadcastRecipients() {
     const checkboxes = document.querySelectorAll('#users-list input[type="checkbox"]:checked');
     const selectedIds = Array.from(checkboxes).map(cb => {
@@ -2465,7 +2631,7 @@ async function openPromotionDetail(promotionId) {
         content.innerHTML = `
             ${imageUrl ? `
                 <div class="mb-6 -mx-6 -mt-6">
-                    <img src="${escapeAttr(imageUrl)}" class="w-full h-48 object-cover" alt="${escapeHtml(promotion.title)}">
+                    ${responsiveImage(promotion, 'image_url', '100vw', `class="w-full h-48 object-cover" alt="${escapeHtml(promotion.title)}"`)}
                 </div>
             ` : ''}
             
@@ -2739,7 +2905,7 @@ async function handleAdminSubmit(e) {
     // Специальная обработка для рассылок
     if (currentAdminTab === 'broadcasts') {
         data.message = formData.get('message');
-        data.recipient_type = formData.get('recipient_type');
+        Object.assign(data, collectBroadcastRecipients(formData));
         data.image_url = formData.get('image_url') || null;
         
         // Обработка scheduled_at
@@ -2754,29 +2920,6 @@ async function handleAdminSubmit(e) {
             data.scheduled_at = null;
         }
         
-        // Обработка recipient_ids для выбранных пользователей
-        if (data.recipient_type === 'selected') {
-            const recipientIdsInput = document.getElementById('broadcast-recipient-ids');
-            if (recipientIdsInput && recipientIdsInput.value) {
-                try {
-                    data.recipient_ids = JSON.parse(recipientIdsInput.value);
-                } catch (e) {
-                    data.recipient_ids = [];
-                }
-            } else {
-                data.recipient_ids = [];
-            }
-        } else {
-            data.recipient_ids = [];
-        }
-
-        if (data.recipient_type === 'by_balance') {
-            const min = formData.get('filter_balance_min');
-            const max = formData.get('filter_balance_max');
-            if (min) data.filter_balance_min = parseInt(min);
-            if (max) data.filter_balance_max = parseInt(max);
-        }
-        
         try {
             const response = await fetch(`${window.location.origin}/api/admin/broadcasts`, {
                 method: 'POST',
@@ -2895,6 +3038,8 @@ async function viewBroadcast(id) {
             recipientInfo = `По балансу: ${broadcast.filter_balance_min || 0} - ${broadcast.filter_balance_max || '∞'} баллов`;
         } else if (broadcast.recipient_type === 'by_date') {
             recipientInfo = 'По дате регистрации';
+        } else if (broadcast.recipient_type === 'segment') {
+            recipientInfo = 'По сегменту';
         }
         
         // Создаем модальное окно с деталями